@@ -1,11 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import User
+from .pagination import EstimatedCountPaginator
 from simple_history.admin import SimpleHistoryAdmin
 
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin, SimpleHistoryAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) behind "N total" links.
+    show_full_result_count = False
     list_display = (
         "username",
         "email",
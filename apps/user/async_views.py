@@ -0,0 +1,229 @@
+from functools import wraps
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, Group
+from django.http import HttpResponse, HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.models import TokenUser
+
+from apps.user.cache import aget_user_permissions, auser_has_perms
+from apps.user.pagination import UserCursorPagination
+from apps.user.permissions import CustomPermission
+from apps.user.rollup import asignup_series, atotal_signups
+from apps.user.versions import aconditional_response, aget_versions, user_version_keys
+from apps.user.views import (
+    dashboard_data,
+    parse_dashboard_params,
+    UserViewSet,
+    permission_codenames,
+    visible_users,
+)
+
+from .models import User
+from .serializers import (
+    MyTokenObtainPairSerializer,
+    UserSerializer,
+    UserSerializerWithNames,
+    UserValuesSerializer,
+)
+
+
+def render(data, status: int = 200) -> HttpResponse:
+    return HttpResponse(
+        JSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+def get_authenticators():
+    return [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+
+async def authenticate(request):
+    """
+    Return ``(user, auth)`` from the first authenticator that accepts the
+    request, like DRF's Request.user, but awaiting each authenticator.
+    """
+    for authenticator in get_authenticators():
+        result = await authenticator.aauthenticate(request)
+        if result is not None:
+            return result
+    return AnonymousUser(), None
+
+
+def error_response(request, exc: exceptions.APIException) -> HttpResponse:
+    """
+    Render ``exc`` the way DRF's default exception handler does.
+    """
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {"detail": exc.detail}
+    status = exc.status_code
+    header = None
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        header = get_authenticators()[0].authenticate_header(request)
+        if not header:
+            status = 403
+    response = render(data, status)
+    if header:
+        response["WWW-Authenticate"] = header
+    if getattr(exc, "wait", None):
+        response["Retry-After"] = "%d" % exc.wait
+    return response
+
+
+def async_api(model=None, methods: Iterable[str] = ("GET", "HEAD"), authenticated=True):
+    """
+    Wrap an async handler with authentication and permission checks.
+
+    Requests must be authenticated unless ``authenticated`` is False, in
+    which case credentials are not even read (like a view with no
+    authentication_classes); with ``model`` set, the user also needs the
+    CustomPermission model permission for the method. The handler receives
+    a DRF Request and returns the data to render (or a response).
+    """
+
+    def decorator(handler):
+        @csrf_exempt
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                user, auth = AnonymousUser(), None
+                if authenticated:
+                    user, auth = await authenticate(request)
+                    if not user.is_authenticated:
+                        raise exceptions.NotAuthenticated()
+                if model is not None:
+                    perms = CustomPermission().get_required_permissions(
+                        request.method, model
+                    )
+                    if not await auser_has_perms(user, perms):
+                        raise exceptions.PermissionDenied()
+                drf_request = Request(
+                    request,
+                    parsers=[
+                        parser() for parser in api_settings.DEFAULT_PARSER_CLASSES
+                    ],
+                    authenticators=(),
+                )
+                drf_request.user, drf_request.auth = user, auth
+                data = await handler(drf_request, *args, **kwargs)
+                if isinstance(data, HttpResponseBase):
+                    return data
+                return render(data)
+            except exceptions.APIException as exc:
+                return error_response(request, exc)
+
+        return view
+
+    return decorator
+
+
+def read_through(async_view, sync_view, methods: Optional[Iterable[str]] = None):
+    """
+    Route ``methods`` (default GET/HEAD) to ``async_view`` and everything
+    else to the regular viewset ``sync_view``.
+    """
+    methods = methods or ("GET", "HEAD")
+    sync_view = sync_to_async(sync_view)
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method in methods:
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+
+    return view
+
+
+@async_api(methods=("POST",), authenticated=False)
+async def login(request):
+    """
+    Async MyTokenObtainPairView, awaiting the password check.
+    """
+    serializer = MyTokenObtainPairSerializer(
+        data=request.data, context={"request": request}
+    )
+    attrs = serializer.to_internal_value(serializer.initial_data)
+    return await serializer.avalidate(attrs)
+
+
+@async_api(model=User)
+async def user_list(request):
+    """
+    Async UserViewSet.list.
+    """
+    # Only used for its filter backends, which build the query lazily.
+    view = UserViewSet(request=request, format_kwarg=None, action="list")
+    queryset = visible_users(view.filter_queryset(User.objects.all()), request.user)
+    paginator = UserCursorPagination()
+    page = await paginator.apaginate_queryset(
+        UserValuesSerializer.values(queryset), request, view
+    )
+    data = UserValuesSerializer(
+        await UserValuesSerializer.aload(page), context={"request": request}
+    ).data
+    return paginator.get_paginated_response(data).data
+
+
+@async_api(model=User)
+async def user_detail(request, pk):
+    """
+    Async UserViewSet.retrieve.
+    """
+
+    async def respond():
+        queryset = UserSerializerWithNames.setup_eager_loading(
+            User.objects.filter(pk=pk)
+        )
+        user = await queryset.afirst()
+        if user is None:
+            raise exceptions.NotFound("No User matches the given query.")
+        return render(UserSerializerWithNames(user, context={"request": request}).data)
+
+    versions = await aget_versions(user_version_keys(pk))
+    return await aconditional_response(request, versions, respond)
+
+
+@async_api(methods=("POST",))
+async def session(request):
+    """
+    Async UserViewSet.session, which also answers 401 without credentials.
+    """
+    user = request.user
+    if isinstance(user, TokenUser):
+        # Stateless auth: the token has no profile fields to serialize.
+        user = await User.objects.aget(pk=user.pk)
+    return UserSerializer(user).data
+
+
+@async_api()
+async def user_permissions(request):
+    """
+    Async UserPermissionViewSet.list.
+    """
+    return permission_codenames(await aget_user_permissions(request.user))
+
+
+@async_api()
+async def dashboard(request):
+    """
+    Async DashboardViewSet.list.
+    """
+    try:
+        period, buckets = parse_dashboard_params(request.query_params)
+    except ValueError as e:
+        raise exceptions.ParseError(str(e))
+    return dashboard_data(
+        period,
+        await asignup_series(period, buckets),
+        await atotal_signups(),
+        await Group.objects.acount(),
+    )
@@ -0,0 +1,212 @@
+import base64
+import zlib
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import (
+    aget_permission_version,
+    get_permission_version,
+    get_user_permissions,
+)
+from .models import User
+
+PERMISSION_VERSION_CLAIM = "perm_version"
+PERMISSIONS_CLAIM = "perms"
+PERMISSIONS_WBITS = 12
+
+
+def encode_permissions(permissions: Iterable[str]) -> str:
+    """
+    Pack ``app_label.codename`` permission names into a short string.
+
+    Codenames are grouped by app label (``auth:add_group,view_group``),
+    then deflated and base64url-encoded: codenames share long
+    prefixes and suffixes, so hundreds of them take a few hundred bytes.
+    """
+    by_app: Dict[str, List[str]] = {}
+    for permission in sorted(permissions):
+        app_label, codename = permission.split(".", 1)
+        by_app.setdefault(app_label, []).append(codename)
+    packed = ";".join(
+        f"{app_label}:{','.join(codenames)}" for app_label, codenames in by_app.items()
+    )
+    # Raw deflate with a 4 KiB window: no header or checksum, and a small
+    # fraction of the memory zlib.compress() sets up.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -PERMISSIONS_WBITS, 6)
+    compressed = compressor.compress(packed.encode()) + compressor.flush()
+    return base64.urlsafe_b64encode(compressed).decode()
+
+
+def decode_permissions(encoded: str) -> Set[str]:
+    """
+    Reverse encode_permissions().
+    """
+    packed = zlib.decompress(
+        base64.urlsafe_b64decode(encoded), -PERMISSIONS_WBITS
+    ).decode()
+    permissions = set()
+    for group in filter(None, packed.split(";")):
+        app_label, codenames = group.split(":", 1)
+        permissions.update(
+            f"{app_label}.{codename}" for codename in codenames.split(",")
+        )
+    return permissions
+
+
+def get_token_claims(user: User) -> Dict:
+    """
+    Build the authorization claims embedded in a user's tokens.
+
+    Permissions are packed by encode_permissions(). When they still take
+    more than JWT_PERMISSION_CLAIM_MAX_BYTES, the claim is left out and
+    requests look them up in the permission cache instead, so tokens stay
+    well within header size limits. Superusers get no permission list
+    since they are granted everything anyway.
+    """
+    permissions = (
+        "" if user.is_superuser else encode_permissions(get_user_permissions(user))
+    )
+    claims = {
+        "username": user.username,
+        "is_staff": user.is_staff,
+        "is_superuser": user.is_superuser,
+        "groups": list(user.groups.values_list("name", flat=True)),
+        PERMISSION_VERSION_CLAIM: get_permission_version(user.pk),
+    }
+    if len(permissions) <= settings.JWT_PERMISSION_CLAIM_MAX_BYTES:
+        claims[PERMISSIONS_CLAIM] = permissions
+    return claims
+
+
+class ClaimsUser(TokenUser):
+    """
+    Token-backed user that answers permission checks from its claims.
+    """
+
+    @cached_property
+    def group_names(self) -> List[str]:
+        return self.token.get("groups", [])
+
+    @property
+    def permissions_omitted(self) -> bool:
+        return PERMISSIONS_CLAIM not in self.token
+
+    @cached_property
+    def _permissions(self) -> Set[str]:
+        if self.permissions_omitted:
+            return get_user_permissions(self)
+        return decode_permissions(self.token[PERMISSIONS_CLAIM])
+
+    def get_all_permissions(self, obj: Optional[object] = None) -> Set[str]:
+        if obj is not None:
+            return set()
+        return set(self._permissions)
+
+    def has_perm(self, perm: str, obj: Optional[object] = None) -> bool:
+        if self.is_superuser:
+            return True
+        return perm in self.get_all_permissions(obj)
+
+    def has_perms(self, perm_list: List[str], obj: Optional[object] = None) -> bool:
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, module: str) -> bool:
+        if self.is_superuser:
+            return True
+        return any(perm.startswith(f"{module}.") for perm in self._permissions)
+
+
+class AsyncAuthenticationMixin:
+    """
+    Adds ``aauthenticate()``, used by the async views in
+    apps.user.async_views, to a simplejwt authentication class.
+
+    Parsing and verifying the token is pure CPU work; only ``aget_user()``
+    may touch the database or cache, and does so through async APIs.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+
+class JWTAuthentication(AsyncAuthenticationMixin, authentication.JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication with an async code path.
+    """
+
+    async def aget_user(self, validated_token) -> User:
+        """
+        Same as get_user(), loading the user with the async ORM.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from e
+
+        user = await self.user_model.objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}
+        ).afirst()
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+
+class StatelessJWTAuthentication(
+    AsyncAuthenticationMixin, authentication.JWTStatelessUserAuthentication
+):
+    """
+    Authenticate from the access token's claims without loading the user.
+
+    The only lookup left is the permission version stamp, which lives in
+    the cache. Tokens issued before the user's groups or permissions last
+    changed carry an outdated stamp and are rejected, so the client has to
+    refresh and picks up the new claims.
+    """
+
+    def check_version(self, validated_token, current_version: str):
+        version = validated_token.get(PERMISSION_VERSION_CLAIM)
+        if version is None:
+            raise InvalidToken(_("Token contained no authorization claims"))
+        if version != current_version:
+            raise InvalidToken(_("Token authorization claims are outdated"))
+
+    def get_user(self, validated_token) -> ClaimsUser:
+        user = super().get_user(validated_token)
+        self.check_version(validated_token, get_permission_version(user.id))
+        return user
+
+    async def aget_user(self, validated_token) -> ClaimsUser:
+        user = super().get_user(validated_token)
+        self.check_version(validated_token, await aget_permission_version(user.id))
+        return user
@@ -0,0 +1,63 @@
+import asyncio
+
+from django.contrib.auth.backends import ModelBackend
+from rest_framework.exceptions import Throttled
+
+from .hashing import VerifyQueueFull, submit_password_check
+from .models import User
+
+# Seconds suggested to clients in Retry-After when logins are shed.
+RETRY_AFTER = 1
+
+
+class PooledPasswordBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords in a bounded process pool.
+
+    PBKDF2 holds the GIL for the whole check, so during a login burst the
+    worker's other requests stall behind it. Here the check (and the
+    rehash when the hasher's parameters changed) runs in another process;
+    the request thread merely waits, or, under ASGI, the event loop awaits
+    it. When PASSWORD_VERIFY_QUEUE_SIZE checks are already queued, the
+    login is refused with a 429 instead of queueing more.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = User._default_manager.filter(**{User.USERNAME_FIELD: username}).first()
+        is_correct, new_encoded = self._submit(password, user).result()
+        if new_encoded:
+            user.password = new_encoded
+            user.save(update_fields=["password"])
+        return self._accept(user, is_correct)
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = await User._default_manager.filter(
+            **{User.USERNAME_FIELD: username}
+        ).afirst()
+        future = self._submit(password, user)
+        is_correct, new_encoded = await asyncio.wrap_future(future)
+        if new_encoded:
+            user.password = new_encoded
+            await user.asave(update_fields=["password"])
+        return self._accept(user, is_correct)
+
+    def _submit(self, password, user):
+        try:
+            return submit_password_check(password, user.password if user else None)
+        except VerifyQueueFull:
+            raise Throttled(
+                wait=RETRY_AFTER, detail="Too many logins in progress, retry shortly."
+            )
+
+    def _accept(self, user, is_correct):
+        if is_correct and self.user_can_authenticate(user):
+            return user
+        return None
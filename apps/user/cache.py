@@ -0,0 +1,212 @@
+import threading
+import time
+from typing import Dict, Iterable, Set
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework_simplejwt.models import TokenUser
+
+from apps.user.routers import read_from_primary
+
+PERMISSIONS_KEY = "user:perms:{user_id}:{global_version}:{user_version}"
+GLOBAL_VERSION_KEY = "user:perms-version"
+USER_VERSION_KEY = "user:perms-version:{user_id}"
+
+
+class CacheStats:
+    """
+    Thread-safe hit/miss counters for one cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+permission_cache_stats = CacheStats()
+
+
+def _cache():
+    return caches[settings.PERMISSION_CACHE_ALIAS]
+
+
+def _new_version() -> int:
+    # A timestamp rather than a counter: if the version key is evicted,
+    # the replacement can never collide with an entry cached under an
+    # older version.
+    return time.time_ns()
+
+
+def _get_versions(user_id: int) -> tuple:
+    """
+    Return the ``(global, user)`` version stamps, creating missing ones.
+    """
+    cache = _cache()
+    user_key = USER_VERSION_KEY.format(user_id=user_id)
+    versions = cache.get_many([GLOBAL_VERSION_KEY, user_key])
+    for key in (GLOBAL_VERSION_KEY, user_key):
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions[GLOBAL_VERSION_KEY], versions[user_key]
+
+
+async def _aget_versions(user_id: int) -> tuple:
+    """
+    Async version of _get_versions().
+    """
+    cache = _cache()
+    user_key = USER_VERSION_KEY.format(user_id=user_id)
+    versions = await cache.aget_many([GLOBAL_VERSION_KEY, user_key])
+    for key in (GLOBAL_VERSION_KEY, user_key):
+        if key not in versions:
+            await cache.aadd(key, _new_version(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return versions[GLOBAL_VERSION_KEY], versions[user_key]
+
+
+def get_permission_version(user_id: int) -> str:
+    """
+    Return a stamp that changes whenever the user's permissions may have.
+    """
+    global_version, user_version = _get_versions(user_id)
+    return f"{global_version}.{user_version}"
+
+
+async def aget_permission_version(user_id: int) -> str:
+    """
+    Async version of get_permission_version().
+    """
+    global_version, user_version = await _aget_versions(user_id)
+    return f"{global_version}.{user_version}"
+
+
+def get_user_permissions(user) -> Set[str]:
+    """
+    Return ``user.get_all_permissions()`` through the shared cache.
+
+    Entries are keyed by user id plus two version stamps: one per user,
+    bumped when that user's groups or direct permissions change, and one
+    global, bumped when any group's permissions change. Bumping a version
+    orphans the old entries, which then expire on their own.
+
+    Users authenticated from token claims are answered from the token,
+    unless their permissions were left out of it.
+    """
+    if isinstance(user, TokenUser):
+        if not getattr(user, "permissions_omitted", False):
+            return user.get_all_permissions()
+        # Too many to fit in the token: look them up for the user id.
+        user = get_user_model()(pk=user.pk)
+
+    global_version, user_version = _get_versions(user.pk)
+    key = PERMISSIONS_KEY.format(
+        user_id=user.pk,
+        global_version=global_version,
+        user_version=user_version,
+    )
+    cache = _cache()
+    permissions = cache.get(key)
+    if permissions is not None:
+        permission_cache_stats.hit()
+        return permissions
+
+    permission_cache_stats.miss()
+    # From the primary: a lagging replica could cache revoked permissions
+    # under the new version.
+    with read_from_primary():
+        permissions = user.get_all_permissions()
+    cache.set(key, permissions, timeout=settings.PERMISSION_CACHE_TIMEOUT)
+    return permissions
+
+
+async def aget_user_permissions(user) -> Set[str]:
+    """
+    Async version of get_user_permissions().
+    """
+    if isinstance(user, TokenUser):
+        if not getattr(user, "permissions_omitted", False):
+            return user.get_all_permissions()
+        # Too many to fit in the token: look them up for the user id.
+        user = get_user_model()(pk=user.pk)
+
+    global_version, user_version = await _aget_versions(user.pk)
+    key = PERMISSIONS_KEY.format(
+        user_id=user.pk,
+        global_version=global_version,
+        user_version=user_version,
+    )
+    cache = _cache()
+    permissions = await cache.aget(key)
+    if permissions is not None:
+        permission_cache_stats.hit()
+        return permissions
+
+    permission_cache_stats.miss()
+    with read_from_primary():
+        permissions = await user.aget_all_permissions()
+    await cache.aset(key, permissions, timeout=settings.PERMISSION_CACHE_TIMEOUT)
+    return permissions
+
+
+def user_has_perms(user, perm_list: Iterable[str]) -> bool:
+    """
+    Cached equivalent of ``user.has_perms(perm_list)``.
+    """
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perm_list) <= get_user_permissions(user)
+
+
+async def auser_has_perms(user, perm_list: Iterable[str]) -> bool:
+    """
+    Async version of user_has_perms().
+    """
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perm_list) <= await aget_user_permissions(user)
+
+
+def invalidate_user_permissions(user_ids: Iterable[int]):
+    """
+    Drop the cached permissions of the given users once the current
+    transaction commits.
+
+    Bumping earlier would let a concurrent request cache the permissions
+    from before the commit under the new version, where they would stay
+    until they expire (and be signed into stateless tokens meanwhile).
+    """
+    keys = [USER_VERSION_KEY.format(user_id=user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(
+            lambda: _cache().set_many(dict.fromkeys(keys, _new_version()), timeout=None)
+        )
+
+
+def invalidate_all_permissions():
+    """
+    Drop the cached permissions of every user once the current transaction
+    commits.
+    """
+    transaction.on_commit(
+        lambda: _cache().set(GLOBAL_VERSION_KEY, _new_version(), timeout=None)
+    )
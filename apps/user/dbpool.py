@@ -0,0 +1,59 @@
+import os
+from typing import Dict
+
+from django.db import connections
+
+
+def get_pool(alias: str):
+    """
+    Return the connection pool of ``alias`` if it has been created.
+
+    Reading ``connection.pool`` would create one as a side effect, so the
+    backend's per-process registry is looked up instead.
+    """
+    connection = connections[alias]
+    return getattr(connection, "_connection_pools", {}).get(alias)
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Return usage counters of this process's connection pools, per alias.
+
+    * checked_out: connections currently lent to threads;
+    * waiting: threads queued for a connection right now;
+    * wait_ms / waits: time spent and requests queued waiting, in total;
+    * timeouts: checkouts that gave up after the pool timeout;
+    * connections_created / connections_closed: physical connections
+      opened and discarded (idle, expired, broken) since startup.
+    """
+    stats = {}
+    for alias in connections:
+        pool = get_pool(alias)
+        if pool is None or pool.closed:
+            continue
+        raw = pool.get_stats()
+        size = raw.get("pool_size", 0)
+        created = raw.get("connections_num", 0)
+        stats[alias] = {
+            "min_size": raw.get("pool_min", 0),
+            "max_size": raw.get("pool_max", 0),
+            "size": size,
+            "idle": raw.get("pool_available", 0),
+            "checked_out": size - raw.get("pool_available", 0),
+            "waiting": raw.get("requests_waiting", 0),
+            "requests": raw.get("requests_num", 0),
+            "waits": raw.get("requests_queued", 0),
+            "wait_ms": raw.get("requests_wait_ms", 0),
+            "timeouts": raw.get("requests_errors", 0),
+            "connections_created": created,
+            # Connections still being opened count towards size already.
+            "connections_closed": max(created - size, 0),
+            "connection_errors": raw.get("connections_errors", 0),
+            "connections_lost": raw.get("connections_lost", 0),
+            "returned_bad": raw.get("returns_bad", 0),
+        }
+    return stats
+
+
+def pool_report() -> dict:
+    return {"pid": os.getpid(), "pools": pool_stats()}
@@ -0,0 +1,61 @@
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import Contains, Exact
+from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
+
+from .models import User
+
+SEARCH_FIELDS = ("username", "email", "first_name", "last_name")
+# Each has a (field, id) index (see User.Meta.indexes) and the cursor holds
+# both values (see UserCursorPagination), so a sorted page is an index range
+# scan.
+ORDERING_FIELDS = ("date_joined", "username", "email", "last_name")
+
+
+class UserFilter(filters.FilterSet):
+    """
+    Filters for the user list.
+
+    Text is compared on ``LOWER(column)``, which the functional and
+    trigram indexes on User are built on. Django's ``iexact`` and
+    ``icontains`` compare ``UPPER(column)`` instead and could not use them.
+    """
+
+    username = filters.CharFilter(method="filter_lower_exact")
+    email = filters.CharFilter(method="filter_lower_exact")
+    group = filters.NumberFilter(field_name="groups")
+    date_joined = filters.IsoDateTimeFromToRangeFilter()
+    search = filters.CharFilter(method="filter_search")
+
+    class Meta:
+        model = User
+        fields = ["is_active", "is_staff"]
+
+    def filter_lower_exact(self, queryset, name, value):
+        return queryset.filter(Exact(Lower(name), value.lower()))
+
+    def filter_search(self, queryset, name, value):
+        """
+        Keep users matching every whitespace-separated term in any of
+        SEARCH_FIELDS, case-insensitively.
+        """
+        for term in value.lower().split():
+            condition = Q()
+            for field in SEARCH_FIELDS:
+                condition |= Q(Contains(Lower(field), term))
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class UserOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that breaks ties on id, in the direction of the first
+    field so that the ``(field, id)`` indexes serve the sort both ways.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if ordering and ordering[-1].lstrip("-") != "id":
+            ordering.append("-id" if ordering[0].startswith("-") else "id")
+        return tuple(ordering)
@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import Future
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+
+from .workers import get_pool
+
+# Below this many passwords the pool round trip costs more than it saves.
+MIN_POOL_BATCH = 16
+
+
+def get_hash_pool():
+    """
+    Return the process pool used for password hashing.
+    """
+    return get_pool("password-hash", settings.PASSWORD_HASH_WORKERS)
+
+
+def hash_passwords(passwords: Iterable[str]) -> List[str]:
+    """
+    Hash many raw passwords, spreading the work across the process pool.
+
+    Returns the encoded hashes in the same order as ``passwords``.
+    """
+    passwords = list(passwords)
+    if len(passwords) < MIN_POOL_BATCH or settings.PASSWORD_HASH_WORKERS < 2:
+        return [make_password(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // (settings.PASSWORD_HASH_WORKERS * 4))
+    return list(get_hash_pool().map(make_password, passwords, chunksize=chunksize))
+
+
+class VerifyQueueFull(Exception):
+    """
+    Raised when PASSWORD_VERIFY_QUEUE_SIZE verifications are already in
+    flight.
+    """
+
+
+_verify_slots = threading.BoundedSemaphore(settings.PASSWORD_VERIFY_QUEUE_SIZE)
+
+
+def check_and_upgrade(
+    password: str, encoded: Optional[str]
+) -> Tuple[bool, Optional[str]]:
+    """
+    Check ``password`` against ``encoded`` and rehash it if the stored
+    hash uses outdated parameters.
+
+    Returns ``(is_correct, new_encoded)``, the latter None unless an
+    upgrade is due. With no ``encoded`` (unknown user) the password is
+    hashed once anyway so both cases take as long (Django ticket #20760).
+    """
+    if encoded is None:
+        make_password(password)
+        return False, None
+    is_correct, must_update = verify_password(password, encoded)
+    if is_correct and must_update:
+        return True, make_password(password)
+    return is_correct, None
+
+
+def submit_password_check(password: str, encoded: Optional[str]) -> Future:
+    """
+    Queue check_and_upgrade() on the verification pool.
+
+    At most PASSWORD_VERIFY_QUEUE_SIZE checks wait or run at once;
+    beyond that VerifyQueueFull is raised right away instead of letting
+    logins pile up behind each other.
+    """
+    if not _verify_slots.acquire(blocking=False):
+        raise VerifyQueueFull()
+    try:
+        pool = get_pool("password-verify", settings.PASSWORD_VERIFY_WORKERS)
+        future = pool.submit(check_and_upgrade, password, encoded)
+    except BaseException:
+        _verify_slots.release()
+        raise
+    future.add_done_callback(lambda _: _verify_slots.release())
+    return future
@@ -0,0 +1,119 @@
+import time
+from datetime import date
+from typing import Callable, Iterable, List, Optional, Tuple, Type
+
+from django.contrib.auth.models import Group, Permission
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import User
+
+
+def get_historical_models() -> List[Type[models.Model]]:
+    """
+    Return the historical models written by simple_history in this project.
+    """
+    return [User.history.model, Group.history.model, Permission.history.model]
+
+
+def get_m2m_history_models(history_model) -> List[Type[models.Model]]:
+    """
+    Return the m2m history models hanging off ``history_model``.
+
+    ``HistoricalRecords(m2m_fields=...)`` creates one model per field
+    (e.g. HistoricalUser_groups) with a ``history`` foreign key.
+    """
+    return [
+        relation.related_model
+        for relation in history_model._meta.related_objects
+        if relation.field.name == "history"
+    ]
+
+
+def delete_in_batches(
+    queryset,
+    batch_size: int,
+    pause: float = 0.0,
+    max_batches: Optional[int] = None,
+    on_batch: Optional[Callable[[int], None]] = None,
+    children: Iterable[Tuple[Type[models.Model], str]] = (),
+) -> int:
+    """
+    Delete the rows of ``queryset`` a batch at a time.
+
+    Each batch selects up to ``batch_size`` primary keys and deletes them
+    in its own short transaction, so locks are held briefly and an
+    interrupted run loses at most one batch; running it again simply
+    continues with the rows that are left. ``pause`` seconds are slept
+    between batches to give replication and autovacuum room.
+
+    ``children`` lists ``(model, field name)`` pairs whose rows pointing
+    at a batch are deleted with it, for relations the ORM does not cascade.
+
+    Returns the number of rows deleted from ``queryset``'s model.
+    """
+    model = queryset.model
+    pk_name = model._meta.pk.name
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(queryset.values_list(pk_name, flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            for child_model, field_name in children:
+                child_model.objects.filter(**{f"{field_name}__in": pks}).delete()
+            _, per_model = model.objects.filter(pk__in=pks).delete()
+        deleted += per_model.get(model._meta.label, 0)
+        batches += 1
+        if on_batch is not None:
+            on_batch(deleted)
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def prune_history(history_model, cutoff, batch_size: int, **kwargs) -> int:
+    """
+    Delete historical rows older than ``cutoff``, oldest first.
+
+    Walking ``history_date`` in order uses its index. The m2m history rows
+    of each batch are deleted along with it: their ``history`` foreign key
+    is DO_NOTHING, so nothing else would.
+    """
+    queryset = history_model.objects.filter(history_date__lt=cutoff).order_by(
+        "history_date"
+    )
+    children = [(model, "history") for model in get_m2m_history_models(history_model)]
+    return delete_in_batches(queryset, batch_size, children=children, **kwargs)
+
+
+def prune_orphaned_m2m_history(history_model, batch_size: int, **kwargs) -> int:
+    """
+    Delete m2m history rows whose parent historical row no longer exists.
+
+    Needed after dropping partitions of a partitioned historical table,
+    which removes parent rows without any cascade.
+    """
+    deleted = 0
+    for m2m_model in get_m2m_history_models(history_model):
+        parents = history_model.objects.filter(history_id=OuterRef("history_id"))
+        queryset = m2m_model.objects.filter(~Exists(parents))
+        deleted += delete_in_batches(queryset, batch_size, **kwargs)
+    return deleted
+
+
+def month_start(day: date) -> date:
+    """
+    Return the first day of ``day``'s month.
+    """
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    """
+    Return the first day of the month after ``day``'s.
+    """
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
@@ -0,0 +1,390 @@
+import json
+import sqlite3
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from asgiref.local import Local
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from simple_history import utils
+from simple_history.models import HistoricalRecords
+from simple_history.signals import (
+    post_create_historical_m2m_records,
+    post_create_historical_record,
+    pre_create_historical_m2m_records,
+    pre_create_historical_record,
+)
+
+# Per thread / per async task, like simple_history's own request context.
+_context = Local()
+
+
+@dataclass
+class PendingRecord:
+    """
+    A historical row built during a buffered scope but not yet written.
+    """
+
+    records: HistoricalRecords
+    instance: models.Model
+    history_instance: models.Model
+    using: Optional[str]
+
+
+@dataclass
+class HistoryScope:
+    """
+    Collects the historical rows produced while it is active.
+
+    Rows created inside a transaction only join the scope once that
+    transaction commits, so rolled-back changes leave no history.
+    """
+
+    pending: List[PendingRecord] = field(default_factory=list)
+    depth: int = 0
+
+    def defer(self, record: PendingRecord):
+        alias = record.instance._state.db or router.db_for_write(type(record.instance))
+        transaction.on_commit(lambda: self.pending.append(record), using=alias)
+
+
+def current_scope() -> Optional[HistoryScope]:
+    return getattr(_context, "scope", None)
+
+
+def _enter_scope() -> HistoryScope:
+    scope = current_scope()
+    if scope is None:
+        scope = _context.scope = HistoryScope()
+    scope.depth += 1
+    return scope
+
+
+def _leave_scope(scope: HistoryScope) -> bool:
+    """
+    Return True when ``scope`` was the outermost block and must be flushed.
+    """
+    scope.depth -= 1
+    if scope.depth:
+        return False
+    _context.scope = None
+    return True
+
+
+def _schedule_flush(scope: HistoryScope):
+    # Runs right away outside a transaction; inside one, it runs on commit
+    # after the deferred appends registered before it.
+    transaction.on_commit(lambda: flush_scope(scope))
+
+
+@contextmanager
+def buffered_history():
+    """
+    Buffer every historical row created inside the block and write them
+    all with bulk_create when the outermost block exits.
+
+    With HISTORY_QUEUE_PATH set, the rows are appended to a durable local
+    queue instead, for ``flush_history_queue`` to write in the background.
+
+    m2m history (e.g. a user's groups) is snapshotted when the scope is
+    flushed, so several changes to one object within a single scope all
+    record the final set of relations.
+    """
+    scope = _enter_scope()
+    try:
+        yield scope
+    finally:
+        if _leave_scope(scope):
+            _schedule_flush(scope)
+
+
+@asynccontextmanager
+async def abuffered_history():
+    """
+    Async buffered_history(). The scope follows the task into sync_to_async
+    threads, and the flush runs in one since it queries the database.
+    """
+    scope = _enter_scope()
+    try:
+        yield scope
+    finally:
+        if _leave_scope(scope):
+            await sync_to_async(_schedule_flush)(scope)
+
+
+def flush_scope(scope: HistoryScope):
+    """
+    Write (or enqueue) everything a finished scope collected.
+    """
+    if not scope.pending:
+        return
+    if settings.HISTORY_QUEUE_PATH:
+        enqueue_records(scope.pending)
+    else:
+        write_records(scope.pending)
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords that defers its INSERTs while a buffered_history()
+    scope is active, and behaves exactly like the stock class otherwise.
+    """
+
+    def create_historical_record(self, instance, history_type, using=None):
+        scope = current_scope()
+        if scope is None:
+            return super().create_historical_record(instance, history_type, using)
+
+        # Same as HistoricalRecords.create_historical_record, minus the
+        # save() and the m2m rows, which are written in bulk on flush.
+        using = using if self.use_base_model_db else None
+        history_date = getattr(instance, "_history_date", timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(
+            instance, history_type, using
+        )
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {}
+        for model_field in self.fields_included(instance):
+            attrs[model_field.attname] = getattr(instance, model_field.attname)
+
+        relation_field = getattr(manager.model, "history_relation", None)
+        if relation_field is not None:
+            attrs["history_relation"] = instance
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+
+        pre_create_historical_record.send(
+            sender=manager.model,
+            instance=instance,
+            history_date=history_date,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            history_instance=history_instance,
+            using=using,
+        )
+        scope.defer(PendingRecord(self, instance, history_instance, using))
+
+
+def snapshot_m2m(pending: List[PendingRecord]) -> Dict[int, Dict]:
+    """
+    Read the current m2m rows of every pending record, batched.
+
+    One query per (model, m2m field) covers all buffered instances.
+    Returns ``{id(pending record): {m2m field: [row values]}}``, with row
+    values keyed by attname so they can also be serialized.
+    """
+    snapshots = defaultdict(lambda: defaultdict(list))
+    groups = defaultdict(list)
+    for record in pending:
+        for m2m_field in record.history_instance._history_m2m_fields:
+            groups[(type(record.instance), m2m_field)].append(record)
+
+    for (model, m2m_field), records in groups.items():
+        through_model = getattr(model, m2m_field.name).through
+        through_fields = through_model._meta.fields
+        through_field_name = utils.get_m2m_field_name(m2m_field)
+        owner_attname = through_model._meta.get_field(through_field_name).attname
+
+        rows_by_owner = defaultdict(list)
+        rows = through_model.objects.filter(
+            **{f"{owner_attname}__in": {r.instance.pk for r in records}}
+        ).values(*[f.attname for f in through_fields])
+        for row in rows:
+            rows_by_owner[row[owner_attname]].append(row)
+
+        for record in records:
+            snapshots[id(record)][m2m_field] = rows_by_owner[record.instance.pk]
+    return snapshots
+
+
+def write_records(pending: List[PendingRecord]):
+    """
+    Insert the pending historical rows and their m2m snapshots in bulk.
+    """
+    snapshots = snapshot_m2m(pending)
+    by_model = defaultdict(list)
+    for record in pending:
+        by_model[(type(record.history_instance), record.using)].append(record)
+
+    # {id(pending record): [(m2m field, m2m history model, created rows)]}
+    m2m_created = defaultdict(list)
+    with transaction.atomic():
+        for (history_model, using), records in by_model.items():
+            history_model.objects.using(using).bulk_create(
+                [record.history_instance for record in records],
+                batch_size=settings.HISTORY_BUFFER_BATCH_SIZE,
+            )
+
+            m2m_rows = defaultdict(list)
+            for record in records:
+                for m2m_field, rows in snapshots[id(record)].items():
+                    m2m_model = record.records.m2m_models[m2m_field]
+                    created = [
+                        m2m_model(history=record.history_instance, **row)
+                        for row in rows
+                    ]
+                    pre_create_historical_m2m_records.send(
+                        sender=m2m_model,
+                        rows=created,
+                        history_instance=record.history_instance,
+                        instance=record.instance,
+                        field=m2m_field,
+                    )
+                    m2m_rows[m2m_model].extend(created)
+                    m2m_created[id(record)].append((m2m_field, m2m_model, created))
+            for m2m_model, rows in m2m_rows.items():
+                m2m_model.objects.using(using).bulk_create(
+                    rows, batch_size=settings.HISTORY_BUFFER_BATCH_SIZE
+                )
+
+    for record in pending:
+        history_instance = record.history_instance
+        for m2m_field, m2m_model, created in m2m_created[id(record)]:
+            post_create_historical_m2m_records.send(
+                sender=m2m_model,
+                created_rows=created,
+                history_instance=history_instance,
+                instance=record.instance,
+                field=m2m_field,
+            )
+        post_create_historical_record.send(
+            sender=type(history_instance),
+            instance=record.instance,
+            history_instance=history_instance,
+            history_date=history_instance.history_date,
+            history_user=history_instance.history_user,
+            history_change_reason=history_instance.history_change_reason,
+            using=record.using,
+        )
+
+
+# Durable local queue ------------------------------------------------------
+#
+# A SQLite file on local disk: appends are a single fsync'ed transaction,
+# and it survives worker restarts, unlike an in-memory buffer.
+
+
+class QueueJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder keeps only milliseconds; history dates keep all six
+    digits so queued rows match synchronously written ones.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _queue_connection() -> sqlite3.Connection:
+    connection = sqlite3.connect(settings.HISTORY_QUEUE_PATH, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS history_queue ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+    )
+    return connection
+
+
+def _serialize(record: PendingRecord, m2m: Dict) -> str:
+    history_instance = record.history_instance
+    fields = {}
+    for model_field in history_instance._meta.concrete_fields:
+        if model_field.primary_key:
+            continue
+        value = getattr(history_instance, model_field.attname)
+        if isinstance(value, FieldFile):
+            value = value.name
+        fields[model_field.attname] = value
+    return json.dumps(
+        {
+            "model": history_instance._meta.label,
+            "using": record.using,
+            "fields": fields,
+            "m2m": {
+                record.records.m2m_models[m2m_field]._meta.label: rows
+                for m2m_field, rows in m2m.items()
+            },
+        },
+        cls=QueueJSONEncoder,
+    )
+
+
+def enqueue_records(pending: List[PendingRecord]):
+    """
+    Append the pending historical rows to the durable local queue.
+    """
+    snapshots = snapshot_m2m(pending)
+    payloads = [(_serialize(r, snapshots[id(r)]),) for r in pending]
+    connection = _queue_connection()
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO history_queue (payload) VALUES (?)", payloads
+            )
+    finally:
+        connection.close()
+
+
+def flush_queue(batch_size: int) -> int:
+    """
+    Write up to ``batch_size`` queued historical rows to the database.
+
+    Rows are removed from the queue only after the database transaction
+    commits, so a crash in between re-delivers them (at-least-once).
+    Returns the number of rows written.
+    """
+    connection = _queue_connection()
+    try:
+        entries = connection.execute(
+            "SELECT id, payload FROM history_queue ORDER BY id LIMIT ?",
+            (batch_size,),
+        ).fetchall()
+        if not entries:
+            return 0
+
+        by_model = defaultdict(list)
+        for _, payload in entries:
+            data = json.loads(payload)
+            history_model = apps.get_model(data["model"])
+            by_model[(history_model, data["using"])].append(
+                (history_model(**data["fields"]), data["m2m"])
+            )
+
+        with transaction.atomic():
+            for (history_model, using), items in by_model.items():
+                history_model.objects.using(using).bulk_create(
+                    [history_instance for history_instance, _ in items]
+                )
+                m2m_rows = defaultdict(list)
+                for history_instance, m2m in items:
+                    for label, rows in m2m.items():
+                        m2m_model = apps.get_model(label)
+                        m2m_rows[m2m_model].extend(
+                            m2m_model(history=history_instance, **row) for row in rows
+                        )
+                for m2m_model, rows in m2m_rows.items():
+                    m2m_model.objects.using(using).bulk_create(rows)
+
+        with connection:
+            connection.execute(
+                "DELETE FROM history_queue WHERE id <= ?", (entries[-1][0],)
+            )
+        return len(entries)
+    finally:
+        connection.close()
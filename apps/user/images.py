@@ -0,0 +1,216 @@
+import logging
+import os
+from io import BytesIO
+from typing import Dict, Iterable, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import User
+from .storage import update_references
+from .versions import bump_rows
+from .workers import get_pool
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+
+# Formats whose files may carry EXIF/XMP metadata worth stripping.
+SANITIZED_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+THUMBNAILS_KEY = "thumbnails:{name}"
+# Seconds before images without thumbnails are looked up again.
+THUMBNAILS_MISSING_TIMEOUT = 60
+
+
+def verify_image(file) -> Optional[str]:
+    """
+    Check that ``file`` is a supported, reasonably sized image.
+
+    Only the header is parsed and ``verify()`` walks the file structure;
+    the raster itself is never decoded, so this stays cheap for large
+    uploads. Returns an error message, or None when the image is valid.
+    """
+    if not hasattr(file, "read"):
+        return "Invalid image format."
+    try:
+        with Image.open(file, formats=settings.AVATAR_FORMATS) as image:
+            width, height = image.size
+            if width * height > settings.AVATAR_MAX_PIXELS:
+                return "Image is too large."
+            image.verify()
+    except (Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        return "Invalid image format."
+    finally:
+        file.seek(0)
+    return None
+
+
+def thumbnail_name(image_name: str, label: str) -> str:
+    """
+    Return the storage name of the ``label`` thumbnail of ``image_name``.
+    """
+    stem, _ = os.path.splitext(image_name)
+    extension = THUMBNAIL_EXTENSIONS[settings.AVATAR_THUMBNAIL_FORMAT]
+    return f"thumbnails/{label}/{stem}.{extension}"
+
+
+def existing_thumbnails(image_names: Iterable[str]) -> Set[str]:
+    """
+    Return those of ``image_names`` whose thumbnails have all been written.
+
+    Answered from the default cache in one round trip when possible.
+    process_avatar() marks the thumbnails it writes; the storage is only
+    checked for images the cache knows nothing about, and missing ones are
+    looked up again after THUMBNAILS_MISSING_TIMEOUT, which covers avatars
+    still in the worker pool or written by another process.
+    """
+    keys = {THUMBNAILS_KEY.format(name=name): name for name in image_names}
+    if not keys:
+        return set()
+    cached = cache.get_many(keys)
+    looked_up = {
+        key: all(
+            default_storage.exists(thumbnail_name(name, label))
+            for label in settings.AVATAR_THUMBNAIL_SIZES
+        )
+        for key, name in keys.items()
+        if key not in cached
+    }
+    for exists, timeout in ((True, None), (False, THUMBNAILS_MISSING_TIMEOUT)):
+        entries = {key: exists for key, found in looked_up.items() if found == exists}
+        if entries:
+            cache.set_many(entries, timeout=timeout)
+    return {keys[key] for key, exists in {**cached, **looked_up}.items() if exists}
+
+
+def thumbnails_exist(image_name: str) -> bool:
+    """
+    Whether every thumbnail of ``image_name`` has been written (see
+    existing_thumbnails()).
+    """
+    return image_name in existing_thumbnails([image_name])
+
+
+def thumbnail_urls(image, request=None, exists=None) -> Optional[Dict[str, str]]:
+    """
+    Return the thumbnail URLs of an ImageField value (or of a stored image
+    name), keyed by size label.
+
+    None until the thumbnails exist: avatars being processed, whose
+    processing failed, or uploaded before thumbnails were introduced (see
+    the generate_thumbnails command) have none. Pass ``exists`` when it is
+    already known, e.g. from existing_thumbnails() for a whole page.
+    """
+    if not image:
+        return None
+    name = getattr(image, "name", image)
+    if exists is None:
+        exists = thumbnails_exist(name)
+    if not exists:
+        return None
+    urls = {}
+    for label in settings.AVATAR_THUMBNAIL_SIZES:
+        url = default_storage.url(thumbnail_name(name, label))
+        urls[label] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def _encode(image: Image.Image, image_format: str, **options) -> ContentFile:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def _replace(name: str, content: ContentFile) -> str:
+    default_storage.delete(name)
+    return default_storage.save(name, content)
+
+
+def delete_thumbnails(image_name: str):
+    """
+    Delete every thumbnail of ``image_name``.
+    """
+    for label in settings.AVATAR_THUMBNAIL_SIZES:
+        default_storage.delete(thumbnail_name(image_name, label))
+    cache.delete(THUMBNAILS_KEY.format(name=image_name))
+
+
+def process_avatar(user_id: int, image_name: str) -> str:
+    """
+    Strip the metadata of an uploaded avatar and write its thumbnails.
+
+    Runs in a worker process. The original is re-encoded without EXIF/XMP
+    (GPS position, camera serial, ...) after applying its EXIF orientation,
+    keeping only the colour profile, and stored as a new blob which the
+    user is pointed at; the unsanitized blob is left for ``gc_media``.
+    Returns the stored name of the sanitized original.
+    """
+    storage = User._meta.get_field("image").storage
+    with storage.open(image_name, "rb") as file:
+        image = Image.open(file)
+        image_format = image.format
+        image.load()
+    icc_profile = image.info.get("icc_profile")
+    image = ImageOps.exif_transpose(image)
+
+    name = image_name
+    if image_format in SANITIZED_FORMATS:
+        options = {"icc_profile": icc_profile} if icc_profile else {}
+        if image_format == "JPEG":
+            options["quality"] = 90
+        name = storage.save(image_name, _encode(image, image_format, **options))
+        if name != image_name:
+            with transaction.atomic():
+                updated = User.objects.filter(pk=user_id, image=image_name).update(
+                    image=name
+                )
+                if updated:
+                    update_references(image_name, name)
+                    # update() sends no post_save.
+                    bump_rows(User, [user_id])
+
+    thumbnail_format = settings.AVATAR_THUMBNAIL_FORMAT
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    mode = "RGBA" if has_alpha and thumbnail_format == "WEBP" else "RGB"
+    image = image.convert(mode)
+    for label, size in settings.AVATAR_THUMBNAIL_SIZES.items():
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        _replace(
+            thumbnail_name(name, label),
+            _encode(thumbnail, thumbnail_format, quality=85),
+        )
+    cache.set(THUMBNAILS_KEY.format(name=name), True, timeout=None)
+    return name
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("Avatar processing failed", exc_info=future.exception())
+
+
+def submit_avatar(user_id: int, image_name: str):
+    """
+    Process an avatar in the image worker pool, or inline when
+    IMAGE_WORKERS is 0.
+    """
+    if settings.IMAGE_WORKERS < 1:
+        process_avatar(user_id, image_name)
+        return
+    pool = get_pool("image", settings.IMAGE_WORKERS)
+    pool.submit(process_avatar, user_id, image_name).add_done_callback(_log_failure)
+
+
+def schedule_avatar_processing(user):
+    """
+    Queue processing of ``user``'s avatar once the current transaction
+    commits, so the worker sees the stored file and the saved row.
+    """
+    if not user.image:
+        return
+    user_id, image_name = user.pk, user.image.name
+    transaction.on_commit(lambda: submit_avatar(user_id, image_name))
@@ -0,0 +1,106 @@
+import csv
+import io
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from simple_history.utils import bulk_create_with_history
+
+from .hashing import hash_passwords
+from .models import User
+from .rollup import record_signups
+from .validators import IMPORT_FIELDS, existing_username_errors
+
+
+class ImportConflict(Exception):
+    """
+    Raised when rows collide with users created after they were validated.
+    """
+
+    def __init__(self, row_errors: Dict[int, Dict[str, str]]):
+        super().__init__(row_errors)
+        self.row_errors = row_errors
+
+
+def normalize_row(row) -> Dict:
+    """
+    Keep only the importable fields of a row, as stripped strings.
+
+    Non-object rows are passed through untouched so validation can
+    report them.
+    """
+    if not isinstance(row, dict):
+        return row
+    return {
+        field: str(row[field]).strip()
+        for field in IMPORT_FIELDS
+        if row.get(field) is not None
+    }
+
+
+def read_import_rows(request) -> List:
+    """
+    Read the rows of a bulk import from a JSON array or a CSV upload.
+
+    A multipart request with a ``file`` part is parsed as CSV with a
+    header line; any other request body must be a JSON array of objects.
+    Raises ValueError when the payload is neither.
+    """
+    upload = request.FILES.get("file")
+    if upload is not None:
+        text = io.TextIOWrapper(upload.file, encoding="utf-8-sig")
+        try:
+            rows = list(csv.DictReader(text))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ValueError(f"Invalid CSV file: {e}")
+    elif isinstance(request.data, list):
+        rows = request.data
+    else:
+        raise ValueError("Expected a JSON array of users or a CSV file.")
+    return [normalize_row(row) for row in rows]
+
+
+def import_users(rows: List[Dict], history_user=None) -> List[User]:
+    """
+    Create users for already validated rows.
+
+    Passwords are hashed across the process pool, then users and their
+    HistoricalUser rows are inserted with bulk_create in batches of
+    USER_IMPORT_BATCH_SIZE, all in one transaction together with the
+    signup rollup update.
+
+    Raises ImportConflict, with errors per row index, when a username
+    was taken after the rows were validated.
+    """
+    passwords = hash_passwords(row["password"] for row in rows)
+    users = [
+        User(
+            username=row["username"],
+            email=row["email"],
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            password=password,
+        )
+        for row, password in zip(rows, passwords)
+    ]
+    try:
+        with transaction.atomic():
+            users = bulk_create_with_history(
+                users,
+                User,
+                batch_size=settings.USER_IMPORT_BATCH_SIZE,
+                default_user=history_user,
+                default_change_reason="Bulk import",
+            )
+            # bulk_create sends no post_save, so update the rollup directly.
+            record_signups(user.date_joined for user in users)
+    except IntegrityError:
+        # Someone took one of the usernames since validate_import_rows();
+        # the import was rolled back as a whole.
+        row_errors = existing_username_errors(
+            {row["username"]: index for index, row in enumerate(rows)}
+        )
+        if not row_errors:
+            raise
+        raise ImportConflict(row_errors) from None
+    return users
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.user.history_buffer import flush_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Write historical records from the local history queue "
+        "(HISTORY_QUEUE_PATH) to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.HISTORY_BUFFER_BATCH_SIZE,
+            help="Records written per transaction.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.HISTORY_QUEUE_PATH:
+            raise CommandError("HISTORY_QUEUE_PATH is not set.")
+
+        while True:
+            written = flush_queue(options["batch_size"])
+            if written:
+                self.stdout.write(f"Wrote {written} historical records.")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,118 @@
+import os
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.user.images import delete_thumbnails
+from apps.user.models import MediaBlob, User
+from apps.user.storage import TEMP_DIR, is_blob_name, rebuild_references
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete image blobs no user refers to any more, with their thumbnails, "
+        "once they are older than the grace period. Blob files without a "
+        "MediaBlob row, left when the transaction storing them rolled back, "
+        "are deleted too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=int,
+            default=settings.MEDIA_GC_GRACE_HOURS,
+            help="Keep unreferenced blobs stored more recently than this.",
+        )
+        parser.add_argument(
+            "--rebuild-refcounts",
+            action="store_true",
+            help="Recount references from the user table first.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the blobs that would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild_refcounts"]:
+            recounted = rebuild_references()
+            self.stdout.write(f"Recounted references of {recounted} blobs.")
+
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        orphans = MediaBlob.objects.filter(refcount__lte=0, last_stored__lt=cutoff)
+        storage = User._meta.get_field("image").storage
+
+        deleted = 0
+        freed = 0
+        for pk, name, size in orphans.values_list("pk", "name", "size").iterator():
+            if options["dry_run"]:
+                self.stdout.write(f"Would delete {name} ({size} bytes)")
+            else:
+                # Re-checked under a row lock: storing the same content in
+                # the meantime touches last_stored while holding that lock.
+                with transaction.atomic():
+                    blob = orphans.select_for_update(skip_locked=True).filter(pk=pk)
+                    if not blob.exists():
+                        continue
+                    storage.delete(name)
+                    delete_thumbnails(name)
+                    blob.delete()
+            deleted += 1
+            freed += size
+
+        for name, size in self.unregistered_blobs(storage, cutoff):
+            if options["dry_run"]:
+                self.stdout.write(f"Would delete unregistered {name} ({size} bytes)")
+            else:
+                storage.delete(name)
+                delete_thumbnails(name)
+            deleted += 1
+            freed += size
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {deleted} blobs ({freed} bytes).")
+        )
+
+    def unregistered_blobs(self, storage, cutoff):
+        """
+        Yield ``(name, size)`` of the blob files last written before
+        ``cutoff`` that have no MediaBlob row and no user refers to.
+
+        Storing the same content again touches the file, so one about to be
+        adopted by a new row is still within its grace period.
+        """
+        root = storage.path("")
+        candidates = {}
+        for directory, subdirectories, filenames in os.walk(root):
+            if directory == root:
+                # Thumbnails are deleted with their blob; temporary files
+                # are not blobs.
+                subdirectories[:] = [
+                    d for d in subdirectories if d not in ("thumbnails", TEMP_DIR)
+                ]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                if not is_blob_name(name):
+                    continue
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff.timestamp():
+                    candidates[name] = stat.st_size
+
+        names = iter(candidates)
+        while batch := list(islice(names, 1000)):
+            known = set(
+                MediaBlob.objects.filter(name__in=batch).values_list("name", flat=True)
+            )
+            known.update(
+                User.objects.filter(image__in=batch).values_list("image", flat=True)
+            )
+            for name in batch:
+                if name not in known:
+                    yield name, candidates[name]
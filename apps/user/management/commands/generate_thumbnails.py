@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from apps.user.images import process_avatar, thumbnails_exist
+from apps.user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the avatars that have no thumbnails yet: those uploaded "
+        "before thumbnails were introduced and those whose processing "
+        "failed. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Reprocess every avatar, even those with thumbnails.",
+        )
+
+    def handle(self, *args, **options):
+        users = (
+            User.objects.exclude(image="")
+            .exclude(image__isnull=True)
+            .order_by("pk")
+            .values_list("pk", "image")
+        )
+        processed = failed = 0
+        for user_id, image_name in users.iterator():
+            if not options["all"] and thumbnails_exist(image_name):
+                continue
+            try:
+                process_avatar(user_id, image_name)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"User {user_id} ({image_name}): {e}")
+                continue
+            processed += 1
+            if options["verbosity"] > 1:
+                self.stdout.write(f"User {user_id}: {image_name}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Processed {processed} avatars, {failed} failed.")
+        )
@@ -0,0 +1,224 @@
+import re
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.user.history import (
+    get_historical_models,
+    month_start,
+    next_month,
+    prune_orphaned_m2m_history,
+)
+
+PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage monthly range partitions on history_date for the historical "
+        "tables (PostgreSQL only).\n\n"
+        "  setup  convert the tables to partitioned tables (maintenance window)\n"
+        "  create create the partitions for the coming months (run monthly)\n"
+        "  drop   drop partitions older than the retention period"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["setup", "create", "drop"])
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.HISTORY_PARTITION_MONTHS_AHEAD,
+            help="Partitions to keep ready past the current month.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.HISTORY_RETENTION_DAYS,
+            help="Drop partitions that end more than this many days ago.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print the SQL instead of running it.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+        self.dry_run = options["dry_run"]
+
+        for history_model in get_historical_models():
+            table = history_model._meta.db_table
+            if options["action"] == "setup":
+                self.setup(table, options["months_ahead"])
+            elif options["action"] == "create":
+                self.create_partitions(table, options["months_ahead"])
+            else:
+                self.drop_partitions(history_model, options["days"])
+
+    def execute_sql(self, sql: str, params=None):
+        """
+        Run (or, in dry-run mode, print) one statement.
+        """
+        if self.dry_run:
+            self.stdout.write(sql + ";")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def fetch(self, sql: str, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def is_partitioned(self, table: str) -> bool:
+        rows = self.fetch(
+            "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)",
+            [table],
+        )
+        return bool(rows) and rows[0][0] == "p"
+
+    def setup(self, table: str, months_ahead: int):
+        """
+        Rebuild ``table`` as a table partitioned by month on history_date.
+
+        The original table is renamed to ``<table>_legacy`` and copied over,
+        so it can be checked and dropped by hand afterwards. Partitioned
+        tables need the partition key in their primary key, so it becomes
+        (history_id, history_date), and foreign keys pointing at the table
+        (the m2m history tables) are dropped; their orphans are cleaned up
+        by ``drop``. Runs in one transaction and locks the table while
+        copying.
+        """
+        if self.is_partitioned(table):
+            self.stdout.write(f"{table} is already partitioned.")
+            return
+        legacy = f"{table}_legacy"
+        quoted = connection.ops.quote_name(table)
+        quoted_legacy = connection.ops.quote_name(legacy)
+
+        indexes = self.fetch(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "WHERE i.indrelid = to_regclass(%s) AND NOT i.indisprimary",
+            [table],
+        )
+        outgoing = self.fetch(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [table],
+        )
+        incoming = self.fetch(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+            [table],
+        )
+        oldest = self.fetch(f"SELECT MIN(history_date) FROM {quoted}")[0][0]
+
+        with transaction.atomic():
+            self.execute_sql(f"ALTER TABLE {quoted} RENAME TO {quoted_legacy}")
+            for referencing_table, constraint in incoming:
+                self.execute_sql(
+                    f"ALTER TABLE {referencing_table} DROP CONSTRAINT {constraint}"
+                )
+            self.execute_sql(
+                f"CREATE TABLE {quoted} (LIKE {quoted_legacy} INCLUDING DEFAULTS "
+                "INCLUDING IDENTITY INCLUDING GENERATED) "
+                "PARTITION BY RANGE (history_date)"
+            )
+            self.execute_sql(
+                f"ALTER TABLE {quoted} ADD PRIMARY KEY (history_id, history_date)"
+            )
+            for (definition,) in indexes:
+                # Keep the column list, let PostgreSQL name the new index.
+                using = definition[definition.index(" USING ") :]
+                self.execute_sql(f"CREATE INDEX ON {quoted}{using}")
+            for (definition,) in outgoing:
+                self.execute_sql(f"ALTER TABLE {quoted} ADD {definition}")
+
+            first = month_start(oldest.date()) if oldest else None
+            self.create_partitions(table, months_ahead, first=first)
+            self.execute_sql(
+                f"CREATE TABLE {connection.ops.quote_name(table + '_pdefault')} "
+                f"PARTITION OF {quoted} DEFAULT"
+            )
+
+            self.execute_sql(
+                f"INSERT INTO {quoted} OVERRIDING SYSTEM VALUE "
+                f"SELECT * FROM {quoted_legacy}"
+            )
+            self.execute_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'history_id'), "
+                f"COALESCE((SELECT MAX(history_id) FROM {quoted}), 0) + 1, false)"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"{table} partitioned; old data kept in {legacy}.")
+        )
+
+    def create_partitions(self, table: str, months_ahead: int, first: date = None):
+        """
+        Create the monthly partitions from ``first`` (default: this month)
+        through ``months_ahead`` months from now, skipping existing ones.
+        """
+        current = month_start(timezone.localdate())
+        start = first or current
+        last = current
+        for _ in range(months_ahead):
+            last = next_month(last)
+
+        while start <= last:
+            end = next_month(start)
+            name = f"{table}_p{start:%Y%m}"
+            self.execute_sql(
+                f"CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(name)} "
+                f"PARTITION OF {connection.ops.quote_name(table)} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+            start = end
+
+    def drop_partitions(self, history_model, days: int):
+        """
+        Detach and drop every monthly partition that ends before the
+        retention cutoff, then remove the m2m history rows left orphaned.
+        """
+        table = history_model._meta.db_table
+        if not self.is_partitioned(table):
+            self.stdout.write(f"{table} is not partitioned; use prune_history.")
+            return
+        cutoff = (timezone.now() - timedelta(days=days)).date()
+
+        partitions = self.fetch(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [table],
+        )
+        dropped = 0
+        for (name,) in partitions:
+            match = PARTITION_SUFFIX.search(name)
+            if not match:
+                continue
+            start = date(int(match.group(1)), int(match.group(2)), 1)
+            if next_month(start) > cutoff:
+                continue
+            quoted = connection.ops.quote_name(name)
+            self.execute_sql(
+                f"ALTER TABLE {connection.ops.quote_name(table)} "
+                f"DETACH PARTITION {quoted}"
+            )
+            self.execute_sql(f"DROP TABLE {quoted}")
+            dropped += 1
+
+        orphans = 0
+        if dropped and not self.dry_run:
+            orphans = prune_orphaned_m2m_history(
+                history_model, settings.HISTORY_PRUNE_BATCH_SIZE
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{table}: dropped {dropped} partitions, "
+                f"{orphans} orphaned m2m history rows."
+            )
+        )
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.user.history import get_historical_models, prune_history
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete historical records older than the retention period in small "
+        "batches. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.HISTORY_RETENTION_DAYS,
+            help="Keep this many days of history (default: HISTORY_RETENTION_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.HISTORY_PRUNE_BATCH_SIZE,
+            help="Rows deleted per transaction.",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=settings.HISTORY_PRUNE_PAUSE,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches per model; re-run to continue.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many rows would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["days"] or options["days"] < 1:
+            raise CommandError("Retention must be at least one day.")
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        for history_model in get_historical_models():
+            label = history_model._meta.label
+            if options["dry_run"]:
+                found = history_model.objects.filter(history_date__lt=cutoff).count()
+                self.stdout.write(f"{label}: {found} rows older than {cutoff}")
+                continue
+
+            deleted = prune_history(
+                history_model,
+                cutoff,
+                options["batch_size"],
+                pause=options["pause"],
+                max_batches=options["max_batches"],
+                on_batch=(
+                    (lambda count: self.stdout.write(f"{label}: {count} deleted"))
+                    if options["verbosity"] > 1
+                    else None
+                ),
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{label}: deleted {deleted} rows older than {cutoff}"
+                )
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.user.rollup import rebuild_signup_rollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily/weekly/monthly signup rollup from the user table."
+
+    def handle(self, *args, **options):
+        rows = rebuild_signup_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} signup rollup rows."))
@@ -0,0 +1,332 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from apps.user.cache import invalidate_all_permissions
+from apps.user.images import process_avatar
+from apps.user.models import User
+from apps.user.rollup import rebuild_signup_rollup
+from apps.user.storage import rebuild_references
+from apps.user.versions import bump_tables
+
+USER_FIELDS = [
+    "id",
+    "password",
+    "last_login",
+    "is_superuser",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "is_staff",
+    "is_active",
+    "date_joined",
+    "image",
+]
+HISTORY_FIELDS = USER_FIELDS + [
+    "history_id",
+    "history_date",
+    "history_change_reason",
+    "history_type",
+    "history_user_id",
+]
+DIRECT_PERMISSION_RATIO = 0.05
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def next_id(model) -> int:
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+def insert_rows(model, fields, rows):
+    """
+    Insert ``rows`` (tuples of ``fields`` values, by attname) into the
+    table of ``model``.
+
+    PostgreSQL gets a COPY, several times faster than multi-row INSERTs;
+    other databases a bulk_create.
+    """
+    if connection.vendor == "postgresql":
+        quote = connection.ops.quote_name
+        columns = ", ".join(quote(model._meta.get_field(f).column) for f in fields)
+        with connection.cursor() as cursor:
+            with cursor.copy(
+                f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row(row)
+    else:
+        model.objects.bulk_create(model(**dict(zip(fields, row))) for row in rows)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate COUNT users with groups, permissions, avatars and history "
+        "for load testing. Run it against an idle database: ids are assigned "
+        "up front so rows can be COPYed without reading them back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="Number of users to create.")
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument(
+            "--permissions",
+            type=int,
+            default=200,
+            help="Extra permissions to create on the user model.",
+        )
+        parser.add_argument(
+            "--max-groups-per-user",
+            type=int,
+            default=3,
+            help="Each user joins between 0 and this many groups.",
+        )
+        parser.add_argument(
+            "--avatars",
+            type=float,
+            default=0.1,
+            help="Fraction of users given an avatar.",
+        )
+        parser.add_argument(
+            "--avatar-variants",
+            type=int,
+            default=16,
+            help="Distinct avatar images, shared through content addressing.",
+        )
+        parser.add_argument(
+            "--years",
+            type=int,
+            default=3,
+            help="Spread date_joined over this many past years.",
+        )
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+        parser.add_argument(
+            "--no-history",
+            action="store_true",
+            help="Do not write historical rows.",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options["seed"])
+        self.now = timezone.now()
+        started = time.monotonic()
+
+        avatars = self.create_avatars()
+        with transaction.atomic():
+            permission_ids = self.create_permissions()
+            group_ids = self.create_groups(permission_ids)
+            created = self.create_users(avatars, group_ids, permission_ids)
+            self.reset_sequences()
+            rebuild_signup_rollup()
+            if avatars:
+                rebuild_references()
+            # bulk_create sends no signals; users' ETags embed both tables.
+            bump_tables(Group, Permission)
+        invalidate_all_permissions()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {created} users in {time.monotonic() - started:.1f}s."
+            )
+        )
+
+    def log(self, message):
+        if self.options["verbosity"] >= 1:
+            self.stdout.write(message)
+
+    def create_avatars(self):
+        """
+        Store a few distinct avatars and return their sanitized names.
+        """
+        variants = self.options["avatar_variants"]
+        if not self.options["avatars"] or variants < 1:
+            return []
+        storage = User._meta.get_field("image").storage
+        names = []
+        for index in range(variants):
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            image = Image.new("RGB", (256, 256), color)
+            ImageDraw.Draw(image).ellipse((64, 64, 192, 192), fill=color[::-1])
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG")
+            name = storage.save(
+                f"images/{self.options['prefix']}-{index}.png",
+                ContentFile(buffer.getvalue()),
+            )
+            # No user 0: only sanitizes the image and writes thumbnails.
+            names.append(process_avatar(0, name))
+        self.log(f"Stored {len(names)} avatars.")
+        return names
+
+    def create_permissions(self):
+        prefix = self.options["prefix"]
+        content_type = ContentType.objects.get_for_model(User)
+        Permission.objects.bulk_create(
+            [
+                Permission(
+                    codename=f"{prefix}_permission_{index}",
+                    name=f"Seeded permission {index}",
+                    content_type=content_type,
+                )
+                for index in range(self.options["permissions"])
+            ],
+            ignore_conflicts=True,
+        )
+        return list(Permission.objects.values_list("pk", flat=True))
+
+    def create_groups(self, permission_ids):
+        prefix = self.options["prefix"]
+        Group.objects.bulk_create(
+            [
+                Group(name=f"{prefix}-group-{index}")
+                for index in range(self.options["groups"])
+            ],
+            ignore_conflicts=True,
+        )
+        group_ids = list(
+            Group.objects.filter(name__startswith=f"{prefix}-group-").values_list(
+                "pk", flat=True
+            )
+        )
+        through = Group.permissions.through
+        through.objects.bulk_create(
+            [
+                through(group_id=group_id, permission_id=permission_id)
+                for group_id in group_ids
+                for permission_id in self.random.sample(
+                    permission_ids, min(len(permission_ids), 20)
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        self.log(f"Created {len(group_ids)} groups.")
+        return group_ids
+
+    def create_users(self, avatars, group_ids, permission_ids):
+        """
+        Insert the users batch by batch, each with its group memberships,
+        direct permissions and "created" historical rows.
+        """
+        count = self.options["count"]
+        batch_size = self.options["batch_size"]
+        with_history = not self.options["no_history"]
+        history_groups = apps.get_model("user", "HistoricalUser_groups")
+        history_permissions = apps.get_model("user", "HistoricalUser_user_permissions")
+
+        first_user_id = next_id(User)
+        first_history_id = next_id(User.history.model)
+        membership_id = next_id(User.groups.through)
+        grant_id = next_id(User.user_permissions.through)
+        password = make_password(self.options["password"])
+        max_groups = min(self.options["max_groups_per_user"], len(group_ids))
+
+        created = 0
+        for user_ids in chunks(range(first_user_id, first_user_id + count), batch_size):
+            users = [self.user_row(user_id, password, avatars) for user_id in user_ids]
+            memberships = []
+            for user_id in user_ids:
+                for group_id in self.random.sample(
+                    group_ids, self.random.randint(0, max_groups)
+                ):
+                    memberships.append((membership_id, user_id, group_id))
+                    membership_id += 1
+            direct_permissions = []
+            for user_id in user_ids:
+                if self.random.random() < DIRECT_PERMISSION_RATIO:
+                    direct_permissions.append(
+                        (grant_id, user_id, self.random.choice(permission_ids))
+                    )
+                    grant_id += 1
+
+            insert_rows(User, USER_FIELDS, users)
+            insert_rows(User.groups.through, ["id", "user_id", "group_id"], memberships)
+            insert_rows(
+                User.user_permissions.through,
+                ["id", "user_id", "permission_id"],
+                direct_permissions,
+            )
+            if with_history:
+                # history_id follows the user id, so it is known up front.
+                offset = first_history_id - first_user_id
+                insert_rows(
+                    User.history.model,
+                    HISTORY_FIELDS,
+                    [
+                        # history_date is date_joined.
+                        row + (row[0] + offset, row[10], "Seeded", "+", None)
+                        for row in users
+                    ],
+                )
+                insert_rows(
+                    history_groups,
+                    ["id", "user_id", "group_id", "history_id"],
+                    [row + (row[1] + offset,) for row in memberships],
+                )
+                insert_rows(
+                    history_permissions,
+                    ["id", "user_id", "permission_id", "history_id"],
+                    [row + (row[1] + offset,) for row in direct_permissions],
+                )
+            created += len(users)
+            self.log(f"Inserted {created}/{count} users.")
+        return created
+
+    def user_row(self, user_id, password, avatars):
+        prefix = self.options["prefix"]
+        image = ""
+        if avatars and self.random.random() < self.options["avatars"]:
+            image = self.random.choice(avatars)
+        span = self.options["years"] * 365 * 24 * 3600
+        return (
+            user_id,
+            password,
+            None,
+            False,
+            f"{prefix}-{user_id}",
+            "Seeded",
+            f"User {user_id}",
+            f"{prefix}-{user_id}@example.com",
+            False,
+            True,
+            self.now - timedelta(seconds=self.random.randrange(span)),
+            image,
+        )
+
+    def reset_sequences(self):
+        """
+        Move the id sequences past the ids assigned here.
+        """
+        models = [
+            User,
+            User.groups.through,
+            User.user_permissions.through,
+            User.history.model,
+            apps.get_model("user", "HistoricalUser_groups"),
+            apps.get_model("user", "HistoricalUser_user_permissions"),
+        ]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
@@ -0,0 +1,186 @@
+import mimetypes
+import os
+import posixpath
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Blobs written by ContentAddressedStorage are named after their SHA-256.
+DIGEST_NAME = re.compile(r"^[0-9a-f]{64}$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def content_digest(path: str) -> Optional[str]:
+    """
+    Return the digest a content-addressed blob is named after, if any.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if DIGEST_NAME.match(stem) else None
+
+
+def file_etag(path: str, stat: os.stat_result) -> str:
+    """
+    Return a strong ETag for the file at ``path``.
+
+    Content-addressed blobs use their digest; other files their
+    modification time and size, as nginx does.
+    """
+    digest = content_digest(path)
+    if digest:
+        return f'"{digest}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range`` header into an inclusive (start, end).
+
+    Returns None for headers to ignore (multiple ranges, other units) and
+    raises ValueError for a range that does not overlap the file.
+    """
+    match = RANGE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last ``end`` bytes.
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def if_range_matches(request, etag: str, mtime: float) -> bool:
+    """
+    Whether the ``If-Range`` precondition (if any) allows a partial response.
+    """
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def iter_range(file, start: int, length: int):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def offload(path: str, relative_path: str, content_type: str) -> Optional[HttpResponse]:
+    """
+    Return an empty response telling the front proxy to send the file,
+    or None when MEDIA_SENDFILE is not configured.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_SENDFILE == "x-accel-redirect":
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(
+            relative_path
+        )
+    elif settings.MEDIA_SENDFILE == "x-sendfile":
+        response["X-Sendfile"] = path
+    else:
+        return None
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT for production use.
+
+    Sends strong ETag and Last-Modified validators and answers conditional
+    requests with 304. Content-addressed blobs never change, so they are
+    cacheable forever. With MEDIA_SENDFILE set, the transfer itself
+    (including byte ranges) is handed to the front proxy through
+    X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd); otherwise
+    single byte ranges are served from here.
+    """
+    relative_path = posixpath.normpath(path).lstrip("/")
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, relative_path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404("File not found.")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found.")
+
+    etag = file_etag(full_path, stat)
+    last_modified = int(stat.st_mtime)
+
+    def finalize(response):
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        if content_digest(full_path):
+            patch_cache_control(
+                response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+            )
+        else:
+            patch_cache_control(
+                response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE
+            )
+        return response
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        return finalize(not_modified)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+    response = offload(full_path, relative_path, content_type)
+    if response is not None:
+        return finalize(response)
+
+    size = stat.st_size
+
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header and size and if_range_matches(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return finalize(response)
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_range(open(full_path, "rb"), start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return finalize(response)
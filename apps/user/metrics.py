@@ -0,0 +1,354 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+
+from apps.user.cache import permission_cache_stats
+from apps.user.dbpool import pool_stats
+from apps.user.versions import catalog_cache_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+UNMATCHED = "<unmatched>"
+# Other methods are recorded as "other" to bound the label values.
+METHODS = {"GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"}
+
+_current: ContextVar[Optional["RequestMetrics"]] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+class RequestMetrics:
+    """
+    Timings collected while handling one request, in seconds.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total: float, view: float) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+                f"ser;dur={self.serializer * 1000:.1f}",
+                f"view;dur={view * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection, counting the query
+    towards the request being handled in this context, if any.
+
+    The request is looked up in a ContextVar rather than the wrapper being
+    installed per request: under ASGI, queries run on the connections of
+    sync_to_async threads, which inherit the request's context.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class Histogram:
+    """
+    Thread-safe Prometheus histogram keyed by a tuple of label values.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (last is +Inf)..., sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, label_values: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = format_labels(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = format_labels([("le", bound)])
+                lines.append(f"{self.name}_bucket{{{labels},{le}}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def format_labels(pairs: Iterable[tuple]) -> str:
+    return ",".join(
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling the request, middleware included.",
+    ("view", "method"),
+    DURATION_BUCKETS,
+)
+VIEW_DURATION = Histogram(
+    "http_request_view_duration_seconds",
+    "Time spent in the view, rendering included.",
+    ("view", "method"),
+    DURATION_BUCKETS,
+)
+DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing SQL queries per request.",
+    ("view", "method"),
+    DURATION_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL queries executed per request.",
+    ("view", "method"),
+    QUERY_BUCKETS,
+)
+SERIALIZER_DURATION = Histogram(
+    "http_request_serializer_duration_seconds",
+    "Time spent serializing response data per request.",
+    ("view", "method"),
+    DURATION_BUCKETS,
+)
+HISTOGRAMS = [
+    REQUEST_DURATION,
+    VIEW_DURATION,
+    DB_DURATION,
+    DB_QUERIES,
+    SERIALIZER_DURATION,
+]
+
+
+class TimedSerializerMixin:
+    """
+    Count the time spent in to_representation() towards the request's
+    serializer time (see RequestMetricsMiddleware).
+
+    Nested serializers are only counted once, by the outermost one.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_depth -= 1
+            if not metrics.serializer_depth:
+                metrics.serializer += time.perf_counter() - start
+
+
+class RequestMetricsMiddleware:
+    """
+    Record each request's query count, database time, serializer time and
+    view time, aggregated per URL name for the /metrics endpoint and sent
+    back in a Server-Timing header.
+
+    Enabled with REQUEST_METRICS; otherwise Django drops the middleware at
+    startup. Should come first in MIDDLEWARE so the total covers the rest.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        # Connections are per thread: cover those opened from now on, in
+        # any thread, and the ones this thread already has.
+        connection_created.connect(
+            install_query_counter, dispatch_uid="install_query_counter"
+        )
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Django runs a sync process_view() in a thread under ASGI.
+            self.process_view = self._aprocess_view
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics.view_start = time.perf_counter()
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics.view_start = time.perf_counter()
+
+    def _finish(self, request, response, metrics: RequestMetrics):
+        end = time.perf_counter()
+        total = end - metrics.start
+        view = end - metrics.view_start if metrics.view_start else 0.0
+        match = request.resolver_match
+        method = request.method if request.method in METHODS else "other"
+        labels = (match.view_name if match else UNMATCHED, method)
+        REQUEST_DURATION.observe(labels, total)
+        VIEW_DURATION.observe(labels, view)
+        DB_DURATION.observe(labels, metrics.db)
+        DB_QUERIES.observe(labels, metrics.queries)
+        SERIALIZER_DURATION.observe(labels, metrics.serializer)
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing(total, view)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = request._metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = request._metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics)
+
+
+def render_gauges() -> List[str]:
+    """
+    Connection pool and cache counters of this process.
+    """
+    lines = []
+    pools = pool_stats()
+    pool_metrics = [
+        ("db_pool_connections", "gauge", "size", "Connections in the pool."),
+        ("db_pool_connections_idle", "gauge", "idle", "Idle pooled connections."),
+        (
+            "db_pool_connections_checked_out",
+            "gauge",
+            "checked_out",
+            "Pooled connections lent to threads.",
+        ),
+        ("db_pool_waiting", "gauge", "waiting", "Threads waiting for a connection."),
+        (
+            "db_pool_wait_seconds_total",
+            "counter",
+            "wait_ms",
+            "Time spent waiting for a connection.",
+        ),
+        (
+            "db_pool_timeouts_total",
+            "counter",
+            "timeouts",
+            "Checkouts that timed out.",
+        ),
+        (
+            "db_pool_connections_created_total",
+            "counter",
+            "connections_created",
+            "Connections opened.",
+        ),
+        (
+            "db_pool_connections_closed_total",
+            "counter",
+            "connections_closed",
+            "Connections discarded.",
+        ),
+    ]
+    for name, kind, key, help in pool_metrics if pools else []:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        for alias, stats in sorted(pools.items()):
+            value = stats[key] / 1000 if key == "wait_ms" else stats[key]
+            lines.append(f"{name}{{{format_labels([('alias', alias)])}}} {value}")
+
+    cache_counters = [
+        ("permission_cache", "Permission cache", permission_cache_stats),
+        ("catalog_cache", "Group/permission list cache", catalog_cache_stats),
+    ]
+    for prefix, label, stats in cache_counters:
+        cache_stats = stats.as_dict()
+        for result in ("hits", "misses"):
+            name = f"{prefix}_{result}_total"
+            lines += [
+                f"# HELP {name} {label} {result}.",
+                f"# TYPE {name} counter",
+                f"{name} {cache_stats[result]}",
+            ]
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    lines += render_gauges()
+    return "\n".join(lines) + "\n"
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Serve this process's metrics in the Prometheus text format.
+
+    Each worker process aggregates its own requests, so scrape every
+    process (or run one per container). With METRICS_TOKEN set, requests
+    must send it as a bearer token.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not constant_time_compare(
+            request.META.get("HTTP_AUTHORIZATION", ""), expected
+        ):
+            return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
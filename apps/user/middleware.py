@@ -0,0 +1,37 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .history_buffer import abuffered_history, buffered_history
+
+
+class BufferedHistoryMiddleware:
+    """
+    Defer the request's historical INSERTs and write them in bulk at the end.
+
+    Enabled with HISTORY_BUFFERING; otherwise history is written
+    synchronously by simple_history as usual. Must come after
+    simple_history's HistoryRequestMiddleware, which provides the user
+    recorded on each row.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.HISTORY_BUFFERING:
+            return self.get_response(request)
+        with buffered_history():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.HISTORY_BUFFERING:
+            return await self.get_response(request)
+        async with abuffered_history():
+            return await self.get_response(request)
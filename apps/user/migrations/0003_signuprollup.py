@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+def populate_signup_rollup(apps, schema_editor):
+    from apps.user.rollup import rebuild_signup_rollup
+
+    rebuild_signup_rollup(
+        apps.get_model("user", "User"), apps.get_model("user", "SignupRollup")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0002_user_date_joined_id_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SignupRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("day", "Day"), ("week", "Week"), ("month", "Month")],
+                        max_length=5,
+                    ),
+                ),
+                ("start", models.DateField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("period", "start"),
+                        name="signup_rollup_period_start_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_signup_rollup, migrations.RunPython.noop),
+    ]
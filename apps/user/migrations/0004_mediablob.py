@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+import apps.user.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0003_signuprollup"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="image",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=apps.user.models.get_image_storage,
+                upload_to="images/",
+            ),
+        ),
+        migrations.CreateModel(
+            name="MediaBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("size", models.BigIntegerField()),
+                ("refcount", models.IntegerField(default=0)),
+                (
+                    "last_stored",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("refcount__lte", 0)),
+                        fields=["last_stored"],
+                        name="media_blob_orphan_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:33
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+from apps.user.operations import AddIndex
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ("user", "0004_mediablob"),
+    ]
+
+    operations = [
+        # No-op on databases other than PostgreSQL.
+        TrigramExtension(),
+        AddIndex(
+            model_name="user",
+            index=models.Index(fields=["email", "id"], name="user_email_id_idx"),
+        ),
+        AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["last_name", "id"], name="user_last_name_id_idx"
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Lower("username"),
+                name="user_username_lower_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Lower("email"),
+                name="user_email_lower_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Lower("username"),
+                    name="gin_trgm_ops",
+                ),
+                name="user_username_trgm_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Lower("email"), name="gin_trgm_ops"
+                ),
+                name="user_email_trgm_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Lower("first_name"),
+                    name="gin_trgm_ops",
+                ),
+                name="user_first_name_trgm_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="user",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Lower("last_name"),
+                    name="gin_trgm_ops",
+                ),
+                name="user_last_name_trgm_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+from apps.user.operations import AddIndex
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ("user", "0005_user_search_indexes"),
+    ]
+
+    operations = [
+        AddIndex(
+            model_name="user",
+            index=models.Index(fields=["username", "id"], name="user_username_id_idx"),
+        ),
+    ]
@@ -1,13 +1,168 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.files.storage import storages
 from django.db import models
-from simple_history.models import HistoricalRecords
+from django.db.models.functions import Lower
+from django.utils import timezone
 from simple_history import register
 from django.contrib.auth.models import Group, Permission
+from rest_framework_simplejwt.models import TokenUser
 
-register(Group)
-register(Permission)
+from .history_buffer import BufferedHistoricalRecords
+
+
+def get_history_user(request, **kwargs):
+    """
+    Return the user to record on historical rows.
+
+    Requests authenticated from token claims carry a TokenUser, which
+    cannot be assigned to the history_user foreign key; only its id is
+    needed, so it is swapped for an unsaved User with that primary key.
+    """
+    user = getattr(request, "user", None)
+    if isinstance(user, TokenUser):
+        return User(pk=user.pk)
+    return user
+
+
+def get_image_storage():
+    """
+    Return the storage for user images, ``STORAGES["images"]``.
+    """
+    return storages["images"]
+
+
+def display_name(first_name: str, last_name: str, email: str) -> str:
+    """
+    Full name of a user, falling back to the email when unset.
+    """
+    name = f"{first_name} {last_name}"
+    if name.strip() == "":
+        name = email
+    return name.strip()
+
+
+# User fields that change what the user may do, and are signed into its
+# tokens (see apps.user.signals).
+PERMISSION_FLAGS = ("is_active", "is_staff", "is_superuser")
+
+
+register(Group, records_class=BufferedHistoricalRecords, get_user=get_history_user)
+register(Permission, records_class=BufferedHistoricalRecords, get_user=get_history_user)
 
 
 class User(AbstractUser):
-    image = models.ImageField(upload_to="images/", null=True, blank=True)
-    history = HistoricalRecords(m2m_fields=["groups", "user_permissions"])
+    image = models.ImageField(
+        upload_to="images/", storage=get_image_storage, null=True, blank=True
+    )
+    history = BufferedHistoricalRecords(
+        m2m_fields=["groups", "user_permissions"], get_user=get_history_user
+    )
+
+    @property
+    def display_name(self) -> str:
+        """
+        Full name of the user, falling back to the email when unset.
+        """
+        return display_name(self.first_name, self.last_name, self.email)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user._loaded_flags = {
+            name: value
+            for name, value in zip(field_names, values)
+            if name in PERMISSION_FLAGS
+        }
+        return user
+
+    def permission_flags_changed(self, update_fields=None) -> bool:
+        """
+        Whether a save may have changed PERMISSION_FLAGS since the user was
+        loaded or last saved.
+
+        Users not loaded from the database (or loaded without the flags)
+        count as changed.
+        """
+        if update_fields is not None and not set(update_fields) & set(PERMISSION_FLAGS):
+            return False
+        loaded = getattr(self, "_loaded_flags", {})
+        return any(
+            name not in loaded or loaded[name] != getattr(self, name)
+            for name in PERMISSION_FLAGS
+        )
+
+    def remember_permission_flags(self):
+        self._loaded_flags = {name: getattr(self, name) for name in PERMISSION_FLAGS}
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Backs the keyset pagination of the user list.
+            models.Index(fields=["date_joined", "id"], name="user_date_joined_id_idx"),
+            # Sorted cursor pages (see apps.user.filters.ORDERING_FIELDS).
+            models.Index(fields=["username", "id"], name="user_username_id_idx"),
+            models.Index(fields=["email", "id"], name="user_email_id_idx"),
+            models.Index(fields=["last_name", "id"], name="user_last_name_id_idx"),
+            # Case-insensitive username/email filters.
+            models.Index(Lower("username"), name="user_username_lower_idx"),
+            models.Index(Lower("email"), name="user_email_lower_idx"),
+            # Substring search (PostgreSQL only, see migration 0005).
+            *[
+                GinIndex(
+                    OpClass(Lower(field), name="gin_trgm_ops"),
+                    name=f"user_{field}_trgm_idx",
+                )
+                for field in ("username", "email", "first_name", "last_name")
+            ],
+        ]
+
+
+class SignupRollup(models.Model):
+    """
+    Number of users that joined per day, ISO week and month.
+
+    Maintained incrementally as users are created and deleted (see
+    apps.user.rollup) and rebuilt from scratch with the
+    ``rebuild_signup_rollup`` management command, so the dashboard reads a
+    handful of rows instead of scanning the user table.
+    """
+
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    PERIOD_CHOICES = [(DAY, "Day"), (WEEK, "Week"), (MONTH, "Month")]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "start"], name="signup_rollup_period_start_uniq"
+            ),
+        ]
+
+
+class MediaBlob(models.Model):
+    """
+    A file stored once by ContentAddressedStorage, with the number of
+    users whose image points at it.
+
+    Blobs whose refcount dropped to zero are removed by the ``gc_media``
+    management command once they are older than a grace period.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    last_stored = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["last_stored"],
+                condition=models.Q(refcount__lte=0),
+                name="media_blob_orphan_idx",
+            ),
+        ]
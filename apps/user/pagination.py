@@ -0,0 +1,224 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections, transaction
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the user list.
+
+    Pages are addressed by an opaque cursor holding every ordering value
+    of the last row, ``(date_joined, id)`` by default, instead of an
+    offset. The ordering always ends in ``id`` (see UserOrderingFilter),
+    so positions are unique and a page costs the same ``(field, id)``
+    index range scan however deep into the table, or into a group of
+    equal values, the client is.
+    """
+
+    ordering = ("date_joined", "id")
+    page_size = settings.USER_LIST_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.USER_LIST_MAX_PAGE_SIZE
+
+    # CursorPagination.paginate_queryset, split around the one query it
+    # runs so that apaginate_queryset() can await it instead.
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.build_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.build_page([obj async for obj in queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Return the slice of ``queryset`` holding the requested page plus
+        one extra row, or None when pagination is disabled.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = (0, False, None)
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(
+                    self.after_position(current_position, reverse)
+                )
+            except (ValueError, TypeError, ValidationError):
+                # Values of the wrong type for the fields, e.g. a cursor
+                # from another ordering.
+                raise NotFound(self.invalid_cursor_message)
+
+        self._cursor_state = (offset, reverse, current_position)
+        return queryset[offset : offset + self.page_size + 1]
+
+    def after_position(self, position: str, reverse: bool) -> Q:
+        """
+        Match the rows that sort after ``position`` in the direction read.
+
+        ``(a, id) > (x, y)`` is spelled ``a >= x AND (a > x OR (a = x AND
+        id > y))``: the leading condition gives the planner the index range.
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for order, value in zip(self.ordering, values):
+            attr = order.lstrip("-")
+            lookup = "__lt" if reverse != order.startswith("-") else "__gt"
+            condition |= Q(**equal, **{attr + lookup: value})
+            equal[attr] = value
+        lookup = "__lte" if reverse != self.ordering[0].startswith("-") else "__gte"
+        return Q(**{self.ordering[0].lstrip("-") + lookup: values[0]}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            attr = order.lstrip("-")
+            if isinstance(instance, dict):
+                values.append(str(instance[attr]))
+            else:
+                values.append(str(getattr(instance, attr)))
+        return json.dumps(values)
+
+    def build_page(self, results):
+        """
+        Set the next/previous positions from the fetched rows and return
+        the page.
+        """
+        offset, reverse, current_position = self._cursor_state
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator that avoids exact ``COUNT(*)`` on large tables.
+
+    On PostgreSQL, an unfiltered changelist reports the planner statistics
+    (``pg_class.reltuples``) once the table is past
+    ADMIN_ESTIMATED_COUNT_THRESHOLD rows. Filtered changelists still get an
+    exact count, but under a ADMIN_COUNT_TIMEOUT_MS statement timeout; when
+    that fires, the planner's row estimate for the filtered query is used.
+    Other database backends always count exactly.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return queryset.count()
+
+        if not queryset.query.where:
+            estimate = self._table_estimate(queryset)
+            if estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return self._capped_count(queryset)
+
+    def _table_estimate(self, queryset) -> int:
+        """
+        Return the planner's row estimate for the whole table.
+
+        ``reltuples`` is -1 for tables that were never analyzed, which is
+        below any threshold and so falls through to an exact count.
+        """
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else -1
+
+    def _capped_count(self, queryset) -> int:
+        """
+        Count exactly, falling back to the plan estimate on timeout.
+        """
+        set_timeout = "SELECT set_config('statement_timeout', %s, true)"
+        with transaction.atomic(using=queryset.db):
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("SHOW statement_timeout")
+                previous_timeout = cursor.fetchone()[0]
+                cursor.execute(set_timeout, [str(settings.ADMIN_COUNT_TIMEOUT_MS)])
+                try:
+                    # Savepoint, so a cancelled count leaves the transaction
+                    # usable for the EXPLAIN below.
+                    with transaction.atomic(using=queryset.db):
+                        return queryset.count()
+                except OperationalError:
+                    return self._plan_estimate(queryset)
+                finally:
+                    # Restore explicitly: when called inside an outer
+                    # transaction the local setting would outlive this block.
+                    cursor.execute(set_timeout, [previous_timeout])
+
+    def _plan_estimate(self, queryset) -> int:
+        """
+        Return the planner's row estimate for the filtered query.
+        """
+        plan = json.loads(queryset.explain(format="json"))
+        if isinstance(plan, list):
+            plan = plan[0]
+        return int(plan["Plan"]["Plan Rows"])
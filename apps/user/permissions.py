@@ -1,5 +1,7 @@
 from rest_framework.permissions import DjangoModelPermissions
 
+from .cache import user_has_perms
+
 
 class CustomPermission(DjangoModelPermissions):
     perms_map = {
@@ -11,3 +13,22 @@ class CustomPermission(DjangoModelPermissions):
         "PATCH": ["%(app_label)s.change_%(model_name)s"],
         "DELETE": ["%(app_label)s.delete_%(model_name)s"],
     }
+
+    def has_permission(self, request, view):
+        """
+        Same check as DjangoModelPermissions, but against the cached
+        permission set so steady-state requests run no permission queries.
+        """
+        if not request.user or (
+            not request.user.is_authenticated and self.authenticated_users_only
+        ):
+            return False
+
+        # Workaround to ensure DjangoModelPermissions are not applied
+        # to the root view when using DefaultRouter.
+        if getattr(view, "_ignore_model_permissions", False):
+            return True
+
+        queryset = self._queryset(view)
+        perms = self.get_required_permissions(request.method, queryset.model)
+        return user_has_perms(request.user, perms)
@@ -0,0 +1,149 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import SignupRollup, User
+
+
+def period_start(day: date, period: str) -> date:
+    """
+    Return the first day of the day/week/month bucket containing ``day``.
+
+    Weeks start on Monday, matching the database ``week`` truncation.
+    """
+    if period == SignupRollup.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == SignupRollup.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def previous_start(start: date, period: str) -> date:
+    """
+    Return the start of the bucket right before the one starting at ``start``.
+    """
+    if period == SignupRollup.WEEK:
+        return start - timedelta(weeks=1)
+    if period == SignupRollup.MONTH:
+        return (start - timedelta(days=1)).replace(day=1)
+    return start - timedelta(days=1)
+
+
+def record_signups(joined: Iterable[datetime], delta: int = 1):
+    """
+    Add ``delta`` to every bucket of each join timestamp.
+
+    Timestamps are first folded into one counter per bucket, so a bulk
+    import of thousands of users still costs a couple of queries per
+    touched bucket. Counts are applied with F() updates to stay correct
+    under concurrent signups.
+    """
+    changes = Counter()
+    for joined_at in joined:
+        day = timezone.localtime(joined_at).date()
+        for period, _ in SignupRollup.PERIOD_CHOICES:
+            changes[(period, period_start(day, period))] += delta
+
+    with transaction.atomic():
+        for (period, start), amount in changes.items():
+            rollup, _ = SignupRollup.objects.get_or_create(period=period, start=start)
+            SignupRollup.objects.filter(pk=rollup.pk).update(count=F("count") + amount)
+
+
+def rebuild_signup_rollup(user_model=User, rollup_model=SignupRollup) -> int:
+    """
+    Recompute the whole rollup table from the user table.
+
+    The models are parameters so data migrations can pass their historical
+    versions. Returns the number of rollup rows written.
+    """
+    rows = []
+    for period, _ in SignupRollup.PERIOD_CHOICES:
+        buckets = (
+            user_model.objects.annotate(
+                start=Trunc("date_joined", period, output_field=DateField())
+            )
+            .values("start")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        rows.extend(
+            rollup_model(period=period, start=bucket["start"], count=bucket["count"])
+            for bucket in buckets
+        )
+
+    with transaction.atomic():
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def bucket_starts(
+    period: str, buckets: int, today: Optional[date] = None
+) -> List[date]:
+    """
+    Return the start dates of the last ``buckets`` buckets, oldest first.
+    """
+    if today is None:
+        today = timezone.localdate()
+    starts = [period_start(today, period)]
+    for _ in range(buckets - 1):
+        starts.append(previous_start(starts[-1], period))
+    starts.reverse()
+    return starts
+
+
+def _series_rows(period: str, starts: List[date]):
+    return SignupRollup.objects.filter(
+        period=period, start__gte=starts[0], start__lte=starts[-1]
+    ).values_list("start", "count")
+
+
+def signup_series(
+    period: str, buckets: int, today: Optional[date] = None
+) -> List[Tuple[date, int]]:
+    """
+    Return ``(bucket_start, signups)`` for the last ``buckets`` buckets.
+
+    Reads at most ``buckets`` rollup rows through the unique index;
+    buckets without a row are filled with zero.
+    """
+    starts = bucket_starts(period, buckets, today)
+    counts = dict(_series_rows(period, starts))
+    return [(start, counts.get(start, 0)) for start in starts]
+
+
+async def asignup_series(
+    period: str, buckets: int, today: Optional[date] = None
+) -> List[Tuple[date, int]]:
+    """
+    Async version of signup_series().
+    """
+    starts = bucket_starts(period, buckets, today)
+    counts = {start: count async for start, count in _series_rows(period, starts)}
+    return [(start, counts.get(start, 0)) for start in starts]
+
+
+def total_signups() -> int:
+    """
+    Return the number of users, summed from the monthly buckets.
+    """
+    total = SignupRollup.objects.filter(period=SignupRollup.MONTH).aggregate(
+        total=Sum("count")
+    )["total"]
+    return total or 0
+
+
+async def atotal_signups() -> int:
+    """
+    Async version of total_signups().
+    """
+    totals = await SignupRollup.objects.filter(period=SignupRollup.MONTH).aaggregate(
+        total=Sum("count")
+    )
+    return totals["total"] or 0
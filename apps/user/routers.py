@@ -0,0 +1,209 @@
+import base64
+import json
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+PIN_KEY = "db:pin:{user_id}"
+
+_use_replicas: ContextVar[bool] = ContextVar("use_replicas", default=False)
+
+
+@contextmanager
+def read_from_replicas(enabled: bool = True):
+    """
+    Route the ORM reads made inside the block to the replicas (or, with
+    ``enabled=False``, back to the primary).
+    """
+    token = _use_replicas.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replicas.reset(token)
+
+
+def read_from_primary():
+    """
+    Read from the primary inside the block, e.g. to fill a cache that must
+    not be populated with data a replica has not caught up with yet.
+    """
+    return read_from_replicas(False)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a random replica while read_from_replicas() is active
+    (ReplicaRoutingMiddleware enables it for safe requests) and everything
+    else to the primary.
+
+    Reads inside a transaction on the primary stay there so they see the
+    transaction's own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not (_use_replicas.get() and settings.DATABASE_REPLICAS):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def _pin_cache():
+    return caches[settings.DATABASE_REPLICA_PIN_CACHE_ALIAS]
+
+
+def token_user_id(request) -> Optional[str]:
+    """
+    Return the user id claim of the request's bearer token, unverified.
+
+    Only used to look up a read-your-writes pin: a forged token can at
+    worst send its own reads to the primary, and authentication still
+    verifies it as usual.
+    """
+    header = request.META.get(jwt_settings.AUTH_HEADER_NAME, "").split()
+    if len(header) != 2 or header[0] not in jwt_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        payload = header[1].split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return str(claims[jwt_settings.USER_ID_CLAIM])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _cookie_pinned(request) -> bool:
+    try:
+        pinned_until = float(request.COOKIES[settings.DATABASE_REPLICA_PIN_COOKIE])
+    except (KeyError, ValueError):
+        return False
+    return pinned_until > time.time()
+
+
+def is_pinned(request) -> bool:
+    """
+    Whether the client wrote recently enough that replicas may lag behind.
+    """
+    if _cookie_pinned(request):
+        return True
+    user_id = token_user_id(request)
+    return user_id is not None and bool(
+        _pin_cache().get(PIN_KEY.format(user_id=user_id))
+    )
+
+
+async def ais_pinned(request) -> bool:
+    """
+    Async version of is_pinned().
+    """
+    if _cookie_pinned(request):
+        return True
+    user_id = token_user_id(request)
+    return user_id is not None and bool(
+        await _pin_cache().aget(PIN_KEY.format(user_id=user_id))
+    )
+
+
+def _pin_cookie(response):
+    seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+    response.set_cookie(
+        settings.DATABASE_REPLICA_PIN_COOKIE,
+        "%d" % (time.time() + seconds),
+        max_age=seconds,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def pin(request, response):
+    """
+    Keep the client's reads on the primary for DATABASE_REPLICA_PIN_SECONDS.
+
+    The cookie covers clients that keep cookies, and a pin keyed by the
+    token's user id covers API clients that only send their token (and
+    the user's other devices).
+    """
+    _pin_cookie(response)
+    user_id = token_user_id(request)
+    if user_id is not None:
+        _pin_cache().set(
+            PIN_KEY.format(user_id=user_id),
+            True,
+            timeout=settings.DATABASE_REPLICA_PIN_SECONDS,
+        )
+
+
+async def apin(request, response):
+    """
+    Async version of pin().
+    """
+    _pin_cookie(response)
+    user_id = token_user_id(request)
+    if user_id is not None:
+        await _pin_cache().aset(
+            PIN_KEY.format(user_id=user_id),
+            True,
+            timeout=settings.DATABASE_REPLICA_PIN_SECONDS,
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve safe requests from the replicas (see ReplicaRouter) unless the
+    client is pinned to the primary after a write of its own.
+
+    Does nothing when no DATABASE_REPLICAS are configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        with read_from_replicas(safe and not is_pinned(request)):
+            response = self.get_response(request)
+        if not safe and response.status_code < 400:
+            pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        with read_from_replicas(safe and not await ais_pinned(request)):
+            response = await self.get_response(request)
+        if not safe and response.status_code < 400:
+            await apin(request, response)
+        return response
@@ -1,9 +1,23 @@
-from django.contrib.auth.models import Group, Permission
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import Group, Permission, update_last_login
+from django.db.models import Prefetch
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.relations import MANY_RELATION_KWARGS
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenObtainSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
 
-from .models import User
+from .authentication import get_token_claims
+from .images import existing_thumbnails, thumbnail_urls
+from .metrics import TimedSerializerMixin
+from .models import User, display_name
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -11,10 +25,51 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     Custom TokenObtainPairSerializer that adds user data to the token response.
     """
 
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token.payload.update(get_token_claims(user))
+        return token
+
     def validate(self, attrs):
-        data = super().validate(attrs)
+        # TokenObtainSerializer.validate() authenticates and sets self.user;
+        # the tokens and payload are built by token_data().
+        TokenObtainSerializer.validate(self, attrs)
+        return self.token_data(self.user)
+
+    async def avalidate(self, attrs):
+        """
+        Async validate(): the password check is awaited (see
+        apps.user.backends.PooledPasswordBackend).
+        """
+        self.user = await aauthenticate(
+            self.context.get("request"),
+            **{
+                self.username_field: attrs[self.username_field],
+                "password": attrs["password"],
+            },
+        )
+        if not api_settings.USER_AUTHENTICATION_RULE(self.user):
+            raise AuthenticationFailed(
+                self.error_messages["no_active_account"],
+                "no_active_account",
+            )
+        return await sync_to_async(self.token_data)(self.user)
+
+    def token_data(self, user):
+        """
+        Build the login response for an authenticated user.
+        """
+        refresh = self.get_token(user)
+        data = {"refresh": str(refresh), "access": str(refresh.access_token)}
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
 
-        serializer = UserSerializerWithToken(self.user).data
+        # Reuse the access token signed above instead of letting
+        # UserSerializerWithToken sign a second one.
+        serializer = UserSerializerWithToken(
+            user, context={"access_token": data["access"]}
+        ).data
 
         for k, v in serializer.items():
             data[k] = v
@@ -28,10 +83,50 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         pass
 
 
-class UserSerializer(serializers.ModelSerializer):
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    TokenRefreshSerializer that re-embeds the user's current authorization
+    claims, so a refreshed access token reflects group/permission changes.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(
+                self.error_messages["no_active_account"],
+                "no_active_account",
+            )
+
+        refresh.payload.update(get_token_claims(user))
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # Blacklist app not installed
+                    pass
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+
+            data["refresh"] = str(refresh)
+
+        return data
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField(read_only=True)
     _id = serializers.SerializerMethodField(read_only=True)
     isAdmin = serializers.SerializerMethodField(read_only=True)
+    thumbnails = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
@@ -41,6 +136,7 @@ class UserSerializer(serializers.ModelSerializer):
             "email",
             "name",
             "image",
+            "thumbnails",
             "_id",
             "isAdmin",
             "is_active",
@@ -55,10 +151,10 @@ class UserSerializer(serializers.ModelSerializer):
         return obj.is_staff
 
     def get_name(self, obj: User):
-        name = f"{obj.first_name} {obj.last_name}"
-        if name.strip() == "":
-            name = obj.email
-        return name.strip()
+        return obj.display_name
+
+    def get_thumbnails(self, obj: User):
+        return thumbnail_urls(obj.image, self.context.get("request"))
 
 
 class UserSerializerWithToken(UserSerializer):
@@ -74,30 +170,76 @@ class UserSerializerWithToken(UserSerializer):
             "name",
             "isAdmin",
             "image",
+            "thumbnails",
             "token",
         ]
 
     def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
+        access_token = self.context.get("access_token")
+        if access_token is None:
+            refresh = MyTokenObtainPairSerializer.get_token(obj)
+            access_token = str(refresh.access_token)
+        return access_token
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    ManyRelatedField that looks up every submitted primary key in one IN
+    query, instead of one query per key.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+
+        child = self.child_relation
+        for item in data:
+            if isinstance(item, bool) or not isinstance(item, (int, str)):
+                child.fail("incorrect_type", data_type=type(item).__name__)
+        try:
+            found = {
+                str(obj.pk): obj for obj in child.get_queryset().filter(pk__in=data)
+            }
+        except (TypeError, ValueError):
+            # Only a string that is not a valid key gets here.
+            child.fail("incorrect_type", data_type=str.__name__)
+        for item in data:
+            if str(item) not in found:
+                child.fail("does_not_exist", pk_value=item)
+        return [found[str(item)] for item in data]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
 
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     class Meta:
         model = Group
         fields = "__all__"
 
 
-class PermissionSerializer(serializers.ModelSerializer):
+class PermissionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Permission
         fields = "__all__"
 
 
-class UserSerializerWithNames(serializers.ModelSerializer):
+class UserSerializerWithNames(TimedSerializerMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField(read_only=True)
     _id = serializers.SerializerMethodField(read_only=True)
     isAdmin = serializers.SerializerMethodField(read_only=True)
+    thumbnails = serializers.SerializerMethodField(read_only=True)
     groups = GroupSerializer(read_only=True, many=True)
     permissions = PermissionSerializer(
         read_only=True, many=True, source="user_permissions"
@@ -118,10 +260,31 @@ class UserSerializerWithNames(serializers.ModelSerializer):
             "date_joined",
             "last_login",
             "image",
+            "thumbnails",
             "groups",
             "permissions",
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Prefetch every relation rendered by this serializer.
+
+        Groups (and their permissions) and user permissions are loaded in
+        one query per relation for the whole queryset, so serializing a
+        page of users costs a constant number of queries.
+        """
+        return queryset.prefetch_related(
+            Prefetch(
+                "groups",
+                queryset=Group.objects.order_by("pk").prefetch_related("permissions"),
+            ),
+            Prefetch(
+                "user_permissions",
+                queryset=Permission.objects.select_related("content_type"),
+            ),
+        )
+
     def get__id(self, obj: User):
         return obj.id
 
@@ -129,12 +292,182 @@ class UserSerializerWithNames(serializers.ModelSerializer):
         return obj.is_staff
 
     def get_name(self, obj: User):
-        name = f"{obj.first_name} {obj.last_name}"
-        if name.strip() == "":
-            name = obj.email
-        return name.strip()
+        return obj.display_name
+
+    def get_thumbnails(self, obj: User):
+        return thumbnail_urls(obj.image, self.context.get("request"))
 
     # def get_image(self, obj: User):
     #     if obj.image:
     #         return obj.image.url
     #     return None
+
+
+def _permission_ordering(prefix: str = "") -> list:
+    """
+    Permission's default ordering, for querying through ``prefix``.
+    """
+    return [prefix + field for field in Permission._meta.ordering]
+
+
+class UserValuesSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    """
+    Read-only UserSerializerWithNames for pages of users, built from
+    ``values()`` rows instead of model instances.
+
+    The payloads are the same (keys, order and formatting), but no user,
+    group or permission object is created and no serializer field runs per
+    value. Rows come from values(); load() attaches each user's groups and
+    permissions, fetched as through-table rows in one query per relation
+    and grouped per user in Python. Groups are listed by id and
+    permissions in Permission's default ordering, as
+    UserSerializerWithNames.setup_eager_loading() loads them.
+
+        rows = UserValuesSerializer.load(list(UserValuesSerializer.values(qs)))
+        data = UserValuesSerializer(rows, context={"request": request}).data
+    """
+
+    value_fields = (
+        "id",
+        "username",
+        "first_name",
+        "last_name",
+        "email",
+        "is_staff",
+        "is_active",
+        "date_joined",
+        "last_login",
+        "image",
+    )
+    datetime_field = serializers.DateTimeField()
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.value_fields)
+
+    @staticmethod
+    def related_querysets(user_ids) -> tuple:
+        """
+        Return the queries for the memberships, the group permissions and
+        the direct permissions of ``user_ids``.
+        """
+        memberships = User.groups.through.objects.filter(user_id__in=user_ids)
+        group_permissions = Group.permissions.through.objects.filter(
+            group_id__in=memberships.values("group_id")
+        )
+        user_permissions = User.user_permissions.through.objects.filter(
+            user_id__in=user_ids
+        )
+        return (
+            memberships.order_by("group_id").values_list(
+                "user_id", "group_id", "group__name"
+            ),
+            group_permissions.order_by(
+                *_permission_ordering("permission__")
+            ).values_list("group_id", "permission_id"),
+            user_permissions.order_by(
+                *_permission_ordering("permission__")
+            ).values_list(
+                "user_id",
+                "permission_id",
+                "permission__name",
+                "permission__codename",
+                "permission__content_type_id",
+            ),
+        )
+
+    @classmethod
+    def load(cls, rows: list) -> list:
+        """
+        Attach the groups and permissions of every user in ``rows``.
+        """
+        if rows:
+            querysets = cls.related_querysets([row["id"] for row in rows])
+            cls._attach(rows, *(list(queryset) for queryset in querysets))
+        return rows
+
+    @classmethod
+    async def aload(cls, rows: list) -> list:
+        """
+        Async version of load().
+        """
+        if rows:
+            related = []
+            for queryset in cls.related_querysets([row["id"] for row in rows]):
+                related.append([item async for item in queryset])
+            cls._attach(rows, *related)
+        return rows
+
+    @staticmethod
+    def _attach(rows, memberships, group_permissions, user_permissions):
+        permission_ids = defaultdict(list)
+        for group_id, permission_id in group_permissions:
+            permission_ids[group_id].append(permission_id)
+
+        # A group is rendered the same for every member: build it once.
+        group_payloads = {}
+        groups = defaultdict(list)
+        for user_id, group_id, name in memberships:
+            group = group_payloads.get(group_id)
+            if group is None:
+                group = group_payloads[group_id] = {
+                    "id": group_id,
+                    "name": name,
+                    "permissions": permission_ids[group_id],
+                }
+            groups[user_id].append(group)
+
+        permissions = defaultdict(list)
+        for user_id, permission_id, name, codename, content_type in user_permissions:
+            permissions[user_id].append(
+                {
+                    "id": permission_id,
+                    "name": name,
+                    "codename": codename,
+                    "content_type": content_type,
+                }
+            )
+
+        for row in rows:
+            row["groups"] = groups.get(row["id"], [])
+            row["permissions"] = permissions.get(row["id"], [])
+
+    def to_representation(self, rows):
+        request = self.context.get("request")
+        storage = User._meta.get_field("image").storage
+        datetime = self.datetime_field.to_representation
+        # One cache round trip for the whole page.
+        thumbnails = existing_thumbnails({row["image"] for row in rows if row["image"]})
+        data = []
+        for row in rows:
+            image = row["image"]
+            image_url = None
+            if image:
+                # What ImageField renders: the storage URL, made absolute.
+                image_url = storage.url(image)
+                if request is not None:
+                    image_url = request.build_absolute_uri(image_url)
+            data.append(
+                {
+                    "id": row["id"],
+                    "username": row["username"],
+                    "first_name": row["first_name"],
+                    "last_name": row["last_name"],
+                    "email": row["email"],
+                    "name": display_name(
+                        row["first_name"], row["last_name"], row["email"]
+                    ),
+                    "_id": row["id"],
+                    "isAdmin": row["is_staff"],
+                    "is_active": row["is_active"],
+                    "date_joined": datetime(row["date_joined"]),
+                    "last_login": datetime(row["last_login"]),
+                    "image": image_url,
+                    "thumbnails": thumbnail_urls(
+                        image, request, exists=image in thumbnails
+                    ),
+                    "groups": row["groups"],
+                    "permissions": row["permissions"],
+                }
+            )
+        return data
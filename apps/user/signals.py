@@ -0,0 +1,177 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_all_permissions, invalidate_user_permissions
+from .models import User
+from .rollup import record_signups
+from .storage import update_references
+from .versions import bump_rows, bump_tables
+
+M2M_CHANGE_ACTIONS = ("post_add", "post_remove", "post_clear")
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_permissions_on_user_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Invalidate cached permissions when a user's groups or permissions change.
+    """
+    if action not in M2M_CHANGE_ACTIONS:
+        return
+    if not reverse:
+        invalidate_user_permissions([instance.pk])
+    elif pk_set:
+        # Changed from the group/permission side: pk_set holds user ids.
+        invalidate_user_permissions(pk_set)
+    else:
+        # A reverse clear() does not report which users were affected.
+        invalidate_all_permissions()
+
+
+@receiver(post_save, sender=User)
+def invalidate_permissions_on_user_save(
+    sender, instance, created, update_fields, **kwargs
+):
+    """
+    Invalidate a user's cached permissions when a save changes one of
+    PERMISSION_FLAGS: inactive users have no permissions, superusers have
+    them all, and all three are signed into stateless tokens, which the
+    new version revokes. Other saves (profile edits) keep both.
+    """
+    if not created and instance.permission_flags_changed(update_fields):
+        invalidate_user_permissions([instance.pk])
+    instance.remember_permission_flags()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_permissions_on_group_change(sender, action, **kwargs):
+    """
+    Invalidate every user's cached permissions when group permissions change.
+    """
+    if action in M2M_CHANGE_ACTIONS:
+        invalidate_all_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_permissions_on_delete(sender, **kwargs):
+    """
+    Deleting a group or permission cascades to the through tables
+    without sending m2m_changed.
+    """
+    invalidate_all_permissions()
+
+
+@receiver(post_save, sender=User)
+def record_signup_on_create(sender, instance, created, **kwargs):
+    """
+    Count a new user in the signup rollup.
+    """
+    if created:
+        record_signups([instance.date_joined])
+
+
+@receiver(post_delete, sender=User)
+def record_signup_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted user from the signup rollup.
+    """
+    record_signups([instance.date_joined], delta=-1)
+
+
+def _image_name(value) -> str:
+    return getattr(value, "name", value) or ""
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_image(sender, instance, raw, update_fields, **kwargs):
+    """
+    Look up the image name currently stored for the user, so the blob
+    reference can be moved after the save.
+    """
+    if raw or (update_fields is not None and "image" not in update_fields):
+        return
+    stored = None
+    if not instance._state.adding:
+        stored = (
+            User.objects.filter(pk=instance.pk).values_list("image", flat=True).first()
+        )
+    instance._stored_image = stored or ""
+
+
+@receiver(post_save, sender=User)
+def count_image_references_on_save(sender, instance, **kwargs):
+    """
+    Move the image blob reference when a user's image changes.
+    """
+    stored = instance.__dict__.pop("_stored_image", None)
+    if stored is not None:
+        update_references(stored, _image_name(instance.image))
+
+
+@receiver(post_delete, sender=User)
+def count_image_references_on_delete(sender, instance, **kwargs):
+    """
+    Release the image blob of a deleted user.
+    """
+    if "image" in instance.__dict__:
+        update_references(_image_name(instance.__dict__["image"]), "")
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_version(sender, instance, **kwargs):
+    """
+    Expire the ETag of a saved or deleted user.
+    """
+    bump_rows(User, [instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def bump_user_version_on_m2m_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Expire the ETags of users whose groups or direct permissions changed.
+    """
+    if action not in M2M_CHANGE_ACTIONS:
+        return
+    if not reverse:
+        bump_rows(User, [instance.pk])
+    elif pk_set:
+        bump_rows(User, pk_set)
+    else:
+        # A reverse clear() does not report the users; every user's ETag
+        # includes the group and permission table stamps.
+        bump_tables(type(instance))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+def bump_table_version(sender, **kwargs):
+    """
+    Expire the ETags of the group or permission catalog.
+    """
+    bump_tables(sender)
+
+
+@receiver(post_delete, sender=Permission)
+def bump_table_versions_on_permission_delete(sender, **kwargs):
+    """
+    The delete also cascades to the groups' permission lists.
+    """
+    bump_tables(Permission, Group)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def bump_group_version_on_permission_change(sender, action, **kwargs):
+    """
+    Groups are rendered with their permission ids.
+    """
+    if action in M2M_CHANGE_ACTIONS:
+        bump_tables(Group)
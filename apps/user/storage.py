@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# Kept from the uploaded name when it looks like a plain file extension.
+EXTENSION = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+TEMP_DIR = "tmp"
+
+DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_blob_name(name: str) -> bool:
+    """
+    Whether ``name`` has the shape ContentAddressedStorage gives blobs,
+    ``<directory>/ab/cd/abcd…ef<.ext>``.
+    """
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return bool(DIGEST.match(stem)) and directory.split("/")[-2:] == [
+        stem[:2],
+        stem[2:4],
+    ]
+
+
+def blob_root(name: str) -> str:
+    """
+    Return the directory ``name`` was uploaded to, without the shard
+    directories when ``name`` is already a blob name.
+
+    ``images/ab/cd/abcd…ef.png`` (say, an avatar re-saved after
+    processing) and ``images/logo.png`` both give ``images``, so saving a
+    stored blob again does not nest the shards a second time.
+    """
+    directory = os.path.dirname(name)
+    if is_blob_name(name):
+        return "/".join(directory.split("/")[:-2])
+    return directory
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names every file after the SHA-256 of its
+    content, so identical uploads are stored once.
+
+    ``images/logo.png`` is saved as ``images/ab/cd/abcd…ef.png``: the
+    upload_to directory and the extension are kept, the two shard levels
+    keep directories small. The content is hashed while it is streamed to
+    a temporary file, which is then moved into place, or discarded when
+    the blob already exists. Since names never collide, nothing is probed
+    with ``exists()`` beforehand.
+
+    Every stored blob has a MediaBlob row; references from users are
+    counted by the signals in apps.user.signals. The file is moved into
+    place before the enclosing transaction commits: if that rolls back, the
+    file stays without a row until ``gc_media`` deletes it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def blob_name(self, name: str, digest: str) -> str:
+        directory = blob_root(name)
+        extension = os.path.splitext(name)[1].lower()
+        if not EXTENSION.match(extension):
+            extension = ""
+        return os.path.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        temp_dir = self.path(TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+
+            name = self.blob_name(name, digest.hexdigest())
+            path = self.path(name)
+            # The row lock serializes this with gc_media deleting the blob.
+            with transaction.atomic():
+                register_blob(name, size)
+                if os.path.exists(path):
+                    # Restart gc_media's grace period for a file left
+                    # without a row, which this row may be about to adopt.
+                    os.utime(path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                    os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name.replace("\\", "/")
+
+
+def _blob_model():
+    # Imported lazily: this module is loaded while User's image field is
+    # being defined, before the models are ready.
+    return apps.get_model("user", "MediaBlob")
+
+
+def register_blob(name: str, size: int):
+    """
+    Create (or touch and lock) the MediaBlob row for a stored blob.
+    """
+    blob, created = (
+        _blob_model()
+        .objects.select_for_update()
+        .get_or_create(name=name, defaults={"size": size})
+    )
+    if not created:
+        blob.last_stored = timezone.now()
+        blob.save(update_fields=["last_stored"])
+
+
+def update_references(old_name: str, new_name: str):
+    """
+    Move one reference from blob ``old_name`` to blob ``new_name``.
+
+    Either may be empty; names without a MediaBlob row (files stored
+    before content addressing) are ignored.
+    """
+    if old_name == new_name:
+        return
+    blobs = _blob_model().objects
+    if new_name:
+        blobs.filter(name=new_name).update(refcount=F("refcount") + 1)
+    if old_name:
+        blobs.filter(name=old_name).update(refcount=F("refcount") - 1)
+
+
+def rebuild_references() -> int:
+    """
+    Recount every blob's references from the user table.
+
+    Repairs drift from writes that bypass signals (``update()``, raw
+    SQL). Returns the number of blobs recounted.
+    """
+    references = (
+        apps.get_model("user", "User")
+        .objects.filter(image=OuterRef("name"))
+        .order_by()
+        .values("image")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return _blob_model().objects.update(
+        refcount=Coalesce(Subquery(references), Value(0))
+    )
@@ -1,3 +1,1503 @@
-from django.test import TestCase
+import importlib.util
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from base64 import b64encode
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import ModuleType
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import parse_qs, urlencode, urlparse
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from apps.user.authentication import (
+    ClaimsUser,
+    decode_permissions,
+    encode_permissions,
+)
+from apps.user.cache import get_permission_version, get_user_permissions
+from apps.user.filters import UserFilter, UserOrderingFilter
+from apps.user.history import (
+    delete_in_batches,
+    prune_history,
+    prune_orphaned_m2m_history,
+)
+from apps.user.images import process_avatar, thumbnail_urls
+from apps.user.imports import ImportConflict, import_users
+from apps.user.middleware import BufferedHistoryMiddleware
+from apps.user.management.commands.partition_history import (
+    Command as PartitionCommand,
+)
+from apps.user.models import MediaBlob, User
+from apps.user.routers import (
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    read_from_primary,
+    read_from_replicas,
+)
+from apps.user.serializers import (
+    MyTokenObtainPairSerializer,
+    UserSerializerWithNames,
+    UserValuesSerializer,
+)
+from apps.user.versions import row_version_key, table_version_key
+from apps.user.views import UserViewSet
+
+LOCMEM_CACHES = {
+    alias: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": alias,
+    }
+    for alias in ("default", "catalog")
+}
+
+
+@override_settings(
+    DATABASE_REPLICAS=["replica1"],
+    CACHES=LOCMEM_CACHES,
+)
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Routing decisions only; run against real databases with
+    DATABASE_LOCAL_REPLICA=True, which adds a replica1 alias on the primary.
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def route(self, request, status=200):
+        """
+        Pass ``request`` through the middleware and return the alias reads
+        were routed to, along with the response.
+        """
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(User))
+            return HttpResponse(status=status)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen[0], response
+
+    def bearer(self, user_id):
+        user = User(id=user_id, username=f"user{user_id}")
+        return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(User), "default")
+        self.assertEqual(self.router.db_for_write(User), "default")
+
+    def test_read_from_primary_overrides_replicas(self):
+        with read_from_replicas():
+            self.assertEqual(self.router.db_for_read(User), "replica1")
+            with read_from_primary():
+                self.assertEqual(self.router.db_for_read(User), "default")
+
+    def test_safe_requests_read_from_replica(self):
+        db, response = self.route(self.factory.get("/api/users/"))
+        self.assertEqual(db, "replica1")
+        self.assertNotIn("db_pin", response.cookies)
+
+    def test_writes_pin_cookie(self):
+        db, response = self.route(self.factory.post("/api/users/"))
+        self.assertEqual(db, "default")
+        self.assertIn("db_pin", response.cookies)
+
+        self.factory.cookies["db_pin"] = response.cookies["db_pin"].value
+        db, _ = self.route(self.factory.get("/api/users/"))
+        self.assertEqual(db, "default")
+
+    def test_failed_writes_do_not_pin(self):
+        _, response = self.route(self.factory.post("/api/users/"), status=400)
+        self.assertNotIn("db_pin", response.cookies)
+
+    def test_writes_pin_token_user(self):
+        self.route(self.factory.patch("/api/users/1/", **self.bearer(1)))
+
+        db, _ = self.route(self.factory.get("/api/users/", **self.bearer(1)))
+        self.assertEqual(db, "default")
+        db, _ = self.route(self.factory.get("/api/users/", **self.bearer(2)))
+        self.assertEqual(db, "replica1")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        db, response = self.route(self.factory.post("/api/users/"))
+        self.assertEqual(db, "default")
+        self.assertNotIn("db_pin", response.cookies)
+
+
+USERS = 2000
+GROUPS = 40
+EXTRA_PERMISSIONS = 300
+PASSWORD = "budget-password"
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    HISTORY_BUFFERING=False,
+    REQUEST_METRICS=False,
+    DATABASE_REPLICAS=[],
+    PASSWORD_VERIFY_POOL=False,
+)
+class QueryBudgetTests(TestCase):
+    """
+    Maximum queries and peak memory allocated per API request, against a
+    realistically sized dataset.
+
+    Query budgets are exact upper bounds: an extra query per row (say, a
+    nested serializer whose relation is not prefetched) takes the list
+    endpoints far over them. Allocation budgets leave about 2x headroom
+    over the measured peak, so they only catch order-of-magnitude
+    regressions such as loading a whole table into memory.
+
+    Requests are made by a non-superuser manager holding the model
+    permissions through a group, so permission checks are exercised, with
+    the permission cache warm as in steady state.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        user_type = ContentType.objects.get_for_model(User)
+        Permission.objects.bulk_create(
+            Permission(
+                codename=f"budget_{index}",
+                name=f"Budget permission {index}",
+                content_type=user_type,
+            )
+            for index in range(EXTRA_PERMISSIONS)
+        )
+        permissions = list(Permission.objects.order_by("id"))
+
+        cls.groups = Group.objects.bulk_create(
+            Group(name=f"group-{index}") for index in range(GROUPS)
+        )
+        Group.permissions.through.objects.bulk_create(
+            Group.permissions.through(group_id=group.pk, permission_id=permission.pk)
+            for index, group in enumerate(cls.groups)
+            for permission in permissions[index * 5 : index * 5 + 20]
+        )
+
+        unusable = make_password(None)
+        users = User.objects.bulk_create(
+            User(
+                username=f"user{index}",
+                email=f"user{index}@example.com",
+                first_name="First",
+                last_name=f"Last {index}",
+                password=unusable,
+                date_joined=now - timedelta(hours=index * 8),
+            )
+            for index in range(USERS)
+        )
+        User.groups.through.objects.bulk_create(
+            User.groups.through(
+                user_id=user.pk, group_id=cls.groups[(index + offset) % GROUPS].pk
+            )
+            for index, user in enumerate(users)
+            for offset in range(index % 3 + 1)
+        )
+        User.user_permissions.through.objects.bulk_create(
+            User.user_permissions.through(
+                user_id=user.pk, permission_id=permissions[index % len(permissions)].pk
+            )
+            for index, user in enumerate(users)
+            if index % 4 == 0
+        )
+        cls.target = users[1]
+
+        managers = Group.objects.create(name="Managers")
+        managers.permissions.set(
+            Permission.objects.filter(content_type__app_label__in=["auth", "user"])
+        )
+        cls.manager = User.objects.create_user(
+            username="manager",
+            email="manager@example.com",
+            password=PASSWORD,
+            first_name="Manager",
+            last_name="User",
+        )
+        cls.manager.groups.add(managers)
+        call_command("rebuild_signup_rollup", stdout=StringIO())
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["catalog"].clear()
+        get_user_permissions(User.objects.get(pk=self.manager.pk))
+        token = MyTokenObtainPairSerializer.get_token(self.manager)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token.access_token}")
+
+    @contextmanager
+    def assertBudget(self, queries: int, kilobytes: int):
+        """
+        Fail if the block runs more than ``queries`` queries or allocates
+        more than ``kilobytes`` at its peak.
+        """
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as context:
+                yield
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        executed = "\n".join(query["sql"] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), queries, f"Query budget exceeded:\n{executed}"
+        )
+        self.assertLessEqual(
+            peak // 1024, kilobytes, "Allocation budget exceeded (KiB)."
+        )
+
+    def test_login(self):
+        client = APIClient()
+        with self.assertBudget(queries=2, kilobytes=300):
+            response = client.post(
+                "/api/users/login/",
+                {"username": "manager", "password": PASSWORD},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh(self):
+        refresh = RefreshToken.for_user(self.manager)
+        client = APIClient()
+        with self.assertBudget(queries=2, kilobytes=250):
+            response = client.post(
+                "/api/users/refresh/", {"refresh": str(refresh)}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_verify(self):
+        token = MyTokenObtainPairSerializer.get_token(self.manager)
+        client = APIClient()
+        with self.assertBudget(queries=0, kilobytes=100):
+            response = client.post(
+                "/api/users/verify/", {"token": str(token)}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_db_pool(self):
+        admin = User.objects.create_user(
+            username="pool-admin", email="pool@example.com", is_staff=True
+        )
+        token = MyTokenObtainPairSerializer.get_token(admin)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token.access_token}")
+        with self.assertBudget(queries=1, kilobytes=250):
+            response = client.get("/api/users/db-pool/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_list(self):
+        with self.assertBudget(queries=5, kilobytes=3000):
+            response = self.client.get("/api/users/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 50)
+
+    def test_user_list_large_page(self):
+        # Same queries for ten times the rows: nothing is loaded per user.
+        with self.assertBudget(queries=5, kilobytes=20000):
+            response = self.client.get("/api/users/", {"page_size": 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 500)
+
+    def test_user_list_filtered(self):
+        with self.assertBudget(queries=5, kilobytes=3000):
+            response = self.client.get(
+                "/api/users/",
+                {"search": "user1", "group": self.groups[1].pk, "ordering": "email"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["results"])
+
+    def test_user_retrieve(self):
+        with self.assertBudget(queries=5, kilobytes=300):
+            response = self.client.get(f"/api/users/{self.target.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_create(self):
+        with self.assertBudget(queries=15, kilobytes=3500):
+            response = self.client.post(
+                "/api/users/",
+                {
+                    "username": "created",
+                    "email": "created@example.com",
+                    "password": PASSWORD,
+                    "first_name": "Created",
+                    "last_name": "User",
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_import(self):
+        rows = [
+            {
+                "username": f"imported{index}",
+                "email": f"imported{index}@example.com",
+                "password": PASSWORD,
+                "first_name": "Imported",
+                "last_name": "User",
+            }
+            for index in range(10)
+        ]
+        with self.assertBudget(queries=14, kilobytes=300):
+            response = self.client.post("/api/users/import/", rows, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(USER_EXPORT_CHUNK_SIZE=500)
+    def test_user_export(self):
+        # Memory is bounded by the chunk, not the table; one query per
+        # chunk prefetches the groups of its users.
+        chunks = math.ceil((USERS + 1) / settings.USER_EXPORT_CHUNK_SIZE)
+        with self.assertBudget(queries=2 + chunks, kilobytes=5000):
+            response = self.client.get("/api/users/export/")
+            lines = sum(chunk.count(b"\n") for chunk in response.streaming_content)
+        self.assertEqual(lines, USERS + 1)  # and the manager
+
+    def test_session(self):
+        with self.assertBudget(queries=1, kilobytes=200):
+            response = self.client.post("/api/users/session/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout(self):
+        with self.assertBudget(queries=1, kilobytes=200):
+            response = self.client.post("/api/users/logout/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_permissions(self):
+        with self.assertBudget(queries=1, kilobytes=300):
+            response = self.client.get("/api/users/user-permission/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard(self):
+        with self.assertBudget(queries=4, kilobytes=400):
+            response = self.client.get("/api/users/dashboard/", {"buckets": 24})
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_list(self):
+        with self.assertBudget(queries=3, kilobytes=2000):
+            response = self.client.get("/api/users/group/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), GROUPS + 1)
+
+    def test_group_retrieve(self):
+        with self.assertBudget(queries=3, kilobytes=450):
+            response = self.client.get(f"/api/users/group/{self.groups[0].pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_create(self):
+        permissions = list(Permission.objects.values_list("pk", flat=True)[:20])
+        with self.assertBudget(queries=9, kilobytes=300):
+            response = self.client.post(
+                "/api/users/group/",
+                {"name": "created", "permissions": permissions},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_group_update(self):
+        permissions = list(Permission.objects.values_list("pk", flat=True)[:30])
+        with self.assertBudget(queries=11, kilobytes=400):
+            response = self.client.put(
+                f"/api/users/group/{self.groups[0].pk}/",
+                {"name": "renamed", "permissions": permissions},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_permission_list(self):
+        with self.assertBudget(queries=2, kilobytes=1200):
+            response = self.client.get("/api/users/permission/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_permission_retrieve(self):
+        permission = Permission.objects.first()
+        with self.assertBudget(queries=2, kilobytes=300):
+            response = self.client.get(f"/api/users/permission/{permission.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_permission_create(self):
+        content_type = ContentType.objects.get_for_model(User)
+        with self.assertBudget(queries=5, kilobytes=300):
+            response = self.client.post(
+                "/api/users/permission/",
+                {
+                    "name": "Created permission",
+                    "codename": "created_permission",
+                    "content_type": content_type.pk,
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_user_permission_update(self):
+        codenames = list(
+            Permission.objects.filter(codename__startswith="budget_").values_list(
+                "codename", flat=True
+            )[:50]
+        )
+        with self.assertBudget(queries=13, kilobytes=550):
+            response = self.client.put(
+                f"/api/users/permission/{self.target.pk}/",
+                {"permissions": codenames},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_group_update(self):
+        names = [group.name for group in self.groups[:10]]
+        with self.assertBudget(queries=12, kilobytes=300):
+            response = self.client.put(
+                f"/api/users/user-group/{self.target.pk}/",
+                {"groups": names},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    HISTORY_BUFFERING=False,
+    REQUEST_METRICS=False,
+    DATABASE_REPLICAS=[],
+)
+class UserFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.admin = User.objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+        cls.staff = Group.objects.create(name="Staff")
+        people = [
+            ("asmith", "Ann.Smith@Example.com", "Ann", "Smith", True, True, 10),
+            ("bjones", "bob@example.com", "Bob", "Jones", True, False, 20),
+            ("cannon", "carol@example.com", "Carol", "Annon", False, False, 30),
+            ("dsmithers", "dave@example.org", "Dave", "Smithers", True, False, 40),
+        ]
+        cls.users = {}
+        for username, email, first, last, active, staff, days in people:
+            cls.users[username] = User.objects.create(
+                username=username,
+                email=email,
+                first_name=first,
+                last_name=last,
+                is_active=active,
+                is_staff=staff,
+                date_joined=now - timedelta(days=days),
+            )
+        cls.users["asmith"].groups.add(cls.staff)
+        cls.users["dsmithers"].groups.add(cls.staff)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def usernames(self, **params):
+        response = self.client.get("/api/users/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [
+            user["username"]
+            for user in response.data["results"]
+            if user["username"] != "admin"
+        ]
+
+    def test_boolean_filters(self):
+        self.assertEqual(self.usernames(is_active="false"), ["cannon"])
+        self.assertEqual(self.usernames(is_staff="true"), ["asmith"])
+
+    def test_group(self):
+        self.assertEqual(
+            self.usernames(group=self.staff.pk, ordering="username"),
+            ["asmith", "dsmithers"],
+        )
+
+    def test_date_joined_range(self):
+        now = timezone.now()
+        self.assertEqual(
+            self.usernames(
+                date_joined_after=(now - timedelta(days=35)).isoformat(),
+                date_joined_before=(now - timedelta(days=15)).isoformat(),
+                ordering="username",
+            ),
+            ["bjones", "cannon"],
+        )
+
+    def test_case_insensitive_exact(self):
+        self.assertEqual(self.usernames(username="ASmith"), ["asmith"])
+        self.assertEqual(self.usernames(email="ann.smith@example.COM"), ["asmith"])
+
+    def test_search(self):
+        # Any field matches, case-insensitively; every term must match.
+        self.assertEqual(
+            self.usernames(search="ANN", ordering="username"), ["asmith", "cannon"]
+        )
+        self.assertEqual(
+            self.usernames(search="smith", ordering="username"),
+            ["asmith", "dsmithers"],
+        )
+        self.assertEqual(self.usernames(search="smith .org"), ["dsmithers"])
+        self.assertEqual(self.usernames(search="100%"), [])
+
+    def test_ordering_pages(self):
+        # Cursor pages follow the requested order.
+        seen = []
+        url = "/api/users/?ordering=-last_name&page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [user["username"] for user in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            [name for name in seen if name != "admin"],
+            ["dsmithers", "asmith", "bjones", "cannon"],
+        )
+
+    def test_pages_through_ties(self):
+        # More equal last names than fit on a page: the cursor carries the
+        # id too, so pages neither skip nor repeat users nor fall back to
+        # OFFSET.
+        tied = [
+            User.objects.create(username=f"tied{index}", last_name="Tied").pk
+            for index in range(7)
+        ]
+        for ordering, expected in [("last_name", tied), ("-last_name", tied[::-1])]:
+            with self.subTest(ordering=ordering):
+                url = f"/api/users/?ordering={ordering}&search=tied&page_size=2"
+                pages = []
+                while url:
+                    with CaptureQueriesContext(connection) as context:
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertFalse(any("OFFSET" in query["sql"] for query in context))
+                    pages.append(response.data)
+                    url = response.data["next"]
+                self.assertEqual(
+                    [user["id"] for page in pages for user in page["results"]],
+                    expected,
+                )
+                # And back again.
+                url, seen = pages[-1]["previous"], []
+                while url:
+                    response = self.client.get(url)
+                    seen = [user["id"] for user in response.data["results"]] + seen
+                    url = response.data["previous"]
+                self.assertEqual(seen, expected[: len(seen)])
+                self.assertEqual(len(seen), 6)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/users/", {"cursor": "cD0yMDI0"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_of_wrong_types(self):
+        next_url = self.client.get(
+            "/api/users/", {"ordering": "username", "page_size": 1}
+        ).data["next"]
+        # A username cursor replayed under another ordering.
+        cursor = parse_qs(urlparse(next_url).query)["cursor"][0]
+        response = self.client.get(
+            "/api/users/", {"ordering": "date_joined", "cursor": cursor}
+        )
+        self.assertEqual(response.status_code, 404)
+        # A non-numeric id.
+        position = json.dumps(["asmith", "x"])
+        cursor = b64encode(urlencode({"p": position}).encode()).decode()
+        response = self.client.get(
+            "/api/users/", {"ordering": "username", "cursor": cursor}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_ordering_breaks_ties_on_id(self):
+        request = Request(RequestFactory().get("/", {"ordering": "-email"}))
+        view = UserViewSet()
+        ordering = UserOrderingFilter().get_ordering(request, User.objects.all(), view)
+        self.assertEqual(ordering, ("-email", "-id"))
+
+    def test_invalid_filter(self):
+        response = self.client.get("/api/users/", {"date_joined_after": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == "postgresql", "Trigram indexes need PostgreSQL.")
+class UserSearchIndexTests(TestCase):
+    """
+    The filters compile to queries the User indexes can serve.
+
+    Sequential scans are disabled so the planner picks any usable index
+    even on a tiny test table; a query no index matches still seq-scans.
+    """
+
+    def explain(self, params) -> str:
+        queryset = UserFilter(params, queryset=User.objects.all()).qs
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def test_search_uses_trigram_indexes(self):
+        plan = self.explain({"search": "smith"})
+        for field in ("username", "email", "first_name", "last_name"):
+            self.assertIn(f"user_{field}_trgm_idx", plan)
+
+    def test_exact_filters_use_lower_indexes(self):
+        self.assertIn("user_username_lower_idx", self.explain({"username": "ASmith"}))
+        self.assertIn(
+            "user_email_lower_idx", self.explain({"email": "Ann@Example.com"})
+        )
+
+    def test_ordering_uses_indexes(self):
+        for field, index in [
+            ("username", "user_username_id_idx"),
+            ("email", "user_email_id_idx"),
+            ("last_name", "user_last_name_id_idx"),
+            ("date_joined", "user_date_joined_id_idx"),
+        ]:
+            with self.subTest(field=field):
+                queryset = User.objects.order_by(f"-{field}", "-id")[:50]
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                self.assertIn(index, queryset.explain())
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    HISTORY_BUFFERING=False,
+    REQUEST_METRICS=False,
+    DATABASE_REPLICAS=[],
+)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+        cls.group = Group.objects.create(name="Editors")
+        cls.alice = User.objects.create_user("alice", "alice@example.com")
+        cls.bob = User.objects.create_user("bob", "bob@example.com")
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["catalog"].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assertNotModified(self, url, response):
+        # Answered from the version stamps alone.
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated["ETag"], response["ETag"])
+
+    def assertModified(self, url, response):
+        revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertNotEqual(revalidated["ETag"], response["ETag"])
+
+    def test_validators(self):
+        response = self.client.get("/api/users/group/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["ETag"].startswith('"json-'))
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("private", response["Cache-Control"])
+        # The ETag is the only validator: a date would have one-second
+        # resolution and miss changes made within that second.
+        self.assertNotIn("Last-Modified", response)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(Permission.objects.first())
+        revalidated = self.client.get(
+            "/api/users/group/", HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(revalidated.status_code, 200)
+
+    @override_settings(ROW_VERSION_TIMEOUT=600)
+    def test_row_stamps_expire(self):
+        cache = caches["default"]
+        with mock.patch.object(cache, "add", wraps=cache.add) as add:
+            self.client.get("/api/users/999999/")
+            self.client.get("/api/users/group/")
+        timeouts = {call.args[0]: call.kwargs["timeout"] for call in add.call_args_list}
+        self.assertEqual(timeouts[row_version_key(User, 999999)], 600)
+        self.assertIsNone(timeouts[table_version_key(Group)])
+
+    def test_group_collection(self):
+        url = "/api/users/group/"
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        self.assertNotModified(
+            f"{url}{self.group.pk}/", self.client.get(f"{url}{self.group.pk}/")
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(Permission.objects.first())
+        self.assertModified(url, response)
+
+    def test_permission_collection(self):
+        url = "/api/users/permission/"
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                url,
+                {
+                    "name": "Can audit",
+                    "codename": "audit",
+                    "content_type": ContentType.objects.get_for_model(User).pk,
+                },
+                format="json",
+            )
+        self.assertModified(url, response)
+
+    def test_user(self):
+        url = f"/api/users/{self.alice.pk}/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        # Other users' changes keep alice's ETag.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.groups.add(self.group)
+        self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.groups.add(self.group)
+        self.assertModified(url, response)
+
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = "Writers"
+            self.group.save()
+        self.assertModified(url, response)
+
+    def test_uncommitted_changes_keep_etag(self):
+        url = f"/api/users/{self.alice.pk}/"
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=False):
+            self.alice.first_name = "Alice"
+            self.alice.save()
+            self.assertNotModified(url, response)
+
+    def test_catalog_cache(self):
+        url = "/api/users/permission/"
+        response = self.client.get(url)
+        # Rendered bytes are reused: no queries, no serializer.
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached["Content-Type"], response["Content-Type"])
+        self.assertEqual(cached["ETag"], response["ETag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Permission.objects.create(
+                name="Can audit",
+                codename="audit",
+                content_type=ContentType.objects.get_for_model(User),
+            )
+        updated = self.client.get(url)
+        self.assertIn(
+            "audit", [permission["codename"] for permission in updated.json()]
+        )
+
+    def test_catalog_cache_json_only(self):
+        url = "/api/users/group/"
+        self.client.get(url, HTTP_ACCEPT="text/html")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(context.captured_queries)
+
+
+class UserValuesSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user_type = ContentType.objects.get_for_model(User)
+        group_type = ContentType.objects.get_for_model(Group)
+        permissions = [
+            Permission.objects.create(
+                name=f"Can do {codename}", codename=codename, content_type=content_type
+            )
+            for codename, content_type in [
+                ("zeta", user_type),
+                ("alpha", user_type),
+                ("beta", group_type),
+            ]
+        ]
+        editors = Group.objects.create(name="Editors")
+        editors.permissions.set(permissions)
+        readers = Group.objects.create(name="Readers")
+        Group.objects.create(name="Empty")
+
+        full = User.objects.create(
+            username="full",
+            email="full@example.com",
+            first_name="Full",
+            last_name="Member",
+            is_staff=True,
+            last_login=timezone.now(),
+            image="images/full.png",
+        )
+        full.groups.set([readers, editors])
+        full.user_permissions.set(permissions[:2])
+        User.objects.create(username="bare", email="bare@example.com")
+
+    def render(self, data) -> bytes:
+        return JSONRenderer().render(data)
+
+    def test_same_payloads(self):
+        request = Request(RequestFactory().get("/api/users/"))
+        queryset = User.objects.order_by("id")
+        expected = UserSerializerWithNames(
+            UserSerializerWithNames.setup_eager_loading(queryset),
+            many=True,
+            context={"request": request},
+        ).data
+
+        with self.assertNumQueries(4):
+            rows = UserValuesSerializer.load(
+                list(UserValuesSerializer.values(queryset))
+            )
+            data = UserValuesSerializer(rows, context={"request": request}).data
+        self.assertEqual(self.render(data), self.render(expected))
+        self.assertEqual(
+            [group["name"] for group in data[0]["groups"]], ["Editors", "Readers"]
+        )
+        self.assertEqual(data[1]["groups"], [])
+
+    def test_no_rows(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                UserValuesSerializer(UserValuesSerializer.load([])).data, []
+            )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class PermissionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(name="Viewers")
+        cls.group.permissions.add(Permission.objects.get(codename="view_group"))
+        cls.user = User.objects.create_user("carol", "carol@example.com")
+        cls.user.groups.add(cls.group)
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def permissions(self):
+        # A fresh instance: Django memoizes permissions on the user itself.
+        return get_user_permissions(User.objects.get(pk=self.user.pk))
+
+    def test_profile_save_keeps_cache(self):
+        self.assertEqual(self.permissions(), {"auth.view_group"})
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = "Carol"
+        user.save()
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_permissions(user), {"auth.view_group"})
+
+    def test_flag_changes_invalidate(self):
+        self.assertEqual(self.permissions(), {"auth.view_group"})
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(update_fields=["is_active"])
+        self.assertEqual(self.permissions(), set())
+
+        user.is_active = True
+        user.is_superuser = True
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertIn("auth.delete_group", self.permissions())
+
+    def test_invalidates_on_commit(self):
+        # Until the revocation commits, other requests still read the old
+        # rows; they must not cache them under a new version.
+        version = get_permission_version(self.user.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.groups.remove(self.group)
+            self.group.permissions.clear()
+            self.assertEqual(get_permission_version(self.user.pk), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_permission_version(self.user.pk), version)
+        self.assertEqual(self.permissions(), set())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class TokenClaimsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("dave", "dave@example.com")
+        cls.user.user_permissions.set(
+            Permission.objects.filter(content_type__app_label__in=["auth", "user"])
+        )
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def claims_user(self) -> ClaimsUser:
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        return ClaimsUser(token)
+
+    def test_permissions_round_trip(self):
+        expected = get_user_permissions(User.objects.get(pk=self.user.pk))
+        self.assertEqual(decode_permissions(encode_permissions(expected)), expected)
+        claims_user = self.claims_user()
+        self.assertFalse(claims_user.permissions_omitted)
+        with self.assertNumQueries(0):
+            self.assertEqual(claims_user.get_all_permissions(), expected)
+
+    @override_settings(JWT_PERMISSION_CLAIM_MAX_BYTES=16)
+    def test_large_permission_claims_are_left_out(self):
+        claims_user = self.claims_user()
+        self.assertTrue(claims_user.permissions_omitted)
+        self.assertTrue(claims_user.has_perm("auth.view_group"))
+        self.assertFalse(claims_user.has_perm("auth.missing"))
+
+    def test_only_flag_changes_revoke_tokens(self):
+        version = get_permission_version(self.user.pk)
+        user = User.objects.get(pk=self.user.pk)
+        user.last_name = "Smith"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(get_permission_version(self.user.pk), version)
+
+        user.is_staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertNotEqual(get_permission_version(self.user.pk), version)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class UserImportConflictTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+
+    def rows(self):
+        return [
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": "Secret-password-1",
+                "first_name": "Imported",
+                "last_name": "User",
+            }
+            for username in ("erin", "frank")
+        ]
+
+    def test_username_taken_after_validation(self):
+        # As if "frank" signed up between validation and the insert.
+        User.objects.create_user("frank", "frank@example.com")
+        with self.assertRaises(ImportConflict) as context:
+            import_users(self.rows())
+        self.assertEqual(list(context.exception.row_errors), [1])
+        self.assertFalse(User.objects.filter(username="erin").exists())
+
+    def test_conflict_response(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        User.objects.create_user("frank", "frank@example.com")
+        with mock.patch("apps.user.views.validate_import_rows", return_value={}):
+            response = client.post("/api/users/import/", self.rows(), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(1, response.data["detail"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[], HISTORY_BUFFERING=False)
+class SeedUsersTests(TestCase):
+    def test_history_matches_relations(self):
+        call_command(
+            "seed_users",
+            "400",
+            "--avatars",
+            "0",
+            "--permissions",
+            "5",
+            stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.count(), 400)
+        self.assertEqual(User.history.count(), 400)
+        for field in ("groups", "user_permissions"):
+            through = getattr(User, field).through
+            history = apps.get_model("user", f"HistoricalUser_{field}")
+            fields = [f.attname for f in through._meta.fields]
+            self.assertTrue(through.objects.exists())
+            self.assertEqual(
+                set(history.objects.values_list(*fields)),
+                set(through.objects.values_list(*fields)),
+            )
+            # Each snapshot belongs to its own user's "created" row.
+            self.assertFalse(history.objects.exclude(history__id=F("user_id")).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[], HISTORY_BUFFERING=False)
+class HistoryRetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(name="Archivists")
+        cls.users = [
+            User.objects.create_user(f"history{index}", f"h{index}@example.com")
+            for index in range(3)
+        ]
+        for user in cls.users:
+            user.groups.add(cls.group)
+        cls.history_model = User.history.model
+        cls.m2m_model = apps.get_model("user", "HistoricalUser_groups")
+        # The first two users' rows are a year old.
+        cls.old_ids = list(
+            cls.history_model.objects.filter(
+                id__in=[user.pk for user in cls.users[:2]]
+            ).values_list("history_id", flat=True)
+        )
+        cls.history_model.objects.filter(history_id__in=cls.old_ids).update(
+            history_date=timezone.now() - timedelta(days=365)
+        )
+
+    def old_rows(self):
+        return self.history_model.objects.filter(history_id__in=self.old_ids)
+
+    def test_prune_history_cutoff(self):
+        total = self.history_model.objects.count()
+        self.assertTrue(
+            self.m2m_model.objects.filter(history_id__in=self.old_ids).exists()
+        )
+        cutoff = timezone.now() - timedelta(days=30)
+        deleted = prune_history(self.history_model, cutoff, batch_size=1)
+        self.assertEqual(deleted, len(self.old_ids))
+        self.assertFalse(self.old_rows().exists())
+        self.assertEqual(self.history_model.objects.count(), total - deleted)
+        # Their m2m history rows went with them.
+        self.assertFalse(
+            self.m2m_model.objects.filter(history_id__in=self.old_ids).exists()
+        )
+        self.assertTrue(self.m2m_model.objects.exists())
+
+    def test_delete_in_batches_stops_after_max_batches(self):
+        batches = []
+        deleted = delete_in_batches(
+            self.old_rows().order_by("history_date"),
+            batch_size=1,
+            max_batches=1,
+            on_batch=batches.append,
+        )
+        self.assertEqual((deleted, batches), (1, [1]))
+        self.assertEqual(self.old_rows().count(), len(self.old_ids) - 1)
+
+    def test_prune_history_command(self):
+        call_command("prune_history", "--days", "30", "--dry-run", stdout=StringIO())
+        self.assertEqual(self.old_rows().count(), len(self.old_ids))
+        call_command("prune_history", "--days", "30", stdout=StringIO())
+        self.assertFalse(self.old_rows().exists())
+        with self.assertRaises(CommandError):
+            call_command("prune_history", "--days", "0", stdout=StringIO())
+
+    def test_prune_orphaned_m2m_history(self):
+        kept = self.m2m_model.objects.exclude(history_id__in=self.old_ids).count()
+        orphaned = self.m2m_model.objects.filter(history_id__in=self.old_ids).count()
+        self.assertTrue(orphaned)
+        # What dropping a partition does: parents go, children stay.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE history_id IN (%s)"
+                % (
+                    connection.ops.quote_name(self.history_model._meta.db_table),
+                    ", ".join(str(history_id) for history_id in self.old_ids),
+                )
+            )
+        deleted = prune_orphaned_m2m_history(self.history_model, batch_size=1)
+        self.assertEqual(deleted, orphaned)
+        self.assertEqual(self.m2m_model.objects.count(), kept)
+
+    @skipIf(connection.vendor == "postgresql", "Partitioning works here.")
+    def test_partition_history_needs_postgresql(self):
+        with self.assertRaises(CommandError):
+            call_command("partition_history", "create", stdout=StringIO())
+
+    @skipUnless(connection.vendor == "postgresql", "PostgreSQL only.")
+    def test_partition_history_is_idempotent(self):
+        call_command("partition_history", "setup", stdout=StringIO())
+        table = self.history_model._meta.db_table
+        self.assertTrue(PartitionCommand().is_partitioned(table))
+        count = self.history_model.objects.count()
+
+        output = StringIO()
+        call_command("partition_history", "setup", stdout=output)
+        self.assertIn(f"{table} is already partitioned.", output.getvalue())
+        call_command("partition_history", "create", stdout=StringIO())
+        self.assertEqual(self.history_model.objects.count(), count)
+
+        # Partitions whose month ended before the cutoff are dropped, and
+        # the m2m rows of their history rows with them.
+        call_command("partition_history", "drop", "--days", "30", stdout=StringIO())
+        self.assertFalse(self.old_rows().exists())
+        self.assertFalse(
+            self.m2m_model.objects.filter(history_id__in=self.old_ids).exists()
+        )
+
+
+def png_file(color=(200, 30, 30)) -> ContentFile:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+    return ContentFile(buffer.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[], IMAGE_WORKERS=0)
+class AvatarTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = User._meta.get_field("image").storage
+
+    def create_user(self, color=(200, 30, 30)) -> User:
+        name = self.storage.save("images/avatar.png", png_file(color))
+        return User.objects.create(
+            username=f"avatar{color[0]}", email="avatar@example.com", image=name
+        )
+
+    def test_no_thumbnail_urls_until_processed(self):
+        user = self.create_user()
+        self.assertIsNone(thumbnail_urls(user.image))
+        name = process_avatar(user.pk, user.image.name)
+        self.assertEqual(
+            list(thumbnail_urls(name)), list(settings.AVATAR_THUMBNAIL_SIZES)
+        )
+
+    def test_processed_avatar_keeps_one_shard_level(self):
+        user = self.create_user()
+        self.assertEqual(len(user.image.name.split("/")), 4)
+        name = process_avatar(user.pk, user.image.name)
+        self.assertEqual(len(name.split("/")), 4)
+        self.assertTrue(name.startswith("images/"))
+        # Processing the sanitized blob again stores nothing new.
+        self.assertEqual(process_avatar(user.pk, name), name)
+
+    def test_page_checks_thumbnails_at_once(self):
+        users = [self.create_user((index * 60, 0, 0)) for index in range(1, 4)]
+        for user in users[:2]:
+            process_avatar(user.pk, user.image.name)
+        caches["default"].clear()
+        rows = UserValuesSerializer.load(
+            list(UserValuesSerializer.values(User.objects.order_by("id")))
+        )
+
+        def serialize():
+            cache = mock.Mock(wraps=caches["default"])
+            storage = mock.Mock(wraps=default_storage)
+            with mock.patch("apps.user.images.cache", cache), mock.patch(
+                "apps.user.images.default_storage", storage
+            ):
+                data = UserValuesSerializer(rows).data
+            self.assertEqual(cache.get_many.call_count, 1)
+            self.assertEqual(cache.get.call_count, 0)
+            return [user["thumbnails"] is not None for user in data], storage
+
+        processed, storage = serialize()
+        self.assertEqual(processed, [True, True, False])
+        # Then from the cache alone.
+        processed, storage = serialize()
+        self.assertEqual(processed, [True, True, False])
+        storage.exists.assert_not_called()
+
+    def test_gc_media_deletes_rolled_back_blobs(self):
+        def store_and_roll_back(color) -> str:
+            try:
+                with transaction.atomic():
+                    name = self.storage.save("images/lost.png", png_file(color))
+                    raise RuntimeError
+            except RuntimeError:
+                return name
+
+        kept = self.create_user()
+        stale = store_and_roll_back((1, 2, 3))
+        recent = store_and_roll_back((4, 5, 6))
+        self.assertFalse(MediaBlob.objects.filter(name__in=[stale, recent]).exists())
+        two_days_ago = time.time() - 2 * 24 * 3600
+        for name in (kept.image.name, stale):
+            os.utime(self.storage.path(name), (two_days_ago, two_days_ago))
+
+        out = StringIO()
+        call_command("gc_media", "--dry-run", stdout=out)
+        self.assertIn(f"Would delete unregistered {stale}", out.getvalue())
+        self.assertTrue(self.storage.exists(stale))
+
+        call_command("gc_media", stdout=StringIO())
+        self.assertFalse(self.storage.exists(stale))
+        # Within the grace period, or referenced.
+        self.assertTrue(self.storage.exists(recent))
+        self.assertTrue(self.storage.exists(kept.image.name))
+
+    def test_storing_again_restarts_grace_period(self):
+        name = self.storage.save("images/lost.png", png_file())
+        two_days_ago = time.time() - 2 * 24 * 3600
+        os.utime(self.storage.path(name), (two_days_ago, two_days_ago))
+        self.storage.save("images/again.png", png_file())
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), two_days_ago)
+
+    def test_generate_thumbnails(self):
+        user = self.create_user()
+        call_command("generate_thumbnails", stdout=StringIO())
+        user.refresh_from_db()
+        self.assertIsNotNone(thumbnail_urls(user.image))
+
+
+def async_urlconf():
+    """
+    The project URLconf with the API routes as served when USER_API_ASYNC
+    is on, built from a separate copy of apps.user.urls.
+    """
+    spec = importlib.util.find_spec("apps.user.urls")
+    module = importlib.util.module_from_spec(spec)
+    with override_settings(USER_API_ASYNC=True):
+        spec.loader.exec_module(module)
+    urlconf = ModuleType("async_urls")
+    urlconf.urlpatterns = [path("api/users/", include(module))]
+    return urlconf
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class AsyncViewTests(TestCase):
+    """
+    The async-native views answer exactly like the viewsets they stand in
+    for.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        cls.plain = User.objects.create_user("plain", "plain@example.com", "pw")
+        for index in range(5):
+            User.objects.create_user(f"user{index}", f"user{index}@example.com")
+        cls.tokens = {
+            user.pk: str(MyTokenObtainPairSerializer.get_token(user).access_token)
+            for user in (cls.admin, cls.plain)
+        }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.urlconf = async_urlconf()
+
+    def setUp(self):
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+
+    async def compare(self, method, url, user=None, **kwargs):
+        """
+        Request ``url`` from the sync and the async routes, check both
+        answer the same and return both responses, async first.
+        """
+        headers = {}
+        if user is not None:
+            headers["Authorization"] = f"Bearer {self.tokens[user.pk]}"
+        sync = await sync_to_async(getattr(self.client, method))(
+            url, headers=headers, **kwargs
+        )
+        with override_settings(ROOT_URLCONF=self.urlconf):
+            response = await getattr(self.async_client, method)(
+                url, headers=headers, **kwargs
+            )
+        self.assertEqual(response.status_code, sync.status_code, response.content)
+        return response, sync
+
+    async def assertSameResponse(self, method, url, user=None, **kwargs):
+        response, sync = await self.compare(method, url, user, **kwargs)
+        self.assertEqual(response.json(), sync.json())
+        return response
+
+    async def test_user_list(self):
+        response = await self.assertSameResponse(
+            "get", "/api/users/?page_size=2&ordering=-email", self.admin
+        )
+        await self.assertSameResponse("get", response.json()["next"], self.admin)
+        await self.assertSameResponse("get", "/api/users/?search=user3", self.admin)
+        await self.assertSameResponse(
+            "get", "/api/users/?date_joined_after=bad", self.admin
+        )
+        await self.assertSameResponse("get", "/api/users/", self.plain)
+        await self.assertSameResponse("get", "/api/users/")
+
+    async def test_user_detail(self):
+        response = await self.assertSameResponse(
+            "get", f"/api/users/{self.plain.pk}/", self.admin
+        )
+        self.assertEqual(response.json()["username"], "plain")
+        await self.assertSameResponse("get", "/api/users/0/", self.admin)
+        await self.assertSameResponse("get", f"/api/users/{self.plain.pk}/", self.plain)
+
+    async def test_user_permissions(self):
+        await self.assertSameResponse("get", "/api/users/user-permission/", self.admin)
+        await self.assertSameResponse("get", "/api/users/user-permission/", self.plain)
+        await self.assertSameResponse("get", "/api/users/user-permission/")
+
+    async def test_dashboard(self):
+        await self.assertSameResponse(
+            "get", "/api/users/dashboard/?period=day&buckets=3", self.admin
+        )
+        await self.assertSameResponse(
+            "get", "/api/users/dashboard/?period=x", self.admin
+        )
+
+    async def test_session(self):
+        response = await self.assertSameResponse(
+            "post", "/api/users/session/", self.admin
+        )
+        self.assertEqual(response.json()["username"], "admin")
+        response = await self.assertSameResponse("post", "/api/users/session/")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_login(self):
+        response, sync = await self.compare(
+            "post",
+            "/api/users/login/",
+            data={"username": "plain", "password": "pw"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json().keys(), sync.json().keys())
+        await self.assertSameResponse(
+            "post",
+            "/api/users/login/",
+            data={"username": "plain", "password": "wrong"},
+            content_type="application/json",
+        )
+
+    async def test_login_ignores_stale_credentials(self):
+        token = AccessToken.for_user(self.plain)
+        token.set_exp(lifetime=-timedelta(minutes=1))
+        with override_settings(ROOT_URLCONF=self.urlconf):
+            response = await self.async_client.post(
+                "/api/users/login/",
+                data={"username": "plain", "password": "pw"},
+                content_type="application/json",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn("access", response.json())
+
+    @override_settings(HISTORY_BUFFERING=True, HISTORY_QUEUE_PATH="")
+    def test_buffered_history_middleware(self):
+        @sync_to_async
+        def create_user():
+            user = User.objects.create_user("buffered")
+            # Deferred until the middleware's scope ends.
+            self.assertFalse(user.history.exists())
+
+        async def get_response(request):
+            await create_user()
+            return HttpResponse()
+
+        middleware = BufferedHistoryMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.captureOnCommitCallbacks(execute=True):
+            async_to_sync(middleware)(RequestFactory().get("/"))
+        user = User.objects.get(username="buffered")
+        self.assertEqual(user.history.count(), 1)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    DATABASE_REPLICAS=[],
+    HISTORY_BUFFERING=False,
+    REQUEST_METRICS=True,
+    SERVER_TIMING=True,
+    METRICS_TOKEN="",
+)
+class RequestMetricsTests(TestCase):
+    """
+    Queries are counted wherever they run, including the sync_to_async
+    threads of ASGI requests.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        cls.token = str(MyTokenObtainPairSerializer.get_token(admin).access_token)
+
+    def setUp(self):
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+        self.headers = {"Authorization": f"Bearer {self.token}"}
+
+    def timed_queries(self, response) -> int:
+        match = re.search(
+            r'db;dur=[\d.]+;desc="(\d+) queries"', response["Server-Timing"]
+        )
+        return int(match.group(1))
+
+    def scraped_requests(self, view: str) -> int:
+        content = self.client.get("/metrics").content.decode()
+        match = re.search(
+            rf'^http_request_db_queries_count{{view="{view}",method="GET"}} (\d+)$',
+            content,
+            re.MULTILINE,
+        )
+        return int(match.group(1)) if match else 0
+
+    def test_sync_route(self):
+        before = self.scraped_requests("group-list")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/users/group/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timed_queries(response), len(context))
+        self.assertGreater(len(context), 0)
+        self.assertEqual(self.scraped_requests("group-list"), before + 1)
+
+    async def test_sync_view_under_asgi(self):
+        sync = await sync_to_async(self.client.get)(
+            "/api/users/group/", headers=self.headers
+        )
+        await sync_to_async(self.setUp)()
+        response = await self.async_client.get(
+            "/api/users/group/", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timed_queries(response), self.timed_queries(sync))
+
+    async def test_async_route(self):
+        before = await sync_to_async(self.scraped_requests)("user-permission-list")
+        with override_settings(ROOT_URLCONF=async_urlconf()):
+            response = await self.async_client.get(
+                "/api/users/user-permission/", headers=self.headers
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.timed_queries(response), 0)
+        self.assertEqual(
+            await sync_to_async(self.scraped_requests)("user-permission-list"),
+            before + 1,
+        )
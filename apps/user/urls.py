@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 from rest_framework_simplejwt.views import (
@@ -6,7 +7,7 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView,
 )
 
-from . import views
+from . import async_views, views
 
 router = routers.SimpleRouter()
 router.register(r"group", views.GroupViewSet, basename="group")
@@ -16,12 +17,70 @@ router.register(
 )
 router.register(r"user-group", views.UserGroupViewSet, basename="user-group")
 router.register(r"dashboard", views.DashboardViewSet, basename="dashboard")
+router.register(r"db-pool", views.DatabasePoolViewSet, basename="db-pool")
 router.register(r"", views.UserViewSet, basename="custom-auth")
 
 
 urlpatterns = [
-    path("login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("verify/", TokenVerifyView.as_view(), name="token_verify"),
+]
+
+if settings.USER_API_ASYNC:
+    # Under ASGI, serve login and the hot read endpoints from async-native
+    # views (Django's async ORM and cache APIs, no thread hop per request).
+    # Other methods on the same URLs still go to the viewsets.
+    viewset_views = {url.name: url.callback for url in router.urls}
+    urlpatterns += [
+        path(
+            "login/",
+            async_views.read_through(
+                async_views.login,
+                TokenObtainPairView.as_view(),
+                methods=["POST"],
+            ),
+            name="token_obtain_pair",
+        ),
+        path(
+            "",
+            async_views.read_through(
+                async_views.user_list, viewset_views["custom-auth-list"]
+            ),
+            name="custom-auth-list",
+        ),
+        path(
+            "session/",
+            async_views.read_through(
+                async_views.session,
+                viewset_views["custom-auth-session"],
+                methods=["POST"],
+            ),
+            name="custom-auth-session",
+        ),
+        path(
+            "user-permission/",
+            async_views.read_through(
+                async_views.user_permissions, viewset_views["user-permission-list"]
+            ),
+            name="user-permission-list",
+        ),
+        path(
+            "dashboard/",
+            async_views.read_through(
+                async_views.dashboard, viewset_views["dashboard-list"]
+            ),
+            name="dashboard-list",
+        ),
+        path(
+            "<int:pk>/",
+            async_views.read_through(
+                async_views.user_detail, viewset_views["custom-auth-detail"]
+            ),
+            name="custom-auth-detail",
+        ),
+    ]
+
+urlpatterns += [
+    path("login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("", include(router.urls)),
 ]
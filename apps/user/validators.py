@@ -1,9 +1,16 @@
-from PIL import Image
+from typing import Dict, List
+
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+
+from .images import verify_image
+from .models import User
+
+IMPORT_FIELDS = ["username", "email", "password", "first_name", "last_name"]
 
 
 def validate_create_user_form(data):
     errors = {}
-    print(data)
     if data.get("email") is None or data.get("email") == "":
         errors["email"] = "Email is required."
     if data.get("password") is None or data.get("password") == "":
@@ -15,10 +22,9 @@ def validate_create_user_form(data):
     if data.get("last_name") is None or data.get("last_name") == "":
         errors["last_name"] = "Last name is required."
     if data.get("image") is not None:
-        try:
-            Image.open(data.get("image"))
-        except (IOError, OSError):
-            errors["image"] = "Invalid image format."
+        image_error = verify_image(data.get("image"))
+        if image_error:
+            errors["image"] = image_error
     return errors
 
 
@@ -30,8 +36,59 @@ def validate_admin_update_user(data):
     if data.get("last_name") is None or data.get("last_name") == "":
         errors["last_name"] = "Last name is required."
     if data.get("image") is not None:
-        try:
-            Image.open(data.get("image"))
-        except (IOError, OSError):
-            errors["image"] = "Invalid image format."
+        image_error = verify_image(data.get("image"))
+        if image_error:
+            errors["image"] = image_error
     return errors
+
+
+def validate_import_rows(rows: List[Dict]) -> Dict[int, Dict[str, str]]:
+    """
+    Validate every row of a bulk user import up front.
+
+    Each row gets the same checks as a single create, plus a username
+    format check (bulk_create skips model validation) and uniqueness
+    checks against the other rows and against existing users, the latter
+    in a single IN query.
+
+    Returns a dict of row index to field errors; empty when all rows pass.
+    """
+    username_validator = UnicodeUsernameValidator()
+    row_errors = {}
+    seen_usernames = {}
+
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            row_errors[index] = {"row": "Each row must be an object."}
+            continue
+        errors = validate_create_user_form(row)
+        username = row.get("username")
+        if username:
+            try:
+                username_validator(username)
+            except ValidationError as e:
+                errors["username"] = e.messages[0]
+            if username in seen_usernames:
+                errors["username"] = f"Duplicate of row {seen_usernames[username]}."
+            else:
+                seen_usernames[username] = index
+        if errors:
+            row_errors[index] = errors
+
+    for index, errors in existing_username_errors(seen_usernames).items():
+        row_errors.setdefault(index, {}).update(errors)
+    return dict(sorted(row_errors.items()))
+
+
+def existing_username_errors(row_indexes: Dict[str, int]) -> Dict[int, Dict[str, str]]:
+    """
+    Report the usernames of ``row_indexes`` (username to row index) that
+    are already taken, in a single IN query.
+    """
+    existing = User.objects.filter(username__in=list(row_indexes)).values_list(
+        "username", flat=True
+    )
+    return {
+        row_indexes[username]: {"username": "A user with that username already exists."}
+        for username in existing
+    }
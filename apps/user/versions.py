@@ -0,0 +1,252 @@
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from apps.user.cache import CacheStats
+from apps.user.models import User
+from apps.user.routers import read_from_primary
+
+TABLE_VERSION_KEY = "version:{table}"
+ROW_VERSION_KEY = "version:{table}:{pk}"
+
+catalog_cache_stats = CacheStats()
+
+
+def _cache():
+    return caches[settings.VERSION_CACHE_ALIAS]
+
+
+def _new_version() -> int:
+    # Nanosecond timestamps, as for the permission cache versions: a stamp
+    # recreated after eviction is newer than any the clients hold.
+    return time.time_ns()
+
+
+def _timeout(key: str) -> Optional[int]:
+    # Row stamps expire so that stamps of ids that never change, or never
+    # existed, do not pile up; one recreated after expiry is just newer.
+    # Table stamps are few and kept.
+    return settings.ROW_VERSION_TIMEOUT if key.count(":") > 1 else None
+
+
+def table_version_key(model) -> str:
+    return TABLE_VERSION_KEY.format(table=model._meta.db_table)
+
+
+def row_version_key(model, pk) -> str:
+    return ROW_VERSION_KEY.format(table=model._meta.db_table, pk=pk)
+
+
+def user_version_keys(pk) -> List[str]:
+    """
+    Stamps a user's detail representation depends on: the user's row and
+    the groups and permissions it embeds.
+    """
+    return [
+        row_version_key(User, pk),
+        table_version_key(Group),
+        table_version_key(Permission),
+    ]
+
+
+def get_versions(keys: List[str]) -> List[int]:
+    """
+    Return the version stamps stored under ``keys``, creating missing ones.
+    """
+    cache = _cache()
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = _new_version()
+        for key in missing:
+            cache.add(key, version, timeout=_timeout(key))
+        stored = cache.get_many(missing)
+        for key in missing:
+            versions[key] = stored.get(key, version)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(keys: List[str]) -> List[int]:
+    """
+    Async version of get_versions().
+    """
+    cache = _cache()
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = _new_version()
+        for key in missing:
+            await cache.aadd(key, version, timeout=_timeout(key))
+        stored = await cache.aget_many(missing)
+        for key in missing:
+            versions[key] = stored.get(key, version)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(keys: Iterable[str]):
+    """
+    Give ``keys`` new stamps once the current transaction commits.
+
+    Bumping earlier would let a concurrent request pair the new stamp with
+    the data from before the commit, which clients would then keep.
+    """
+    by_timeout = defaultdict(list)
+    for key in keys:
+        by_timeout[_timeout(key)].append(key)
+
+    def bump():
+        for timeout, group in by_timeout.items():
+            _cache().set_many({key: _new_version() for key in group}, timeout=timeout)
+
+    if by_timeout:
+        transaction.on_commit(bump)
+
+
+def bump_tables(*models):
+    bump_versions(table_version_key(model) for model in models)
+
+
+def bump_rows(model, pks: Iterable):
+    bump_versions(row_version_key(model, pk) for pk in pks)
+
+
+def _media_format(request) -> str:
+    renderer = getattr(request, "accepted_renderer", None)
+    return renderer.format if renderer else "json"
+
+
+def _version_tag(request, versions: List[int]) -> str:
+    return "%s-%s" % (_media_format(request), "-".join("%x" % v for v in versions))
+
+
+def _etag(request, versions: List[int]) -> str:
+    return '"%s"' % _version_tag(request, versions)
+
+
+def _read_context(versions: List[int]):
+    # A replica may not have caught up with a change this recent; reading
+    # it there would pair the new stamp with the old data.
+    age = time.time_ns() - max(versions)
+    if settings.DATABASE_REPLICAS and age < settings.DATABASE_REPLICA_PIN_SECONDS * 1e9:
+        return read_from_primary()
+    return nullcontext()
+
+
+def _add_etag(response, etag: str):
+    # No Last-Modified: at one-second resolution it would call a change
+    # made within the second of the client's copy Not Modified.
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        # Authenticated data: browsers may keep it, but must revalidate.
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_response(request, versions: List[int], respond: Callable):
+    """
+    Return 304 Not Modified when the client's ETag matches ``versions``,
+    else ``respond()``, with the ETag either way.
+    """
+    etag = _etag(request, versions)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        with _read_context(versions):
+            response = respond()
+    return _add_etag(response, etag)
+
+
+async def aconditional_response(request, versions: List[int], respond: Callable):
+    """
+    Async version of conditional_response(); ``respond`` is awaited.
+    """
+    etag = _etag(request, versions)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        with _read_context(versions):
+            response = await respond()
+    return _add_etag(response, etag)
+
+
+def parse_pk(value) -> Optional[int]:
+    """
+    Return the integer primary key in a URL, or None if it is not one
+    (so "042" and "42" cannot get separate stamps).
+    """
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return None
+    return pk if str(pk) == str(value) else None
+
+
+def cached_response(request, versions: List[int], respond: Callable):
+    """
+    Return the rendered JSON response cached for ``request.path`` under
+    ``versions``, or ``respond()`` and cache its content once rendered.
+
+    Hits are plain HttpResponses built from the stored bytes, so neither
+    the ORM nor the serializers run. Entries are never invalidated: a bump
+    changes the key and old entries expire after CATALOG_CACHE_TIMEOUT.
+    Other formats (the browsable API renders per-user forms) are not
+    cached.
+    """
+    if _media_format(request) != "json":
+        return respond()
+    cache = caches[settings.CATALOG_CACHE_ALIAS]
+    key = "response:%s:%s" % (request.path, _version_tag(request, versions))
+    cached = cache.get(key)
+    if cached is not None:
+        catalog_cache_stats.hit()
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+
+    catalog_cache_stats.miss()
+    response = respond()
+    if response.status_code == 200:
+        response.add_post_render_callback(
+            lambda rendered: cache.set(
+                key,
+                (rendered.content, rendered["Content-Type"]),
+                timeout=settings.CATALOG_CACHE_TIMEOUT,
+            )
+        )
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answer list/retrieve requests with 304 Not Modified while none of the
+    ``version_models`` tables changed since the client's copy, before the
+    view queries the database or serializes anything.
+
+    With ``cache_list`` set, list responses are also served from the
+    catalog cache (see cached_response()).
+
+    The table stamps are bumped by the signal handlers in apps.user.signals.
+    """
+
+    version_models: List[type] = []
+    cache_list = False
+
+    def get_versions(self) -> List[int]:
+        return get_versions([table_version_key(model) for model in self.version_models])
+
+    def list(self, request, *args, **kwargs):
+        versions = self.get_versions()
+        respond = partial(super().list, request, *args, **kwargs)
+        if self.cache_list:
+            respond = partial(cached_response, request, versions, respond)
+        return conditional_response(request, versions, respond)
+
+    def retrieve(self, request, *args, **kwargs):
+        respond = partial(super().retrieve, request, *args, **kwargs)
+        return conditional_response(request, self.get_versions(), respond)
@@ -1,29 +1,50 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth.models import Group, Permission, PermissionsMixin
-from django.db.models import Count
-from django.db.models.functions import TruncMonth
-from django.utils import timezone
-from datetime import timedelta
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import (
+    exceptions,
     permissions,
     serializers,
     viewsets,
 )
-from rest_framework.decorators import action, permission_classes
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework_simplejwt.models import TokenUser
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from apps.user.cache import get_user_permissions
+from apps.user.dbpool import pool_report
+from apps.user.export import EXPORT_FORMATS, iter_user_rows
+from apps.user.filters import ORDERING_FIELDS, UserFilter, UserOrderingFilter
+from apps.user.images import schedule_avatar_processing
+from apps.user.imports import ImportConflict, import_users, read_import_rows
+from apps.user.pagination import UserCursorPagination
 from apps.user.permissions import CustomPermission
+from apps.user.rollup import signup_series, total_signups
+from apps.user.versions import (
+    ConditionalGetMixin,
+    conditional_response,
+    get_versions,
+    parse_pk,
+    user_version_keys,
+)
 from apps.user.validators import (
     validate_admin_update_user,
     validate_create_user_form,
+    validate_import_rows,
 )
 
-from .models import User
+from .models import SignupRollup, User, get_history_user
 from .serializers import (
     GroupSerializer,
     MyTokenObtainPairSerializer,
     UserSerializer,
     UserSerializerWithNames,
+    UserValuesSerializer,
     PermissionSerializer,
 )
 
@@ -37,35 +58,76 @@ class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 
+def visible_users(queryset, user):
+    """
+    Hide superusers from everyone but superusers.
+    """
+    if not user.is_superuser:
+        queryset = queryset.filter(is_superuser=False)
+    return queryset
+
+
+def permission_codenames(permissions):
+    # Sorted: the permission set has no order of its own.
+    return sorted(permission_item.split(".")[1] for permission_item in permissions)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     queryset = User.objects.all()
     http_method_names = ["get", "post"]
+    pagination_class = UserCursorPagination
+    filter_backends = [DjangoFilterBackend, UserOrderingFilter]
+    filterset_class = UserFilter
+    ordering_fields = ORDERING_FIELDS
+    permission_classes = [CustomPermission]
+    ordering = UserCursorPagination.ordering
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "retrieve":
+            queryset = UserSerializerWithNames.setup_eager_loading(queryset)
+        return queryset
 
-    @permission_classes([CustomPermission])
     def list(self, request, *args, **kwargs):
         """
-        List all users.
+        List users one cursor page at a time.
+
+        Filter with ``is_active``, ``is_staff``, ``group`` (id),
+        ``date_joined_after``/``date_joined_before``, ``username`` and
+        ``email`` (case-insensitive), search with ``search`` and sort with
+        ``ordering`` (see apps.user.filters).
         """
-        user = request.user
-        if not user.is_superuser:
-            queryset = User.objects.filter(is_superuser=False)
-        else:
-            queryset = self.get_queryset()
-        serialized_data = UserSerializerWithNames(
-            queryset, many=True, context={"request": request}
+        queryset = visible_users(
+            self.filter_queryset(self.get_queryset()), request.user
+        )
+        # Same payloads as UserSerializerWithNames, from values() rows.
+        page = self.paginate_queryset(UserValuesSerializer.values(queryset))
+        serialized_data = UserValuesSerializer(
+            UserValuesSerializer.load(page), context={"request": request}
         ).data
-        return Response(serialized_data)
+        return self.get_paginated_response(serialized_data)
 
-    @permission_classes([CustomPermission])
     def retrieve(self, request, *args, **kwargs):
+        """
+        Return one user, or 304 Not Modified while the client's ETag still
+        matches (see apps.user.versions).
+        """
+        respond = partial(self.render_user, request)
+        pk = parse_pk(kwargs.get("pk"))
+        if pk is None:
+            return respond()
+        return conditional_response(
+            request, get_versions(user_version_keys(pk)), respond
+        )
+
+    def render_user(self, request):
         current_user = super().get_object()
         serialized_data = UserSerializerWithNames(
             current_user, many=False, context={"request": request}
         ).data
         return Response(serialized_data)
 
-    @permission_classes([CustomPermission])
     def create(self, request, *args, **kwargs):
         data = request.data
         errors = validate_create_user_form(data)
@@ -84,10 +146,10 @@ class UserViewSet(viewsets.ModelViewSet):
             new_user.save()
         except Exception as e:
             raise serializers.ValidationError({"detail": str(e)})
+        schedule_avatar_processing(new_user)
         serialized_user = UserSerializerWithNames(new_user, many=False)
         return Response(serialized_user.data)
 
-    @permission_classes([CustomPermission])
     def post(self, request, *args, **kwargs):
         data = request.data
         errors = validate_admin_update_user(data)
@@ -98,9 +160,75 @@ class UserViewSet(viewsets.ModelViewSet):
         current_user.last_name = data.get("last_name", current_user.last_name)
         current_user.image = data.get("image", current_user.image)
         current_user.save()
+        if data.get("image") is not None:
+            schedule_avatar_processing(current_user)
         serialized_data = UserSerializerWithNames(current_user, many=False).data
         return Response(serialized_data)
 
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="import",
+        permission_classes=[CustomPermission],
+    )
+    def bulk_import(self, request):
+        """
+        Create many users from a JSON array or an uploaded CSV ``file``.
+
+        Every row is validated before anything is written; if any row fails,
+        nothing is created and the errors are reported per row index.
+        """
+        try:
+            rows = read_import_rows(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        if not rows:
+            return Response({"detail": "No users provided."}, status=400)
+        if len(rows) > settings.USER_IMPORT_MAX_ROWS:
+            return Response(
+                {
+                    "detail": "At most "
+                    f"{settings.USER_IMPORT_MAX_ROWS} users can be imported at once."
+                },
+                status=400,
+            )
+
+        row_errors = validate_import_rows(rows)
+        if row_errors:
+            return Response({"detail": row_errors}, status=400)
+
+        try:
+            users = import_users(rows, history_user=get_history_user(request))
+        except ImportConflict as e:
+            return Response({"detail": e.row_errors}, status=400)
+        return Response({"created": len(users)}, status=201)
+
+    @action(detail=False, methods=["GET"], permission_classes=[CustomPermission])
+    def export(self, request):
+        """
+        Stream every user as NDJSON (default) or CSV.
+
+        Use ``?export_format=csv`` for CSV. Rows are read in chunks from a
+        server-side cursor and written out as they are produced, so the
+        response never holds the whole table in memory.
+        """
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"detail": f"Unsupported export format '{export_format}'."},
+                status=400,
+            )
+        content_type, encoder = EXPORT_FORMATS[export_format]
+
+        queryset = visible_users(User.objects.all(), request.user)
+        rows = iter_user_rows(queryset, settings.USER_EXPORT_CHUNK_SIZE)
+
+        response = StreamingHttpResponse(encoder(rows), content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="users.{export_format}"'
+        )
+        return response
+
     @action(
         detail=False, methods=["POST"], permission_classes=[permissions.IsAuthenticated]
     )
@@ -111,22 +239,31 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=["POST"], permission_classes=[permissions.AllowAny])
     def session(self, request):
         user = request.user
+        if not user.is_authenticated:
+            # No credentials: there is no profile to serialize.
+            raise exceptions.NotAuthenticated()
+        if isinstance(user, TokenUser):
+            # Stateless auth: the token has no profile fields to serialize.
+            user = User.objects.get(pk=user.pk)
         serialized_user = UserSerializer(user, many=False).data
         return Response(serialized_user)
 
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing group instances.
     """
 
     serializer_class = GroupSerializer
-    queryset = Group.objects.all()
+    # GroupSerializer renders every group's permission ids.
+    queryset = Group.objects.prefetch_related("permissions")
     http_method_names = ["get", "post", "put"]
     permission_classes = [CustomPermission]
+    version_models = [Group]
+    cache_list = True
 
 
-class PermissionViewSet(viewsets.ModelViewSet):
+class PermissionViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing permission instances.
     """
@@ -135,25 +272,38 @@ class PermissionViewSet(viewsets.ModelViewSet):
     queryset = Permission.objects.all()
     http_method_names = ["get", "post", "put"]
     permission_classes = [CustomPermission]
+    version_models = [Permission]
+    cache_list = True
 
     def update(self, request, pk=None):
         """
         Update user permissions.
         """
-        user = User.objects.get(pk=pk)
+        user = User.objects.filter(pk=pk).first()
         if not user:
             return Response({"detail": "User not found."}, status=404)
         permissions = request.data.get("permissions", [])
         if not permissions:
             return Response({"detail": "No permissions provided."}, status=400)
+        if not isinstance(permissions, list):
+            return Response({"detail": "Permissions must be a list."}, status=400)
 
-        # Clear existing permissions
-        user.user_permissions.clear()
-
-        # Assign new permissions
+        # Resolve every codename in a single IN query
+        permission_ids = dict(
+            Permission.objects.filter(codename__in=permissions).values_list(
+                "codename", "id"
+            )
+        )
         for perm in permissions:
-            permission = Permission.objects.get(codename=perm)
-            user.user_permissions.add(permission)
+            if perm not in permission_ids:
+                return Response(
+                    {"detail": f"Permission '{perm}' does not exist."}, status=400
+                )
+
+        # set() diffs against the current permissions and only deletes/inserts
+        # the delta, each in one bulk statement on the through table.
+        with transaction.atomic():
+            user.user_permissions.set(permission_ids.values())
 
         return Response({"detail": "Permissions updated successfully."})
 
@@ -168,18 +318,15 @@ class UserPermissionViewSet(viewsets.ViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return user.get_all_permissions()
+        return get_user_permissions(user)
 
     def list(self, request):
         """
         List all permissions for the authenticated user.
         """
         user = request.user
-        permissions = user.get_all_permissions()
-        permission_list = [
-            permission_item.split(".")[1] for permission_item in permissions
-        ]
-        return Response(permission_list)
+        permissions = get_user_permissions(user)
+        return Response(permission_codenames(permissions))
 
 
 class UserGroupViewSet(viewsets.ViewSet):
@@ -198,33 +345,76 @@ class UserGroupViewSet(viewsets.ViewSet):
         """
         Update user groups.
         """
-        user = User.objects.get(pk=pk)
+        user = User.objects.filter(pk=pk).first()
         if not user:
             return Response({"detail": "User not found."}, status=404)
         groups = request.data.get("groups", [])
         if not groups:
             return Response({"detail": "No groups provided."}, status=400)
 
-        # Clear existing permissions
         if not isinstance(groups, list):
             return Response({"detail": "Groups must be a list."}, status=400)
-        # Validate that all provided groups exist
+        # Resolve and validate all provided groups in a single IN query
+        group_ids = dict(
+            Group.objects.filter(name__in=groups).values_list("name", "id")
+        )
         for group_name in groups:
-            if not Group.objects.filter(name=group_name).exists():
+            if group_name not in group_ids:
                 return Response(
                     {"detail": f"Group '{group_name}' does not exist."}, status=400
                 )
-        # Clear existing groups
-        user.groups.clear()
 
-        # Assign new groups
-        for group_name in groups:
-            group_instance = Group.objects.get(name=group_name)
-            user.groups.add(group_instance)
+        # set() diffs against the current groups and only deletes/inserts
+        # the delta, each in one bulk statement on the through table.
+        with transaction.atomic():
+            user.groups.set(group_ids.values())
 
         return Response({"detail": "Groups updated successfully."})
 
 
+MAX_DASHBOARD_BUCKETS = 366
+
+
+def parse_dashboard_params(query_params):
+    """
+    Return the ``(period, buckets)`` requested from the dashboard.
+
+    Raises ValueError with a message for the client on bad input.
+    """
+    period = query_params.get("period", SignupRollup.MONTH)
+    if period not in dict(SignupRollup.PERIOD_CHOICES):
+        raise ValueError(f"Unknown period '{period}'.")
+    try:
+        buckets = int(query_params.get("buckets", 6))
+    except ValueError:
+        raise ValueError("Buckets must be an integer.")
+    if not 1 <= buckets <= MAX_DASHBOARD_BUCKETS:
+        raise ValueError(f"Buckets must be between 1 and {MAX_DASHBOARD_BUCKETS}.")
+    return period, buckets
+
+
+def dashboard_data(period, series, total_users, total_groups):
+    # Months keep the historical "%Y-%m-02" labels the frontend expects.
+    date_format = "%Y-%m-02" if period == SignupRollup.MONTH else "%Y-%m-%d"
+    user_data = [
+        {"date": start.strftime(date_format), "amount": amount}
+        for start, amount in series
+    ]
+    return {
+        "stats": [
+            {
+                "title": "Total Users",
+                "content": total_users,
+            },
+            {
+                "title": "Groups",
+                "content": total_groups,
+            },
+        ],
+        "graph": user_data,
+    }
+
+
 class DashboardViewSet(viewsets.ViewSet):
     """
     A viewset for retrieving dashboard statistics.
@@ -235,53 +425,36 @@ class DashboardViewSet(viewsets.ViewSet):
     def list(self, request):
         """
         Retrieve dashboard statistics.
+
+        ``?period=day|week|month`` (default month) and ``?buckets=N``
+        (default 6) select the signup graph range. Everything is read from
+        the signup rollup, so the cost depends on the number of buckets
+        rather than the number of users.
         """
-        total_users = User.objects.count()
-        total_groups = Group.objects.count()
-
-        six_months_ago = timezone.now() - timedelta(days=180)
-
-        # Query users joined in the last 6 months, grouped by month
-        users_by_month = (
-            User.objects.filter(date_joined__gte=six_months_ago)
-            .annotate(month=TruncMonth("date_joined"))
-            .values("month")
-            .annotate(count=Count("id"))
-            .order_by("month")
+        try:
+            period, buckets = parse_dashboard_params(request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        data = dashboard_data(
+            period,
+            signup_series(period, buckets),
+            total_signups(),
+            Group.objects.count(),
         )
+        return Response(data)
 
-        # Format the response
-        user_data_dict = {
-            item["month"].strftime("%Y-%m-02"): item["count"]
-            for item in users_by_month
-            if item["month"]
-        }
-
-        # Add missing months with amount=0
-        current_date = (timezone.now().replace(day=1)).replace(day=1)
-        user_data = []
-        for _ in range(6):
-            date_str = current_date.strftime("%Y-%m-02")
-            user_data.insert(
-                0,
-                {
-                    "date": date_str,
-                    "amount": user_data_dict.get(date_str, 0),
-                },
-            )
-            current_date -= timedelta(days=current_date.day)
 
-        data = {
-            "stats": [
-                {
-                    "title": "Total Users",
-                    "content": total_users,
-                },
-                {
-                    "title": "Groups",
-                    "content": total_groups,
-                },
-            ],
-            "graph": user_data,
-        }
-        return Response(data)
+class DatabasePoolViewSet(viewsets.ViewSet):
+    """
+    A viewset for inspecting the database connection pool.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        """
+        Usage counters of the connection pools of the worker process that
+        served the request (each process has its own pools).
+        """
+        return Response(pool_report())
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+_pools: Dict[str, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _mp_context():
+    """
+    Start workers from a clean process rather than by forking the server.
+
+    A forked child would inherit the parent's database connections and
+    connection pool (whose maintenance threads do not survive the fork);
+    using or even garbage-collecting them there would close the parent's
+    sessions.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def _init_worker():
+    """
+    Configure Django in a freshly started worker process.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+
+    django.setup()
+
+
+def get_pool(name: str, max_workers: int) -> ProcessPoolExecutor:
+    """
+    Return the named process pool, creating it on first use.
+
+    CPU-bound work (password hashing, image processing) holds the GIL, so
+    it runs in separate processes to use every core and keep request
+    threads responsive. Each kind of work gets its own pool so a burst of
+    one cannot starve the other.
+    """
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+            )
+        return _pools[name]
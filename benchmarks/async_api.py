@@ -0,0 +1,120 @@
+"""
+Requests per second of the hot read endpoints, WSGI viewsets vs ASGI
+async views.
+
+* wsgi: the DRF viewsets through Django's WSGI handler, one thread per
+  concurrent client, as under gunicorn with threaded workers;
+* asgi: the async views (USER_API_ASYNC) through Django's ASGI handler,
+  all concurrent clients on one event loop, as under uvicorn.
+
+Requests are made in-process (Django's test clients), so network and
+server overhead are left out and what is compared is the request path
+inside Django. Each mode runs in its own process because the URLconf
+depends on USER_API_ASYNC.
+
+Usage (needs a configured database with a superuser):
+
+    python benchmarks/async_api.py [requests] [concurrency]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = [
+    "/api/users/",
+    "/api/users/user-permission/",
+    "/api/users/dashboard/",
+]
+
+
+def setup(mode: str):
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    os.environ["USER_API_ASYNC"] = "true" if mode == "asgi" else "false"
+
+    import django
+
+    django.setup()
+
+
+def auth_header() -> dict:
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from apps.user.models import User
+    from apps.user.serializers import MyTokenObtainPairSerializer
+
+    user = User.objects.filter(is_superuser=True).order_by("id").first()
+    if user is None:
+        sys.exit("No superuser in the database; create one first.")
+    token: RefreshToken = MyTokenObtainPairSerializer.get_token(user)
+    return {"Authorization": f"Bearer {token.access_token}"}
+
+
+def run_wsgi(path: str, requests: int, concurrency: int, headers: dict) -> float:
+    from django.test import Client
+
+    def worker(count: int):
+        client = Client()
+        for _ in range(count):
+            assert client.get(path, headers=headers).status_code == 200
+
+    per_worker = requests // concurrency
+    worker(1)  # warm up
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, [per_worker] * concurrency))
+    return per_worker * concurrency / (time.perf_counter() - start)
+
+
+def run_asgi(path: str, requests: int, concurrency: int, headers: dict) -> float:
+    from django.test import AsyncClient
+
+    async def worker(count: int):
+        client = AsyncClient()
+        for _ in range(count):
+            response = await client.get(path, headers=headers)
+            assert response.status_code == 200
+
+    async def main():
+        per_worker = requests // concurrency
+        await worker(1)  # warm up
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+        return per_worker * concurrency / (time.perf_counter() - start)
+
+    return asyncio.run(main())
+
+
+def run_mode(mode: str, requests: int, concurrency: int):
+    setup(mode)
+    headers = auth_header()
+    run = run_wsgi if mode == "wsgi" else run_asgi
+    for path in PATHS:
+        rps = run(path, requests, concurrency, headers)
+        print(f"{mode:>4} {path:<30} {rps:8.1f} req/s")
+
+
+def main():
+    """
+    Run both modes in subprocesses and print their throughput.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] in ("wsgi", "asgi"):
+        run_mode(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+        return
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    for mode in ("wsgi", "asgi"):
+        subprocess.run(
+            [sys.executable, __file__, mode, str(requests), str(concurrency)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
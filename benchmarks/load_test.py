@@ -0,0 +1,463 @@
+"""
+Load test every route under /api/users/ against a running server.
+
+Each route is hit with ``--requests`` requests from ``--concurrency``
+threads, each keeping its own HTTP connection alive. Per route it
+reports requests per second, p50/p95/p99 latency and the mean number
+of SQL queries per request, read from the Server-Timing header (start
+the server with REQUEST_METRICS=True to get it). Results go to a JSON
+file tagged with the current commit so runs can be compared.
+
+Typical use, with a seeded database (``manage.py seed_users 1000000``)
+and a superuser to log in as:
+
+    REQUEST_METRICS=True <your WSGI/ASGI server> &
+    python benchmarks/load_test.py --username admin --password ... \\
+        --concurrency 32 --requests 2000 --output before.json
+    python benchmarks/load_test.py ... --output after.json
+    python benchmarks/load_test.py --compare before.json after.json
+
+``--serve`` starts ``manage.py runserver`` itself for a quick local run.
+Only the standard library is used, so it runs from any environment.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+@dataclass
+class Route:
+    name: str
+    method: str
+    # Returns (path, body) for the n-th request.
+    request: Callable[[int], tuple]
+    # Cap for expensive routes, e.g. the full-table export.
+    max_requests: Optional[int] = None
+    authenticated: bool = True
+
+
+@dataclass
+class Result:
+    route: str
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    queries: List[int] = field(default_factory=list)
+    statuses: dict = field(default_factory=dict)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "rps": round(self.requests / self.seconds, 1) if self.seconds else 0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "queries_per_request": (
+                round(statistics.mean(self.queries), 2) if self.queries else None
+            ),
+        }
+
+
+def percentile(values: List[float], pct: int) -> Optional[float]:
+    """
+    Nearest-rank percentile of sorted ``values``, in milliseconds.
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return round(values[rank] * 1000, 2)
+
+
+class Client:
+    """
+    One keep-alive HTTP connection.
+    """
+
+    def __init__(self, base_url: str, token: Optional[str] = None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.token = token
+        self.connection = None
+
+    def request(self, method: str, path: str, body=None, authenticated=True):
+        headers = {"Accept": "application/json"}
+        if self.token and authenticated:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=60
+                )
+            try:
+                self.connection.request(
+                    method, self.prefix + path, body=payload, headers=headers
+                )
+                response = self.connection.getresponse()
+                data = response.read()
+                return response.status, response.getheader("Server-Timing"), data
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the kept-alive connection; reconnect.
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+    def json(self, method: str, path: str, body=None):
+        status, _, data = self.request(method, path, body)
+        if status >= 400:
+            sys.exit(f"{method} {path} failed with {status}: {data[:200]!r}")
+        return json.loads(data)
+
+
+def build_routes(client: Client, username: str, password: str) -> List[Route]:
+    """
+    Every route under /api/users/, with ids looked up from the server.
+    Writes use unique names per run so repeated runs do not collide.
+    """
+    run = uuid.uuid4().hex[:8]
+    users = client.json("GET", "/api/users/?page_size=100")["results"]
+    if not users:
+        sys.exit("No users to benchmark with; run manage.py seed_users first.")
+    user_ids = [user["id"] for user in users]
+    groups = client.json("GET", "/api/users/group/")
+    group_ids = [group["id"] for group in groups]
+    group_names = [group["name"] for group in groups]
+    permissions = client.json("GET", "/api/users/permission/")
+    permission_ids = [permission["id"] for permission in permissions]
+    codenames = [permission["codename"] for permission in permissions]
+    content_type = permissions[0]["content_type"]
+    tokens = client.json(
+        "POST", "/api/users/login/", {"username": username, "password": password}
+    )
+    refresh = tokens["refresh"]
+    access = tokens["access"]
+
+    def pick(values, n, count=1):
+        return [values[(n + i) % len(values)] for i in range(count)]
+
+    def new_user(n):
+        return {
+            "username": f"bench-{run}-{n}",
+            "email": f"bench-{run}-{n}@example.com",
+            "password": "bench-password-123",
+            "first_name": "Bench",
+            "last_name": "User",
+        }
+
+    return [
+        Route(
+            "login",
+            "POST",
+            lambda n: (
+                "/api/users/login/",
+                {"username": username, "password": password},
+            ),
+            authenticated=False,
+        ),
+        Route(
+            "refresh",
+            "POST",
+            lambda n: ("/api/users/refresh/", {"refresh": refresh}),
+            authenticated=False,
+        ),
+        Route(
+            "verify",
+            "POST",
+            lambda n: ("/api/users/verify/", {"token": access}),
+            authenticated=False,
+        ),
+        Route("session", "POST", lambda n: ("/api/users/session/", None)),
+        Route("logout", "POST", lambda n: ("/api/users/logout/", None)),
+        Route("user-list", "GET", lambda n: ("/api/users/", None)),
+        Route(
+            "user-list-500",
+            "GET",
+            lambda n: ("/api/users/?" + urlencode({"page_size": 500}), None),
+        ),
+        Route(
+            "user-detail",
+            "GET",
+            lambda n: (f"/api/users/{pick(user_ids, n)[0]}/", None),
+        ),
+        Route("user-create", "POST", lambda n: ("/api/users/", new_user(n))),
+        Route(
+            "user-import",
+            "POST",
+            lambda n: (
+                "/api/users/import/",
+                [new_user(f"{n}-{i}") for i in range(10)],
+            ),
+        ),
+        Route(
+            "user-export",
+            "GET",
+            lambda n: ("/api/users/export/", None),
+            max_requests=5,
+        ),
+        Route(
+            "user-permission", "GET", lambda n: ("/api/users/user-permission/", None)
+        ),
+        Route("dashboard", "GET", lambda n: ("/api/users/dashboard/", None)),
+        Route("group-list", "GET", lambda n: ("/api/users/group/", None)),
+        Route(
+            "group-detail",
+            "GET",
+            lambda n: (f"/api/users/group/{pick(group_ids, n)[0]}/", None),
+        ),
+        Route(
+            "group-create",
+            "POST",
+            lambda n: (
+                "/api/users/group/",
+                {
+                    "name": f"bench-{run}-{n}",
+                    "permissions": pick(permission_ids, n, 10),
+                },
+            ),
+        ),
+        Route(
+            "group-update",
+            "PUT",
+            lambda n: (
+                f"/api/users/group/{group_ids[0]}/",
+                {"name": group_names[0], "permissions": pick(permission_ids, n, 10)},
+            ),
+        ),
+        Route("permission-list", "GET", lambda n: ("/api/users/permission/", None)),
+        Route(
+            "permission-detail",
+            "GET",
+            lambda n: (f"/api/users/permission/{pick(permission_ids, n)[0]}/", None),
+        ),
+        Route(
+            "permission-create",
+            "POST",
+            lambda n: (
+                "/api/users/permission/",
+                {
+                    "name": f"Bench {run} {n}",
+                    "codename": f"bench_{run}_{n}",
+                    "content_type": content_type,
+                },
+            ),
+        ),
+        Route(
+            "user-permissions-update",
+            "PUT",
+            lambda n: (
+                f"/api/users/permission/{pick(user_ids, n)[0]}/",
+                {"permissions": pick(codenames, n, 5)},
+            ),
+        ),
+        Route(
+            "user-groups-update",
+            "PUT",
+            lambda n: (
+                f"/api/users/user-group/{pick(user_ids, n)[0]}/",
+                {"groups": pick(group_names, n, 2)},
+            ),
+        ),
+        Route("db-pool", "GET", lambda n: ("/api/users/db-pool/", None)),
+    ]
+
+
+def run_route(
+    route: Route, base_url: str, token: str, requests: int, concurrency: int
+) -> Result:
+    result = Result(route.name)
+    lock = threading.Lock()
+    counter = iter(range(min(requests, route.max_requests or requests)))
+    local = threading.local()
+
+    def worker():
+        client = local.__dict__.setdefault("client", Client(base_url, token))
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            path, body = route.request(n)
+            start = time.perf_counter()
+            try:
+                status, timing, _ = client.request(
+                    route.method, path, body, route.authenticated
+                )
+            except (OSError, http.client.HTTPException):
+                status, timing = "error", None
+            elapsed = time.perf_counter() - start
+            with lock:
+                result.requests += 1
+                result.latencies.append(elapsed)
+                result.statuses[str(status)] = result.statuses.get(str(status), 0) + 1
+                if status == "error" or status >= 400:
+                    result.errors += 1
+                match = QUERIES.search(timing or "")
+                if match:
+                    result.queries.append(int(match.group(1)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def serve(port: int) -> subprocess.Popen:
+    """
+    Start ``manage.py runserver`` with request metrics on and wait for it.
+    """
+    env = dict(os.environ, REQUEST_METRICS="True")
+    server = subprocess.Popen(
+        [sys.executable, "manage.py", "runserver", "--noreload", f"127.0.0.1:{port}"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            http.client.HTTPConnection("127.0.0.1", port, timeout=1).request(
+                "HEAD", "/api/users/"
+            )
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit("The development server did not start.")
+
+
+def compare(before_path: str, after_path: str):
+    """
+    Print the change of each route's metrics between two result files.
+    """
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'route':<24} {'rps':>17} {'p95 ms':>19} {'p99 ms':>19} {'queries':>13}")
+    for name, new in after["routes"].items():
+        old = before["routes"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for key, width in (
+            ("rps", 17),
+            ("p95_ms", 19),
+            ("p99_ms", 19),
+            ("queries_per_request", 13),
+        ):
+            a, b = old.get(key), new.get(key)
+            if a is None or b is None:
+                cells.append(f"{'-':>{width}}")
+            elif a:
+                cells.append(f"{a:>7} {b:>7} {(b - a) / a:+.0%}".rjust(width))
+            else:
+                cells.append(f"{a:>7} {b:>7}".rjust(width))
+        print(f"{name:<24} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default=os.environ.get("BENCH_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("BENCH_PASSWORD"))
+    parser.add_argument("--requests", type=int, default=500, help="Per route.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--routes", help="Comma-separated route names to run.")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--serve", action="store_true", help="Start runserver.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not (args.username and args.password):
+        parser.error("--username and --password (of a superuser) are required.")
+
+    server = None
+    if args.serve:
+        server = serve(urlsplit(args.url).port or 80)
+    try:
+        client = Client(args.url)
+        token = client.json(
+            "POST",
+            "/api/users/login/",
+            {"username": args.username, "password": args.password},
+        )["access"]
+        client.token = token
+        routes = build_routes(client, args.username, args.password)
+        if args.routes:
+            wanted = set(args.routes.split(","))
+            routes = [route for route in routes if route.name in wanted]
+
+        report = {
+            "commit": git_commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "url": args.url,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "routes": {},
+        }
+        for route in routes:
+            result = run_route(route, args.url, token, args.requests, args.concurrency)
+            summary = report["routes"][route.name] = result.summary()
+            print(
+                f"{route.name:<24} {summary['rps']:>8} req/s  "
+                f"p50 {summary['p50_ms']} p95 {summary['p95_ms']} "
+                f"p99 {summary['p99_ms']} ms  "
+                f"queries {summary['queries_per_request']}  "
+                f"errors {summary['errors']}"
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the token-issuing half of POST /api/users/login/.
+
+Password checking is left out on purpose: it is identical before and
+after and would drown out the difference. What is measured is everything
+MyTokenObtainPairSerializer.validate() does once the user is known:
+
+* before: sign a refresh/access pair, then let UserSerializerWithToken
+  sign a second access token for the user payload;
+* after: sign one pair and reuse its access token for the payload.
+
+Usage (needs a configured database with at least one user):
+
+    python benchmarks/login_tokens.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+from apps.user.models import User  # noqa: E402
+from apps.user.serializers import (  # noqa: E402
+    MyTokenObtainPairSerializer,
+    UserSerializerWithToken,
+)
+
+
+def issue_tokens_before(user: User) -> dict:
+    """
+    Replay the login pipeline as it was: two access tokens signed.
+    """
+    refresh = MyTokenObtainPairSerializer.get_token(user)
+    data = {"refresh": str(refresh), "access": str(refresh.access_token)}
+    # The old get_token() called RefreshToken.for_user() a second time.
+    second_access = str(RefreshToken.for_user(user).access_token)
+    payload = UserSerializerWithToken(
+        user, context={"access_token": second_access}
+    ).data
+    data.update(payload)
+    return data
+
+
+def issue_tokens_after(user: User) -> dict:
+    """
+    Current pipeline: one signed pair, access token reused in the payload.
+    """
+    refresh = MyTokenObtainPairSerializer.get_token(user)
+    data = {"refresh": str(refresh), "access": str(refresh.access_token)}
+    payload = UserSerializerWithToken(
+        user, context={"access_token": data["access"]}
+    ).data
+    data.update(payload)
+    return data
+
+
+def main():
+    """
+    Time both pipelines and print the per-login cost.
+    """
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    user = User.objects.order_by("id").first()
+    if user is None:
+        sys.exit("No users in the database; create one first.")
+
+    for label, pipeline in (
+        ("before", issue_tokens_before),
+        ("after", issue_tokens_after),
+    ):
+        pipeline(user)  # warm up caches and imports
+        seconds = timeit.timeit(lambda: pipeline(user), number=iterations)
+        print(f"{label:>6}: {seconds / iterations * 1e6:8.1f} us/login")
+
+
+if __name__ == "__main__":
+    main()
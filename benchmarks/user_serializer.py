@@ -0,0 +1,83 @@
+"""
+Time to serialize and render users for the user list, model serializer vs
+values() serializer.
+
+* model: UserSerializerWithNames over prefetched User instances, as the
+  list endpoints did;
+* values: UserValuesSerializer over values() rows with their groups and
+  permissions attached by load(), as they do now.
+
+Both include their queries and JSON rendering; the rendered bytes are
+checked to be identical before anything is timed.
+
+Usage (needs a configured database with at least ``rows`` users, e.g.
+from ``manage.py seed_users 10000``):
+
+    python benchmarks/user_serializer.py [rows] [repeat]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+
+from apps.user.models import User  # noqa: E402
+from apps.user.serializers import (  # noqa: E402
+    UserSerializerWithNames,
+    UserValuesSerializer,
+)
+
+
+def render_model(queryset, request) -> bytes:
+    users = UserSerializerWithNames.setup_eager_loading(queryset)
+    data = UserSerializerWithNames(users, many=True, context={"request": request}).data
+    return JSONRenderer().render(data)
+
+
+def render_values(queryset, request) -> bytes:
+    rows = UserValuesSerializer.load(list(UserValuesSerializer.values(queryset)))
+    data = UserValuesSerializer(rows, context={"request": request}).data
+    return JSONRenderer().render(data)
+
+
+def best_of(repeat: int, render, queryset, request) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(queryset.all(), request)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    ids = list(User.objects.order_by("id").values_list("id", flat=True)[:rows])
+    if len(ids) < rows:
+        sys.exit(f"Only {len(ids)} users in the database; seed {rows} first.")
+    queryset = User.objects.filter(id__in=ids).order_by("id")
+    request = Request(RequestFactory().get("/api/users/"))
+
+    if render_model(queryset.all(), request) != render_values(queryset.all(), request):
+        sys.exit("The two serializers rendered different payloads.")
+
+    model = best_of(repeat, render_model, queryset, request)
+    values = best_of(repeat, render_values, queryset, request)
+    print(f"{rows} users, best of {repeat}")
+    print(f"model  {model * 1000:9.1f} ms")
+    print(f"values {values * 1000:9.1f} ms  ({model / values:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -52,10 +52,13 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt",
     "corsheaders",
     "simple_history",
+    "django_filters",
 ]
 
 MIDDLEWARE = [
+    "apps.user.metrics.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "apps.user.routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -64,6 +67,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "simple_history.middleware.HistoryRequestMiddleware",
+    "apps.user.middleware.BufferedHistoryMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -98,9 +102,57 @@ DATABASES = {
         "PASSWORD": env("DATABASE_PASSWORD", default="postgres"),
         "HOST": env("DATABASE_HOST", default="localhost"),
         "PORT": env("DATABASE_PORT", default="5432"),
+        # Checked when a connection is taken from the pool (or reused, when
+        # not pooling), so a connection the server dropped is replaced
+        # instead of failing the request.
+        "CONN_HEALTH_CHECKS": env.bool("DATABASE_HEALTH_CHECKS", default=True),
     }
 }
 
+# Connection pooling (psycopg[pool], see apps.user.dbpool). Each worker
+# process keeps up to DATABASE_POOL_MAX_SIZE connections; a request thread
+# (or, under ASGI, the thread running the ORM call) checks one out when it
+# first queries and returns it when the request finishes, waiting at most
+# DATABASE_POOL_TIMEOUT seconds when all are in use. Size the pool for the
+# worker's threads: max_size x processes must stay below max_connections.
+DATABASE_POOL = env.bool("DATABASE_POOL", default=False)
+if DATABASE_POOL:
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": env.int("DATABASE_POOL_MIN_SIZE", default=2),
+            "max_size": env.int("DATABASE_POOL_MAX_SIZE", default=10),
+            "timeout": env.float("DATABASE_POOL_TIMEOUT", default=10.0),
+            "max_idle": env.float("DATABASE_POOL_MAX_IDLE", default=600.0),
+            "max_lifetime": env.float("DATABASE_POOL_MAX_LIFETIME", default=3600.0),
+        }
+    }
+
+# Read replicas (see apps.user.routers): safe requests read from a random
+# replica unless the client wrote within DATABASE_REPLICA_PIN_SECONDS.
+# Each URL gets an alias replica1, replica2, ...; DATABASE_LOCAL_REPLICA
+# adds one pointing at the primary itself, a stand-in for trying the
+# routing locally. Tests treat replicas as mirrors of the test database.
+_replica_configs = [
+    env.db_url_config(url) for url in env.list("DATABASE_REPLICA_URLS", default=[])
+]
+if env.bool("DATABASE_LOCAL_REPLICA", default=False):
+    _replica_configs.append({})
+DATABASE_REPLICAS = []
+for _index, _config in enumerate(_replica_configs, start=1):
+    DATABASES[f"replica{_index}"] = {
+        **DATABASES["default"],
+        "OPTIONS": dict(DATABASES["default"].get("OPTIONS", {})),
+        **_config,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{_index}")
+DATABASE_ROUTERS = ["apps.user.routers.ReplicaRouter"] if DATABASE_REPLICAS else []
+DATABASE_REPLICA_PIN_SECONDS = env.int("DATABASE_REPLICA_PIN_SECONDS", default=10)
+DATABASE_REPLICA_PIN_COOKIE = "db_pin"
+DATABASE_REPLICA_PIN_CACHE_ALIAS = env(
+    "DATABASE_REPLICA_PIN_CACHE_ALIAS", default="default"
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -141,6 +193,87 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+    # User images, stored once per distinct content (see apps.user.storage)
+    "images": {"BACKEND": "apps.user.storage.ContentAddressedStorage"},
+}
+# Media serving (see apps.user.media.serve_media). MEDIA_SENDFILE hands the
+# transfer to the front proxy: "x-accel-redirect" (nginx, with an internal
+# location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or
+# "x-sendfile" (Apache mod_xsendfile, lighttpd). Empty serves from Python.
+MEDIA_SENDFILE = env.str("MEDIA_SENDFILE", default="")
+MEDIA_ACCEL_REDIRECT_PREFIX = env.str(
+    "MEDIA_ACCEL_REDIRECT_PREFIX", default="/protected-media/"
+)
+MEDIA_CACHE_MAX_AGE = env.int("MEDIA_CACHE_MAX_AGE", default=3600)
+# Unreferenced image blobs younger than this are kept by gc_media, so an
+# upload is not collected before the user row pointing at it is saved.
+MEDIA_GC_GRACE_HOURS = env.int("MEDIA_GC_GRACE_HOURS", default=24)
+
+# Avatar processing (see apps.user.images)
+AVATAR_FORMATS = ["JPEG", "PNG", "WEBP", "GIF"]
+AVATAR_MAX_PIXELS = env.int("AVATAR_MAX_PIXELS", default=25_000_000)
+AVATAR_THUMBNAIL_SIZES = {"small": 80, "medium": 256}
+AVATAR_THUMBNAIL_FORMAT = env.str("AVATAR_THUMBNAIL_FORMAT", default="WEBP")
+IMAGE_WORKERS = env.int("IMAGE_WORKERS", default=2)
+
+
+# History retention (see the prune_history and partition_history commands)
+HISTORY_RETENTION_DAYS = env.int("HISTORY_RETENTION_DAYS", default=365)
+HISTORY_PRUNE_BATCH_SIZE = env.int("HISTORY_PRUNE_BATCH_SIZE", default=5000)
+HISTORY_PRUNE_PAUSE = env.float("HISTORY_PRUNE_PAUSE", default=0.1)
+HISTORY_PARTITION_MONTHS_AHEAD = env.int("HISTORY_PARTITION_MONTHS_AHEAD", default=3)
+
+# Buffered history writing (see apps.user.history_buffer): collect a
+# request's historical rows and bulk insert them when it finishes, or
+# append them to a local queue drained by the flush_history_queue command.
+HISTORY_BUFFERING = env.bool("HISTORY_BUFFERING", default=False)
+HISTORY_BUFFER_BATCH_SIZE = env.int("HISTORY_BUFFER_BATCH_SIZE", default=500)
+HISTORY_QUEUE_PATH = env("HISTORY_QUEUE_PATH", default="")
+
+# Admin changelist counts (see apps.user.pagination.EstimatedCountPaginator)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = env.int(
+    "ADMIN_ESTIMATED_COUNT_THRESHOLD", default=100000
+)
+ADMIN_COUNT_TIMEOUT_MS = env.int("ADMIN_COUNT_TIMEOUT_MS", default=150)
+
+# Per-request query count and timings (see apps.user.metrics), served in
+# the Prometheus text format at /metrics and, with SERVER_TIMING, sent to
+# clients in a Server-Timing header. Set METRICS_TOKEN to require it as a
+# bearer token on /metrics.
+REQUEST_METRICS = env.bool("REQUEST_METRICS", default=False)
+SERVER_TIMING = env.bool("SERVER_TIMING", default=True)
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (e.g. redis://) when running more than one worker
+# process, otherwise signal-driven invalidations stay process-local.
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+    # Rendered group/permission lists (see apps.user.versions). Keys carry
+    # the shared version stamps, so a per-process local-memory cache is
+    # safe; point it at a shared backend to fill it once for all processes.
+    "catalog": env.cache("CATALOG_CACHE_URL", default="locmemcache://catalog"),
+}
+
+# Cross-request cache of user.get_all_permissions() (see apps.user.cache)
+PERMISSION_CACHE_ALIAS = env("PERMISSION_CACHE_ALIAS", default="default")
+PERMISSION_CACHE_TIMEOUT = env.int("PERMISSION_CACHE_TIMEOUT", default=3600)
+# Change stamps behind the ETags of users, groups and permissions (see
+# apps.user.versions). Like the permission cache, it must be shared by
+# every process, or a process can answer 304 for data changed elsewhere.
+VERSION_CACHE_ALIAS = env("VERSION_CACHE_ALIAS", default="default")
+ROW_VERSION_TIMEOUT = env.int("ROW_VERSION_TIMEOUT", default=86400)
+CATALOG_CACHE_ALIAS = env("CATALOG_CACHE_ALIAS", default="catalog")
+CATALOG_CACHE_TIMEOUT = env.int("CATALOG_CACHE_TIMEOUT", default=3600)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -149,15 +282,56 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "user.User"
 
+# Stateless mode trusts the claims signed into the access token instead of
+# loading the user on every request (see apps.user.authentication).
+JWT_STATELESS_AUTH = env.bool("JWT_STATELESS_AUTH", default=False)
+# Larger permission claims are left out of tokens and looked up instead.
+JWT_PERMISSION_CLAIM_MAX_BYTES = env.int("JWT_PERMISSION_CLAIM_MAX_BYTES", default=1024)
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        (
+            "apps.user.authentication.StatelessJWTAuthentication"
+            if JWT_STATELESS_AUTH
+            else "apps.user.authentication.JWTAuthentication"
+        ),
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
 }
 
+# Serve the hot read endpoints from async views (ASGI deployments only;
+# under WSGI every async view would need its own event loop).
+USER_API_ASYNC = env.bool("USER_API_ASYNC", default=False)
+
+# User list pagination (see apps.user.pagination.UserCursorPagination)
+USER_LIST_PAGE_SIZE = env.int("USER_LIST_PAGE_SIZE", default=50)
+USER_LIST_MAX_PAGE_SIZE = env.int("USER_LIST_MAX_PAGE_SIZE", default=500)
+# Rows fetched per server-side cursor round trip by the user export
+USER_EXPORT_CHUNK_SIZE = env.int("USER_EXPORT_CHUNK_SIZE", default=2000)
+# Bulk user import (see apps.user.imports)
+USER_IMPORT_BATCH_SIZE = env.int("USER_IMPORT_BATCH_SIZE", default=1000)
+USER_IMPORT_MAX_ROWS = env.int("USER_IMPORT_MAX_ROWS", default=50000)
+# Worker processes used to hash passwords (see apps.user.hashing)
+PASSWORD_HASH_WORKERS = env.int("PASSWORD_HASH_WORKERS", default=os.cpu_count() or 1)
+# Check login passwords in a bounded process pool (see apps.user.backends);
+# logins beyond PASSWORD_VERIFY_QUEUE_SIZE in flight get a 429.
+PASSWORD_VERIFY_POOL = env.bool("PASSWORD_VERIFY_POOL", default=False)
+PASSWORD_VERIFY_WORKERS = env.int(
+    "PASSWORD_VERIFY_WORKERS", default=os.cpu_count() or 1
+)
+PASSWORD_VERIFY_QUEUE_SIZE = env.int(
+    "PASSWORD_VERIFY_QUEUE_SIZE", default=PASSWORD_VERIFY_WORKERS * 8
+)
+AUTHENTICATION_BACKENDS = [
+    (
+        "apps.user.backends.PooledPasswordBackend"
+        if PASSWORD_VERIFY_POOL
+        else "django.contrib.auth.backends.ModelBackend"
+    ),
+]
+
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=2),
@@ -180,14 +354,14 @@ SIMPLE_JWT = {
     "USER_AUTHENTICATION_RULE": "rest_framework_simplejwt.authentication.default_user_authentication_rule",
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "apps.user.authentication.ClaimsUser",
     "JTI_CLAIM": "jti",
     "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
     # "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
     "TOKEN_OBTAIN_SERIALIZER": "apps.user.serializers.MyTokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "apps.user.serializers.MyTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
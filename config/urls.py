@@ -15,17 +15,25 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.staticfiles.storage import staticfiles_storage
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.views.generic.base import RedirectView
 
+from apps.user.media import serve_media
+from apps.user.metrics import metrics_view
+
 urlpatterns = [
     path(
         "favicon.ico", RedirectView.as_view(url=staticfiles_storage.url("favicon.ico"))
     ),
     path("admin/", admin.site.urls),
     path("api/users/", include("apps.user.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("metrics", metrics_view, name="metrics"),
+    re_path(
+        r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")), serve_media
+    ),
+]